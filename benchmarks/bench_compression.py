@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares uploading a synthetic telemetry CSV as it is against compressing it
+on the fly (gzip, and zstd if the zstandard package is installed), over the
+stand-in Drive from stand_in_drive.py with a simulated bandwidth. Reports the
+bytes sent, the time taken and how fast each compressor runs on its own with
+1 thread and with one per CPU.
+
+Usage: python benchmarks/bench_compression.py [rows] [bandwidth_mbps]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from oauth2client import client, file as oauth_file
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import compression  # pylint: disable=C0413
+import remote_storage  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+from stand_in_drive import DISCOVERY_PATH, StandInDrive, serve  # pylint: disable=C0413
+import synthetic  # pylint: disable=C0413
+
+
+def compress_only(compressor, path):
+    """
+    :returns: a tuple of (seconds taken, compressed size)
+    """
+    start = time.perf_counter()
+    size = sum(len(block) for block in compressor.stream(path))
+    return time.perf_counter() - start, size
+
+
+def upload(drive, path):
+    """
+    :returns: a tuple of (seconds taken, bytes the server received)
+    """
+    received = StandInDrive.bytes_received
+    start = time.perf_counter()
+    drive.upload_file(path)
+    return time.perf_counter() - start, StandInDrive.bytes_received - received
+
+
+def main():
+    """
+    Time each way of uploading the file
+    """
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    bandwidth = (float(sys.argv[2]) if len(sys.argv) > 2 else 10.0) * 1e6
+    threads = os.cpu_count() or 1
+    methods = [compression.GZIP] + ([compression.ZSTD] if compression.zstd_available() else [])
+    base = serve(0.02, bandwidth)
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "channel.csv")
+        synthetic.write_data_file(path, 4, 1000.0, rows / 1000.0, rows / 4000.0)
+        size = os.path.getsize(path)
+        print("{:,} rows ({:.1f} MB), {:.0f} MB/s link".format(rows, size / 1e6, bandwidth / 1e6))
+
+        for method in methods:
+            for count in sorted({1, threads}):
+                elapsed, compressed = compress_only(compression.Compressor(method, threads=count),
+                                                    path)
+                print("  {:28s} {:7.3f} s  {:7.1f} MB/s  {:5.1%} of the original".format(
+                    "compress " + method + ", " + str(count) + " thread(s)", elapsed,
+                    size / 1e6 / elapsed, compressed / size))
+
+        credentials_path = os.path.join(work, "drive.credentials")
+        oauth_file.Storage(credentials_path).put(client.AccessTokenCredentials("token", "bench"))
+        baseline = None
+        for method in [None] + methods:
+            compressor = None if method is None else compression.Compressor(method)
+            drive = remote_storage.GoogleDrive(Logger(), credentials_path=credentials_path,
+                                               discovery_uri=base + DISCOVERY_PATH[1:],
+                                               compressor=compressor)
+            elapsed, sent = upload(drive, path)
+            baseline = baseline or elapsed
+            print("  {:28s} {:7.3f} s  {:7.1f} MB sent  {:5.2f}x".format(
+                "upload " + (method or "uncompressed"), elapsed, sent / 1e6, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares csv_reader.read_csv against numpy.genfromtxt on synthetic telemetry
+files. Each reader runs in a fresh process, and the benchmark reports its
+wall-clock time and how far it pushed that process's peak resident memory.
+
+Usage: python benchmarks/bench_csv.py [rows ...]
+"""
+
+import os
+import sys
+import tempfile
+import resource
+import time
+from multiprocessing import get_context
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import csv_reader  # pylint: disable=C0413
+
+DEFAULT_ROWS = (1000000, 4000000)
+
+
+def write_channel(path, rows, rate=10000.0):
+    """
+    Write a synthetic two-column (time, value) telemetry channel to a CSV file
+
+    :param path: path of the CSV file to create
+    :param rows: number of samples to write
+    :param rate: sample rate in Hz
+    """
+    block = 1000000
+    with open(path, "w") as csv_file:
+        for start in range(0, rows, block):
+            time_base = np.arange(start, min(start + block, rows)) / rate
+            values = 500 * np.sin(time_base) + np.random.normal(0, 5, len(time_base))
+            np.savetxt(csv_file, np.column_stack((time_base, values)),
+                       delimiter=",", fmt="%.6f")
+
+
+def _run(reader, path, queue):
+    """
+    Child process body: time one read and report the growth in peak RSS
+    """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    arr = reader(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    queue.put((elapsed, peak * 1024, arr.nbytes))
+
+
+def measure(label, reader, path):
+    """
+    Run a reader once in a fresh process and print its time and memory use
+    """
+    context = get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(reader, path, queue))
+    process.start()
+    elapsed, peak, nbytes = queue.get()
+    process.join()
+    print("  {:<28} {:8.2f} s {:9.1f} MB peak {:9.1f} MB result".format(
+        label, elapsed, peak / 1e6, nbytes / 1e6))
+
+
+def read_genfromtxt(path):
+    """
+    The reader echo.py used before csv_reader existed
+    """
+    return np.genfromtxt(path, delimiter=",", dtype=float)
+
+
+def read_single(path):
+    """
+    read_csv with one parser thread
+    """
+    return csv_reader.read_csv(path)
+
+
+def read_threaded(path):
+    """
+    read_csv with one parser thread per CPU
+    """
+    return csv_reader.read_csv(path, threads=os.cpu_count() or 1)
+
+
+def read_float32(path):
+    """
+    read_csv storing 32-bit floats
+    """
+    return csv_reader.read_csv(path, dtype=np.float32, threads=os.cpu_count() or 1)
+
+
+def read_one_column(path):
+    """
+    read_csv keeping only the value column
+    """
+    return csv_reader.read_csv(path, columns=[1], threads=os.cpu_count() or 1)
+
+
+def main():
+    """
+    Generate each file size and compare the readers on it
+    """
+    rows_list = [int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS
+    threads = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in rows_list:
+            path = os.path.join(tmpdir, "channel.csv")
+            # Write from a child process so the parent's peak RSS, which each
+            # spawned reader inherits, stays at its post-import baseline
+            writer = get_context("spawn").Process(target=write_channel, args=(path, rows))
+            writer.start()
+            writer.join()
+            print("{:,} rows ({:.1f} MB)".format(rows, os.path.getsize(path) / 1e6))
+            measure("genfromtxt float64", read_genfromtxt, path)
+            measure("read_csv float64, 1 thread", read_single, path)
+            measure("read_csv float64, {} threads".format(threads), read_threaded, path)
+            measure("read_csv float32, {} threads".format(threads), read_float32, path)
+            measure("read_csv column 1 only", read_one_column, path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares one request per item against GoogleDrive's batched metadata
+requests, for folder creation and for the --verify lookups of files the
+ledger says are already uploaded, against the local stand-in Drive from
+bench_drive_startup.py. Some batched requests are made to fail with HTTP 503
+so the per-item retries are exercised too.
+
+Usage: python benchmarks/bench_drive_batch.py [round_trip_ms] [items] [failure_rate]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from oauth2client import client, file as oauth_file
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remote_storage  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+from upload_ledger import UploadLedger, file_md5  # pylint: disable=C0413
+from stand_in_drive import DISCOVERY_PATH, StandInDrive, serve  # pylint: disable=C0413
+
+
+def timed(function, *args):
+    """
+    :returns: a tuple of (seconds taken, result, HTTP requests made)
+    """
+    requests = StandInDrive.requests
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result, StandInDrive.requests - requests
+
+
+def report(label, elapsed, requests, baseline=None):
+    """
+    Print one line of results
+    """
+    line = "  {:32s} {:7.3f} s  {:4d} request(s)".format(label, elapsed, requests)
+    if baseline is not None:
+        line += "  {:5.2f}x".format(baseline / elapsed)
+    print(line)
+
+
+def main():
+    """
+    Time each operation one item at a time and batched
+    """
+    round_trip = (float(sys.argv[1]) if len(sys.argv) > 1 else 50.0) / 1000
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    base = serve(round_trip)
+    remote_storage.GoogleDrive.RETRY_BASE_DELAY = round_trip
+    with tempfile.TemporaryDirectory() as work:
+        credentials_path = os.path.join(work, "drive.credentials")
+        oauth_file.Storage(credentials_path).put(client.AccessTokenCredentials("token", "bench"))
+        ledger = UploadLedger(os.path.join(work, "echo.ledger"))
+        drive = remote_storage.GoogleDrive(Logger(), credentials_path=credentials_path,
+                                           ledger=ledger,
+                                           discovery_uri=base + DISCOVERY_PATH[1:])
+        print("{:.0f} ms round trip, {} items, {:.0%} of batched requests fail and are retried"
+              .format(round_trip * 1000, items, failure_rate))
+
+        names = ["EchoBench-" + str(index) for index in range(items)]
+        single, folder_ids, requests = timed(lambda: [drive.create_folder(name)
+                                                      for name in names])
+        report("create_folder x " + str(items), single, requests)
+        StandInDrive.batch_failure_rate = failure_rate
+        batched, batch_ids, requests = timed(drive.create_folders, names)
+        report("create_folders", batched, requests, single)
+        if None in batch_ids:
+            print("  WARNING: " + str(batch_ids.count(None)) + " folder(s) not created")
+
+        # Pretend each folder is an uploaded file, then verify them all
+        paths = []
+        for index, folder_id in enumerate(folder_ids):
+            path = os.path.join(work, "file" + str(index))
+            with open(path, "w") as data_file:
+                data_file.write("0" * index)
+            StandInDrive.files[folder_id]["md5Checksum"] = file_md5(path)
+            ledger.record(path, file_md5(path), folder_id)
+            paths.append(path)
+        StandInDrive.batch_failure_rate = 0.0
+
+        def one_at_a_time():
+            for path in paths:
+                with drive.http_pool.connection() as connection:
+                    drive.DRIVE_SERVICE.files().get(
+                        fileId=ledger.lookup(path)["id"],
+                        fields="md5Checksum,trashed").execute(http=connection)
+        single, _, requests = timed(one_at_a_time)
+        report("files().get x " + str(items), single, requests)
+        StandInDrive.batch_failure_rate = failure_rate
+        batched, pending, requests = timed(drive.pending_uploads, paths, True)
+        report("pending_uploads(verify=True)", batched, requests, single)
+        if pending:
+            print("  WARNING: " + str(len(pending)) + " file(s) not confirmed")
+
+
+if __name__ == "__main__":
+    main()
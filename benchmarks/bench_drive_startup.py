@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Measures how long it takes to connect to Google Drive and make the first few
+API calls, against the local stand-in for the Drive API in stand_in_drive.py,
+which adds a simulated round trip time to every request and a few more to
+every new connection (for the TCP and TLS handshakes). Compares:
+
+  - the old startup, where discovery.build fetched and parsed the discovery
+    document on every run over a fresh httplib2.Http
+  - GoogleDrive with an empty discovery cache (first run) and a warm one
+  - a batch of metadata lookups each made over a fresh authorized
+    httplib2.Http, against the same lookups over GoogleDrive's HttpPool
+
+Needs google-api-python-client and oauth2client, but no Google account.
+
+Usage: python benchmarks/bench_drive_startup.py [round_trip_ms] [lookups]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import httplib2
+from googleapiclient import discovery, http
+from oauth2client import client, file as oauth_file
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remote_storage  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+from upload_ledger import DiscoveryCache  # pylint: disable=C0413
+from stand_in_drive import (DISCOVERY_PATH, HANDSHAKE_ROUND_TRIPS,  # pylint: disable=C0413
+                            StandInDrive, serve)
+
+
+def timed(function, *args):
+    """
+    :returns: a tuple of (seconds taken, result, new connections opened)
+    """
+    connections = StandInDrive.connections
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result, StandInDrive.connections - connections
+
+
+def old_startup(base, credentials):
+    """
+    The old GoogleDrive.__init__: build the service from a freshly fetched
+    discovery document, then create a folder
+    """
+    service = discovery.build("drive", "v3", http=credentials.authorize(httplib2.Http()),
+                              discoveryServiceUrl=base + DISCOVERY_PATH[1:],
+                              static_discovery=False, cache_discovery=False)
+    return service.files().create(body={"name": "bench"}, fields="id").execute()
+
+
+def new_startup(base, credentials_path, cache_path):
+    """
+    GoogleDrive's startup with a discovery cache, then a folder creation
+    """
+    drive = remote_storage.GoogleDrive(Logger(), credentials_path=credentials_path,
+                                       discovery_cache=DiscoveryCache(cache_path),
+                                       discovery_uri=base + DISCOVERY_PATH[1:])
+    drive.create_folder("bench")
+    return drive
+
+
+def fresh_lookups(drive, file_ids):
+    """
+    Look up each file over its own new authorized httplib2.Http
+    """
+    for file_id in file_ids:
+        drive.DRIVE_SERVICE.files().get(fileId=file_id).execute(
+            http=drive.CREDENTIALS.authorize(http.build_http()))
+
+
+def pooled_lookups(drive, file_ids):
+    """
+    Look up each file over a connection borrowed from the drive's HttpPool
+    """
+    for file_id in file_ids:
+        with drive.http_pool.connection() as connection:
+            drive.DRIVE_SERVICE.files().get(fileId=file_id).execute(http=connection)
+
+
+def main():
+    """
+    Time each kind of startup and lookup batch
+    """
+    round_trip = (float(sys.argv[1]) if len(sys.argv) > 1 else 50.0) / 1000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    base = serve(round_trip)
+    with tempfile.TemporaryDirectory() as work:
+        credentials = client.AccessTokenCredentials("token", "bench")
+        credentials_path = os.path.join(work, "drive.credentials")
+        oauth_file.Storage(credentials_path).put(credentials)
+        cache_path = os.path.join(work, "echo.discovery")
+        print("{:.0f} ms round trip, {} round trips per new connection".format(
+            round_trip * 1000, HANDSHAKE_ROUND_TRIPS))
+
+        baseline, _, connections = timed(old_startup, base, credentials)
+        print("  {:28s} {:7.3f} s  {:2d} connection(s)".format(
+            "old startup", baseline, connections))
+        for label in ("startup, empty cache", "startup, warm cache"):
+            elapsed, drive, connections = timed(new_startup, base, credentials_path, cache_path)
+            print("  {:28s} {:7.3f} s  {:2d} connection(s)  {:5.2f}x".format(
+                label, elapsed, connections, baseline / elapsed))
+
+        file_ids = [drive.create_folder("bench" + str(index)) for index in range(lookups)]
+        fresh, _, fresh_connections = timed(fresh_lookups, drive, file_ids)
+        pooled, _, connections = timed(pooled_lookups, drive, file_ids)
+        print("  {:28s} {:7.3f} s  {:2d} connection(s)".format(
+            str(lookups) + " lookups, fresh Http", fresh, fresh_connections))
+        print("  {:28s} {:7.3f} s  {:2d} connection(s)  {:5.2f}x".format(
+            str(lookups) + " lookups, pooled", pooled, connections, fresh / pooled))
+
+
+if __name__ == "__main__":
+    main()
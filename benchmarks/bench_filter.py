@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares filters.FilterBank, which filters every matching channel of a file
+in one sosfiltfilt call with a cached design, against the old per-channel
+path (a fresh ba design and filtfilt for each channel). Also reports how far
+apart the two outputs are, at the filter the old echo.py test code used and
+at a higher order, lower cutoff filter where the ba form loses precision.
+
+Usage: python benchmarks/bench_filter.py [channels] [samples_per_channel]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import filters  # pylint: disable=C0413
+import plotting  # pylint: disable=C0413
+
+SPECS = ("butter:5:0.0066667", "butter:8:0.002")
+
+
+def make_channels(channels, samples):
+    """
+    Build a ChannelSet of synthetic telemetry sampled at 1 kHz
+    """
+    rng = np.random.RandomState(0)
+    data = np.empty((samples, channels + 1), order="F")
+    data[:, 0] = np.arange(samples) / 1000.0
+    for index in range(channels):
+        data[:, index + 1] = 100 * np.sin(data[:, 0] * (index + 1)) + rng.normal(0, 2, samples)
+    return plotting.ChannelSet("bench", data)
+
+
+def per_channel(channels, spec):
+    """
+    The old path: design the filter in ba form and run filtfilt once per channel
+    """
+    results = []
+    for dataset in channels:
+        numerator, denominator = signal.butter(spec.order, spec.cutoff, output='ba')
+        results.append(signal.filtfilt(numerator, denominator, dataset.ylist))
+    return np.column_stack(results)
+
+
+def batched(channels, bank):
+    """
+    The new path: one sosfiltfilt call over every matching channel
+    """
+    return np.column_stack([result[3] for result in bank.filter_channels(channels)])
+
+
+def best_of(function, *args, repeats=3):
+    """
+    :returns: a tuple of (fastest time in seconds, last result)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    """
+    Time both paths for each spec and compare their outputs
+    """
+    channel_count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    channels = make_channels(channel_count, samples)
+    print("{} channels x {:,} samples".format(channel_count, samples))
+    for text in SPECS:
+        bank = filters.FilterBank([filters.parse_rule("*=" + text)])
+        spec = bank.rules[0][1]
+        old_time, old_result = best_of(per_channel, channels, spec)
+        new_time, new_result = best_of(batched, channels, bank)
+        if np.all(np.isfinite(old_result)):
+            accuracy = "max difference {:.3g}".format(np.max(np.abs(old_result - new_result)))
+        else:
+            accuracy = "ba output not finite (unstable design)"
+        print("  {:20s} per-channel ba {:7.2f} s  batched sos {:7.2f} s  {:5.2f}x  {}".format(
+            text, old_time, new_time, old_time / new_time, accuracy))
+
+
+if __name__ == "__main__":
+    main()
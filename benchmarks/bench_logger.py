@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares echo_logger.Logger, which hands messages to a background writer with
+the log file kept open, against the old logger, which printed each message
+and opened, appended to and closed the log file every time. Reports how long
+the logging thread is held up, and how long until everything is on disk.
+Console output goes to /dev/null.
+
+Usage: python benchmarks/bench_logger.py [messages] [threads]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from echo_logger import Logger  # pylint: disable=C0413
+
+
+class OldLogger:
+    """
+    The logger as it was: synchronous print, and the file reopened per message
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def log_verbose(self, message):
+        """
+        Print and append one message
+        """
+        print(message)
+        with open(self.path, "a") as logfile:
+            logfile.write("[" + str(int(time.time())) + "] " + message + "\n")
+
+    def flush(self):
+        """
+        Nothing to wait for
+        """
+
+
+def run(logger, messages, threads):
+    """
+    Log messages from several threads at once, like the upload workers do
+
+    :returns: a tuple of (seconds until the last log call returned, seconds
+    until everything was written)
+    """
+    def work(worker):
+        for index in range(messages // threads):
+            logger.log_verbose("Uploaded chunk " + str(index) + " of worker " + str(worker))
+
+    workers = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logged = time.perf_counter() - start
+    logger.flush()
+    return logged, time.perf_counter() - start
+
+
+def main():
+    """
+    Time each logger
+    """
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    console = sys.stdout
+    with tempfile.TemporaryDirectory() as work, open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            results = [
+                ("old logger", run(OldLogger(os.path.join(work, "old.log")), messages, threads)),
+                ("Logger, text", run(Logger(True, os.path.join(work, "text.log")),
+                                     messages, threads)),
+                ("Logger, JSON lines", run(Logger(True, os.path.join(work, "json.log"), True),
+                                           messages, threads))]
+        finally:
+            sys.stdout = console
+    print("{:,} messages from {} threads".format(messages, threads))
+    baseline = results[0][1][1]
+    for label, (logged, written) in results:
+        print("  {:20s} logging {:6.2f} s  written {:6.2f} s  {:5.2f}x".format(
+            label, logged, written, baseline / written))
+
+
+if __name__ == "__main__":
+    main()
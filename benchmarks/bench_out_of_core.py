@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Measures the peak memory of a whole offline run of echo.py (parse, filter,
+summarise and plot, through echo.process_files) on one large data file, with
+the file handled in memory and out-of-core. Out-of-core, the file is parsed a
+block at a time into a memory-mapped .npy file (the cache's, or a scratch
+file with --no-cache), filtered into a memory-mapped scratch file and
+decimated before plotting, so the peak should stay far below the size of the
+parsed array.
+
+Each run is a separate process, whose anonymous memory (RssAnon: memory that
+isn't a page of some file, and so can't be dropped under pressure) is
+sampled as it goes. Memory-mapped pages are left out of the peak, since the
+kernel reclaims them as needed.
+
+Usage: python benchmarks/bench_out_of_core.py [channels] [duration_s] [rate_hz]
+"""
+
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # pylint: disable=C0413
+
+# How often the child samples its memory use
+SAMPLE_SECONDS = 0.02
+# --filter-memory for each mode, in MB: far above the file for in memory, far
+# below it for out-of-core
+MODES = (("in memory", ["--no-cache", "--filter-memory=100000"]),
+         ("out-of-core, no cache", ["--no-cache", "--filter-memory=64"]),
+         ("out-of-core, cached", ["--filter-memory=64"]))
+
+
+def anonymous_bytes():
+    """
+    :returns: this process's current RssAnon, in bytes
+    """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def child(argv):
+    """
+    Run echo.main with the given arguments in this process, and print its wall
+    time and peak memory use as JSON
+    """
+    import echo
+    peak = [anonymous_bytes()]
+    running = [True]
+
+    def sample():
+        while running[0]:
+            peak[0] = max(peak[0], anonymous_bytes())
+            time.sleep(SAMPLE_SECONDS)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    echo.main(argv)
+    seconds = time.perf_counter() - start
+    running[0] = False
+    sampler.join()
+    print(json.dumps({"seconds": seconds, "peak_anon": max(peak[0], anonymous_bytes()),
+                      "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+
+
+def run(work, options):
+    """
+    Run echo.py offline over work/data in a child process
+
+    :returns: the child's measurements
+    """
+    argv = ["-p", os.path.join(work, "data"), "-o", "-a", "--no-report", "--plot-processes=1",
+            "--filter=*=butter:4:10hz"] + options
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"] + argv,
+                            cwd=work, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    """
+    Generate one large data file and run echo.py over it in each mode
+    """
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2:])
+        return
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 2000.0
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 1000.0
+    work = tempfile.mkdtemp(prefix="echo-bench-")
+    try:
+        data_dir = os.path.join(work, "data")
+        os.makedirs(data_dir)
+        path = os.path.join(data_dir, "SOAK.csv")
+        rows = synthetic.write_data_file(path, channels, rate, duration, duration / 4)
+        array_bytes = rows * (channels + 1) * 8
+        print("{} channels x {:,} samples: {:.0f} MB of CSV, {:.0f} MB parsed".format(
+            channels, rows, os.path.getsize(path) / 1e6, array_bytes / 1e6))
+        print("{:<24}{:>10}{:>16}{:>14}".format("mode", "seconds", "peak anon MB",
+                                                 "max RSS MB"))
+        for name, options in MODES:
+            result = run(work, options)
+            print("{:<24}{:>10.1f}{:>16.0f}{:>14.0f}".format(
+                name, result["seconds"], result["peak_anon"] / 1e6, result["max_rss"] / 1e6))
+            for entry in os.listdir(work):
+                if entry.startswith("EchoPlots-"):
+                    shutil.rmtree(os.path.join(work, entry))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Times plotting.PlotRenderer drawing a batch of synthetic channels with
+1, 2, 4, ... worker processes (up to the number of CPUs), and checks that
+every process count produces byte-identical PDFs.
+
+Usage: python benchmarks/bench_plot.py [channels] [samples_per_channel]
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import plotting  # pylint: disable=C0413
+
+
+class QuietLogger:
+    """
+    Stands in for echo_logger.Logger without printing anything
+    """
+
+    def log(self, message):
+        """
+        Discard a message
+        """
+
+    def log_verbose(self, message):
+        """
+        Discard a verbose message
+        """
+
+
+def make_datasets(channels, samples):
+    """
+    Build synthetic telemetry channels sampled at 1 kHz
+    """
+    rng = np.random.RandomState(0)
+    time_base = np.arange(samples) / 1000.0
+    return [plotting.DataSet("channel{:02d}".format(index), time_base,
+                             100 * np.sin(time_base * (index + 1)) + rng.normal(0, 2, samples))
+            for index in range(channels)]
+
+
+def render_all(datasets, folder, processes):
+    """
+    Draw every dataset with the given number of processes
+
+    :returns: a tuple of (seconds taken, dict of file name to MD5 checksum)
+    """
+    analysis = plotting.DataAnalysis(QuietLogger(), False, folder)
+    start = time.perf_counter()
+    renderer = plotting.PlotRenderer(analysis, processes)
+    for dataset in datasets:
+        renderer.submit(dataset, xlabel="Time (s)", ylabel="Units")
+    paths = renderer.wait()
+    elapsed = time.perf_counter() - start
+    checksums = {}
+    for path in paths:
+        with open(path, "rb") as pdf_file:
+            checksums[os.path.basename(path)] = hashlib.md5(pdf_file.read()).hexdigest()
+    return elapsed, checksums
+
+
+def main():
+    """
+    Render the batch with each process count and report the speedup
+    """
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    datasets = make_datasets(channels, samples)
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    print("{} channels x {:,} samples".format(channels, samples))
+    baseline = None
+    reference = None
+    for processes in counts:
+        with tempfile.TemporaryDirectory() as folder:
+            elapsed, checksums = render_all(datasets, folder, processes)
+        if baseline is None:
+            baseline, reference = elapsed, checksums
+        identical = "identical" if checksums == reference else "DIFFERENT OUTPUT"
+        print("  {:2d} process(es) {:8.2f} s  {:5.2f}x  {}".format(
+            processes, elapsed, baseline / elapsed, identical))
+
+
+if __name__ == "__main__":
+    main()
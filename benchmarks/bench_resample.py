@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Times resample.align putting several files' worth of channels, each file at
+its own jittered sample rate, onto one common grid with every method, against
+a per-channel numpy.interp loop (which has to search the time column again
+for every channel).
+
+Usage: python benchmarks/bench_resample.py [files] [channels_per_file] [samples_per_channel]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import resample  # pylint: disable=C0413
+
+
+def make_groups(files, channels, samples):
+    """
+    Build one (times, values) group per file. Each file has its own nominal
+    rate around 1 kHz, with timestamp jitter of a tenth of a sample
+    """
+    rng = np.random.RandomState(0)
+    groups = []
+    for index in range(files):
+        period = 1.0 / (1000.0 + 37.0 * index)
+        times = np.arange(samples) * period + rng.uniform(-0.1, 0.1, samples) * period
+        times.sort()
+        values = np.empty((samples, channels), dtype=np.float32, order="F")
+        for column in range(channels):
+            values[:, column] = np.sin(times * (column + 1)) + rng.normal(0, 0.05, samples)
+        groups.append((times, values))
+    return groups
+
+
+def per_channel_interp(groups, grid):
+    """
+    The baseline: numpy.interp over each channel in turn
+    """
+    return np.column_stack([np.interp(grid, times, values[:, column])
+                            for times, values in groups for column in range(values.shape[1])])
+
+
+def timed(function, *args, **kwargs):
+    """
+    :returns: a tuple of (seconds taken, result)
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    """
+    Align the channels with each method and report the time taken
+    """
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    samples = int(sys.argv[3]) if len(sys.argv) > 3 else 10000000
+    groups = make_groups(files, channels, samples)
+    print("{} files x {} channels x {:,} samples".format(files, channels, samples))
+    grid = resample.common_grid([times for times, _ in groups])
+    # Load SciPy (for decimate's filter) before anything is timed
+    resample.align([(times[:1000], values[:1000]) for times, values in groups],
+                   method=resample.DECIMATE)
+    baseline, reference = timed(per_channel_interp, groups, grid)
+    print("  {:24s} {:7.2f} s".format("per-channel np.interp", baseline))
+    for method in resample.METHODS:
+        elapsed, (_, aligned) = timed(resample.align, groups, method=method)
+        difference = np.max(np.abs(aligned - reference))
+        print("  {:24s} {:7.2f} s  {:5.2f}x  max difference from interp {:.3g}".format(
+            "align(" + method + ")", elapsed, baseline / elapsed, difference))
+
+
+if __name__ == "__main__":
+    main()
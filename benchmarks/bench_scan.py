@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Compares scanner.scan against the two os.walk passes that find_data and
+find_videos used to make. On a local disk every listing comes from the page
+cache, and scan() pays extra for the stat calls that fill in the manifest, so
+the benchmark also runs with a simulated network share that adds a fixed
+latency to each directory listing (both approaches list through os.scandir).
+
+Usage: python benchmarks/bench_scan.py [directories] [files_per_directory] [latency_ms]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import scanner  # pylint: disable=C0413
+
+EXTENSIONS = (".csv", ".mp4", ".pdf", ".txt", ".log")
+
+
+def make_tree(root, directories, files_per_directory):
+    """
+    Create a nested tree of empty files with a mix of extensions
+    """
+    for dir_index in range(directories):
+        subdir = os.path.join(root, "run{:03d}".format(dir_index // 10),
+                              "stand{:02d}".format(dir_index % 10))
+        os.makedirs(subdir)
+        for file_index in range(files_per_directory):
+            extension = EXTENSIONS[file_index % len(EXTENSIONS)]
+            open(os.path.join(subdir, "f{:05d}{}".format(file_index, extension)), "w").close()
+    open(os.path.join(root, "t0_time.csv"), "w").close()
+
+
+def two_walks(root):
+    """
+    The old approach: one os.walk for data files and another for videos
+    """
+    data = []
+    for subdir, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(".csv") and not name.lower().endswith("t0_time.csv"):
+                data.append(os.path.join(subdir, name))
+    videos = []
+    for subdir, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(scanner.VIDEO_FILE_TYPES):
+                videos.append(os.path.join(subdir, name))
+    return data, videos
+
+
+def best_of(function, repeats=5):
+    """
+    :returns: the fastest of several runs of function, in seconds
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def add_latency(latency):
+    """
+    Make every os.scandir call sleep first, like a listing on a network share
+
+    :param latency: the delay per listing, in seconds
+    """
+    real_scandir = os.scandir
+
+    def slow_scandir(path="."):
+        time.sleep(latency)
+        return real_scandir(path)
+    os.scandir = slow_scandir
+
+
+def report(root, directories, files_per_directory, label):
+    """
+    Time both approaches on the tree and print the results
+    """
+    print("{:,} files in {:,} directories, {}".format(directories * files_per_directory,
+                                                     directories, label))
+    print("  two os.walk passes      {:8.1f} ms".format(best_of(lambda: two_walks(root)) * 1e3))
+    for threads in (1, 4, scanner.DEFAULT_THREADS, 16):
+        print("  scan, {:2d} threads        {:8.1f} ms".format(
+            threads, best_of(lambda: scanner.scan(root, threads)) * 1e3))
+
+
+def main():
+    """
+    Build the tree and time both approaches on it
+    """
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    files_per_directory = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, directories, files_per_directory)
+        data, videos = two_walks(root)
+        manifest = scanner.scan(root)
+        assert sorted(data) == manifest.paths(scanner.DATA)
+        assert sorted(videos) == manifest.paths(scanner.VIDEO)
+        report(root, directories, files_per_directory, "local disk")
+        add_latency(latency_ms / 1e3)
+        report(root, directories, files_per_directory,
+               "{:g} ms per listing".format(latency_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Times how long echo.py takes to start and finish for runs that shouldn't need
+any of its heavy dependencies (--help, and an offline run over a directory
+with nothing to plot), plus an offline run with one small CSV file for
+comparison. Each run is made in a fresh interpreter with "python -X
+importtime", so the report also lists the slowest top-level imports and any
+heavy module that was loaded when it didn't need to be.
+
+Usage: python benchmarks/bench_startup.py [repeats]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ECHO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "echo.py")
+# Modules the quick runs shouldn't import
+HEAVY_MODULES = ("numpy", "scipy", "matplotlib", "googleapiclient", "oauth2client", "httplib2")
+
+
+def run_echo(args, cwd):
+    """
+    Run echo.py once with -X importtime
+
+    :returns: a tuple of (seconds taken, dict of top-level module name to
+    cumulative import time in seconds, set of every module imported)
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-W", "ignore", ECHO] + args,
+                            cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=False)
+    elapsed = time.perf_counter() - start
+    top_level = {}
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name.strip().split(".")[0])
+        # Top-level imports are the ones indented by a single space
+        if name.startswith(" ") and not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative) / 1e6
+    return elapsed, top_level, imported
+
+
+def main():
+    """
+    Time each kind of run and report the slowest imports
+    """
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as work:
+        empty = os.path.join(work, "empty")
+        small = os.path.join(work, "small")
+        os.makedirs(empty)
+        os.makedirs(small)
+        with open(os.path.join(small, "pt.csv"), "w") as csv_file:
+            csv_file.writelines("{:.3f},{:.3f}\n".format(i / 1000.0, i % 97) for i in range(2000))
+        runs = (("--help", ["--help"], True),
+                ("offline, no files", ["-p", empty, "-o"], True),
+                ("offline, one CSV", ["-p", small, "-o", "--no-cache"], False))
+        for label, args, quick in runs:
+            best = None
+            for _ in range(repeats):
+                elapsed, top_level, imported = run_echo(args, work)
+                best = elapsed if best is None else min(best, elapsed)
+            slowest = sorted(top_level.items(), key=lambda item: -item[1])[:3]
+            print("  {:20s} {:7.3f} s   slowest imports: {}".format(
+                label, best, ", ".join("{} {:.3f} s".format(name, seconds)
+                                       for name, seconds in slowest)))
+            heavy = sorted(imported.intersection(HEAVY_MODULES))
+            if quick and heavy:
+                print("  {:20s} WARNING: imported {}".format("", ", ".join(heavy)))
+
+
+if __name__ == "__main__":
+    main()
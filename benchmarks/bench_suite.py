@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Runs Echo's main stages against a synthetic test directory (see synthetic.py)
+and keeps the results, so a slowdown shows up between versions. Times:
+
+  - scanner.scan over the test directory
+  - echo.csv_to_array on the largest data file (without the cache)
+  - ChannelSet.set_t0, and shifting every channel's times to it
+  - a Butterworth filter over every channel of that file
+  - DataAnalysis.plot_dataset drawing one channel
+  - GoogleDrive.upload_file sending a video to the stand-in Drive in
+    stand_in_drive.py, with a simulated round trip time and bandwidth
+
+Each stage is timed several times and the fastest is kept. The results are
+appended to a JSON history file along with the version of Echo (from git
+describe), and compared with the last results from the same machine and
+settings; any stage more than --threshold percent slower is flagged.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--repeats=N] [--round-trip=MS]
+                                        [--bandwidth=MBPS] [--results=PATH]
+                                        [--threshold=PERCENT] [--no-upload]
+"""
+
+import getopt
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import echo  # pylint: disable=C0413
+import scanner  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+import synthetic  # pylint: disable=C0413
+
+# Test directory settings: (data files, channels, sample rates, seconds, videos, video bytes)
+FULL = (8, 8, (1000.0, 5000.0), 60.0, 1, 200 * 1000 * 1000)
+QUICK = (4, 4, (1000.0, 100.0), 20.0, 1, 20 * 1000 * 1000)
+FILTER_RULE = "*=butter:4:50hz"
+# How each kind of rate is printed
+RATE_UNITS = {"mb_per_second": "MB/s", "samples_per_second": "samples/s"}
+
+
+def best_of(function, repeats):
+    """
+    :returns: the fastest of several runs of function, in seconds
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def git_version():
+    """
+    :returns: the output of git describe for the Echo checkout, or "unknown"
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def local_stages(created, work, repeats):
+    """
+    Time the stages that don't touch the network
+
+    :param created: the dict returned by synthetic.make_test_directory
+    :param work: a scratch directory for plots
+    :param repeats: the number of runs to keep the fastest of
+    :returns: a dict of stage name to a dict of results
+    """
+    import filters
+    import plotting
+    root = os.path.dirname(created["t0"][0])
+    data_path = max(created["data"], key=os.path.getsize)
+    size = os.path.getsize(data_path)
+    results = {}
+
+    seconds = best_of(lambda: scanner.scan(root), repeats)
+    results["scan"] = {"seconds": seconds}
+
+    echo.logger = Logger()
+    echo.cache = None
+    seconds = best_of(lambda: echo.csv_to_array(data_path), repeats)
+    results["csv_to_array"] = {"seconds": seconds, "mb_per_second": size / 1e6 / seconds}
+
+    data = echo.csv_to_array(data_path)
+    channels = plotting.ChannelSet("bench", data)
+    samples = data.shape[0] * (data.shape[1] - 1)
+
+    def shift():
+        channels.set_t0(1.0)
+        for dataset in channels:
+            dataset.xlist  # pylint: disable=W0104
+    seconds = best_of(shift, repeats)
+    results["set_t0"] = {"seconds": seconds, "samples_per_second": samples / seconds}
+
+    bank = filters.FilterBank()
+    bank.add(FILTER_RULE)
+    seconds = best_of(lambda: bank.filter_channels(channels), repeats)
+    results["filter"] = {"seconds": seconds, "samples_per_second": samples / seconds}
+
+    analysis = plotting.DataAnalysis(echo.logger, False, work)
+    dataset = channels.channel(0)
+    seconds = best_of(lambda: analysis.plot_dataset(dataset, "Time (s)", "Units"), repeats)
+    results["plot_dataset"] = {"seconds": seconds}
+    return results
+
+
+def upload_stage(created, work, repeats, round_trip, bandwidth):
+    """
+    Time uploading the first video to the stand-in Drive
+
+    :returns: a dict of stage name to a dict of results
+    """
+    from oauth2client import client, file as oauth_file
+    import remote_storage
+    from stand_in_drive import DISCOVERY_PATH, serve
+    base = serve(round_trip, bandwidth)
+    credentials_path = os.path.join(work, "drive.credentials")
+    oauth_file.Storage(credentials_path).put(client.AccessTokenCredentials("token", "bench"))
+    drive = remote_storage.GoogleDrive(echo.logger, credentials_path=credentials_path,
+                                       discovery_uri=base + DISCOVERY_PATH[1:])
+    video_path = created["video"][0]
+    seconds = best_of(lambda: drive.upload_file(video_path), repeats)
+    return {"upload_file": {"seconds": seconds,
+                            "mb_per_second": os.path.getsize(video_path) / 1e6 / seconds}}
+
+
+def load_history(results_path):
+    """
+    :returns: the list of earlier results, or an empty list
+    """
+    try:
+        with open(results_path, "r") as results_file:
+            return json.load(results_file)
+    except (OSError, ValueError):
+        return []
+
+
+def compare(entry, history, threshold):
+    """
+    Print each stage's results next to the last ones from the same machine
+    and settings
+
+    :returns: the names of the stages that got more than threshold percent slower
+    """
+    previous = None
+    for earlier in reversed(history):
+        if earlier["machine"] == entry["machine"] and earlier["settings"] == entry["settings"]:
+            previous = earlier
+            break
+    print("Echo " + entry["version"] + (", compared with " + previous["version"] + " (" +
+                                        previous["time"] + ")" if previous else ""))
+    slower = []
+    for name, result in entry["results"].items():
+        line = "  {:14s} {:9.4f} s".format(name, result["seconds"])
+        rates = [(result[key], unit) for key, unit in RATE_UNITS.items() if key in result]
+        line += "  {:16,.1f} {:9s}".format(*rates[0]) if rates else " " * 29
+        if previous is not None and name in previous["results"]:
+            change = result["seconds"] / previous["results"][name]["seconds"] - 1
+            line += "  {:+7.1%}".format(change)
+            if change * 100 > threshold:
+                line += "  SLOWER"
+                slower.append(name)
+        print(line.rstrip())
+    return slower
+
+
+def main():
+    """
+    Build the test directory, run every stage and record the results
+    """
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "", [
+            "quick", "repeats=", "round-trip=", "bandwidth=", "results=", "threshold=",
+            "no-upload"])
+    except getopt.GetoptError as error:
+        print(str(error))
+        sys.exit(2)
+    settings = FULL
+    repeats = 3
+    round_trip = 0.02
+    bandwidth = 50e6
+    results_path = os.path.join(os.getcwd(), "echo.bench.json")
+    threshold = 10.0
+    upload = True
+    for opt, arg in opts:
+        if opt == "--quick":
+            settings = QUICK
+        elif opt == "--repeats":
+            repeats = max(1, int(arg))
+        elif opt == "--round-trip":
+            round_trip = float(arg) / 1000
+        elif opt == "--bandwidth":
+            bandwidth = float(arg) * 1e6 or None
+        elif opt == "--results":
+            results_path = os.path.realpath(arg)
+        elif opt == "--threshold":
+            threshold = float(arg)
+        elif opt == "--no-upload":
+            upload = False
+
+    data_files, channels, rates, duration, videos, video_bytes = settings
+    entry = {"version": git_version(),
+             "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+             "machine": platform.node() + " (" + platform.machine() + ", " +
+                        str(os.cpu_count()) + " CPUs, Python " + platform.python_version() + ")",
+             "settings": {"data_files": data_files, "channels": channels,
+                          "rates": list(rates), "duration": duration,
+                          "video_bytes": video_bytes, "repeats": repeats,
+                          "round_trip": round_trip if upload else None,
+                          "bandwidth": bandwidth if upload else None}}
+    with tempfile.TemporaryDirectory() as work:
+        root = os.path.join(work, "test")
+        print("Generating test directory...")
+        created = synthetic.make_test_directory(root, data_files, channels, rates, duration,
+                                                videos, video_bytes)
+        entry["results"] = local_stages(created, work, repeats)
+        if upload:
+            entry["results"].update(upload_stage(created, work, repeats, round_trip, bandwidth))
+
+    history = load_history(results_path)
+    slower = compare(entry, history, threshold)
+    history.append(entry)
+    with open(results_path + ".tmp", "w") as results_file:
+        json.dump(history, results_file, indent=1)
+    os.replace(results_path + ".tmp", results_path)
+    print("Results saved to " + results_path)
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
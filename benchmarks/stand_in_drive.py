@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+A local stand-in for the Drive v3 API, for the benchmarks and tests. It serves the
+discovery document, creates, looks up and moves files and folders, answers
+batches of those requests and takes resumable uploads, adding a simulated
+round trip time to every request and a few more to every new connection (for
+the TCP and TLS handshakes). Uploaded bytes can be limited to a simulated
+link bandwidth, shared by every connection. Upload chunks can be made to
+fail, to test retrying and resuming.
+
+Needs google-api-python-client (for its copy of the discovery document), but
+no Google account.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from googleapiclient.discovery_cache import get_static_doc
+
+DISCOVERY_PATH = "/discovery/v1/apis/drive/v3/rest"
+FILES_PATH = "/drive/v3/files"
+BATCH_PATH = "/batch/drive/v3"
+UPLOAD_PATH = "/upload/drive/v3/files"
+SESSION_PATH = "/upload/sessions/"
+# Round trips a new connection costs before its first request (TCP + TLS)
+HANDSHAKE_ROUND_TRIPS = 3
+
+
+class StandInDrive(BaseHTTPRequestHandler):
+    """
+    Just enough of the Drive API for Echo, with simulated latency and
+    bandwidth. A fraction of batched requests can be made to fail with HTTP
+    503, as Drive does under load, and so can chunks of uploads: the next few
+    in turn (upload_failures), or every one for some file names
+    (failing_names)
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, which Nagle's algorithm
+    # would otherwise hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+    round_trip = 0.0
+    # Bytes per second all uploads share, or None for no limit
+    bandwidth = None
+    batch_failure_rate = 0.0
+    # HTTP statuses to answer the next upload chunks with, in order (None lets
+    # a chunk through), and names of files whose chunks always get HTTP 500
+    upload_failures = []
+    failing_names = set()
+    document = b""
+    files = {}
+    sessions = {}
+    connections = 0
+    requests = 0
+    bytes_received = 0
+    # When the simulated link has finished sending what it has been given
+    link_free = 0.0
+    lock = threading.Lock()
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.lock:
+            StandInDrive.connections += 1
+        time.sleep(HANDSHAKE_ROUND_TRIPS * self.round_trip)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+    def _respond(self):
+        with self.lock:
+            StandInDrive.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._transfer(len(body))
+        headers = {}
+        path = self.path.split("?")[0]
+        if path == BATCH_PATH:
+            status, content_type, body = self._batch(body)
+        elif path in (UPLOAD_PATH, "/resumable" + UPLOAD_PATH):
+            status, headers, body = self._start_upload(body)
+            content_type = "application/json"
+        elif path.startswith(SESSION_PATH):
+            status, headers, body = self._continue_upload(path[len(SESSION_PATH):], body)
+            content_type = "application/json"
+        else:
+            status, body = self._route(self.command, self.path, body)
+            content_type = "application/json"
+        time.sleep(self.round_trip)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_PUT = _respond
+
+    def _transfer(self, size):
+        """
+        Wait as long as sending size bytes over the simulated link would take,
+        after whatever the other connections are already sending
+        """
+        with self.lock:
+            StandInDrive.bytes_received += size
+            if not self.bandwidth or not size:
+                return
+            start = max(time.time(), StandInDrive.link_free)
+            StandInDrive.link_free = start + size / self.bandwidth
+            done = StandInDrive.link_free
+        time.sleep(max(0.0, done - time.time()))
+
+    def _route(self, method, path, body):
+        """
+        :returns: a tuple of (HTTP status, JSON response body)
+        """
+        query = parse_qs(urlparse(path).query)
+        path = path.split("?")[0]
+        file_id = path.rsplit("/", 1)[-1]
+        if method == "GET" and path == DISCOVERY_PATH:
+            return 200, self.document
+        if method == "POST" and path == FILES_PATH:
+            metadata = json.loads(body or b"{}")
+            file_id = uuid.uuid4().hex
+            self.files[file_id] = dict(metadata, id=file_id, md5Checksum="0", trashed=False)
+            return 200, json.dumps({"id": file_id}).encode()
+        if file_id not in self.files:
+            return 404, b'{"error": {"code": 404, "message": "File not found"}}'
+        if method == "PATCH":
+            self.files[file_id]["parents"] = query.get("addParents", [""])[0].split(",")
+        return 200, json.dumps(self.files[file_id]).encode()
+
+    def _batch(self, body):
+        """
+        Answer a multipart/mixed batch, one part per request
+
+        :returns: a tuple of (HTTP status, content type, response body)
+        """
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            inner = part.get_payload().replace("\r\n", "\n")
+            head, _, inner_body = inner.partition("\n\n")
+            method, path, _ = head.split("\n", 1)[0].split(" ", 2)
+            if random.random() < self.batch_failure_rate:
+                status, content = 503, b'{"error": {"code": 503, "message": "Backend Error"}}'
+            else:
+                status, content = self._route(method, path, inner_body.encode())
+            parts.append("--" + boundary + "\r\nContent-Type: application/http\r\n" +
+                         "Content-ID: <response-" + part["Content-ID"][1:] + "\r\n\r\n" +
+                         "HTTP/1.1 " + str(status) + " " + ("OK" if status == 200 else "Error") +
+                         "\r\nContent-Type: application/json\r\n\r\n" +
+                         content.decode() + "\r\n")
+        return (200, "multipart/mixed; boundary=" + boundary,
+                ("".join(parts) + "--" + boundary + "--").encode())
+
+    def _start_upload(self, body):
+        """
+        Open a resumable upload session for the file described by body
+
+        :returns: a tuple of (HTTP status, extra headers, response body)
+        """
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = {"metadata": json.loads(body or b"{}"), "received": 0,
+                                         "md5": hashlib.md5()}
+        return 200, {"Location": "http://" + self.headers["Host"] + SESSION_PATH +
+                                 session_id}, b""
+
+    def _continue_upload(self, session_id, body):
+        """
+        Take one chunk of a resumable upload (or a request for its status)
+
+        Only the checksum of the data is kept, so a chunk that doesn't start
+        where the last one ended is refused, and the client resends from the
+        confirmed offset.
+
+        :returns: a tuple of (HTTP status, extra headers, response body)
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return 404, {}, b'{"error": {"code": 404, "message": "Session not found"}}'
+        if body:
+            with self.lock:
+                status = self.upload_failures.pop(0) if self.upload_failures else None
+            if status is None and session["metadata"].get("name") in self.failing_names:
+                status = 500
+            if status is not None:
+                return status, {}, (b'{"error": {"code": ' + str(status).encode() +
+                                    b', "message": "Backend Error"}}')
+        content_range = self.headers.get("Content-Range", "")
+        match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", content_range)
+        if match:
+            total = match.group(2)
+            if int(match.group(1)) == session["received"]:
+                session["md5"].update(body)
+                session["received"] += len(body)
+        else:
+            # "bytes */TOTAL" asks how much has arrived
+            total = content_range.rpartition("/")[2] or str(len(body))
+        if total != "*" and session["received"] >= int(total):
+            file_id = uuid.uuid4().hex
+            with self.lock:
+                self.files[file_id] = dict(session["metadata"], id=file_id, trashed=False,
+                                           size=str(session["received"]),
+                                           md5Checksum=session["md5"].hexdigest())
+                del self.sessions[session_id]
+            return 200, {}, json.dumps(self.files[file_id]).encode()
+        headers = {}
+        if session["received"]:
+            headers["Range"] = "bytes=0-" + str(session["received"] - 1)
+        return 308, headers, b""
+
+
+def serve(round_trip, bandwidth=None):
+    """
+    Start the stand-in server on a free local port
+
+    :param round_trip: the simulated round trip time, in seconds
+    :param bandwidth: the simulated upload bandwidth, in bytes per second, or
+    None for no limit
+    :returns: the server's base URL
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInDrive)
+    server.daemon_threads = True
+    base = "http://127.0.0.1:" + str(server.server_address[1]) + "/"
+    document = json.loads(get_static_doc("drive", "v3"))
+    document["rootUrl"] = base
+    StandInDrive.document = json.dumps(document).encode()
+    StandInDrive.round_trip = round_trip
+    StandInDrive.bandwidth = bandwidth
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return base
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Generates synthetic test directories laid out like the output of a test
+stand: data files of telemetry channels (a time column, then one column per
+channel) at a mix of sample rates, a t0_time.csv, and large dummy video
+files. Each channel idles with sensor noise, ramps up at T0 to a plateau with
+some combustion roughness, then tails off at the end of the burn, so plots,
+filters and trimming see realistic shapes.
+
+Usage: python benchmarks/synthetic.py path [data_files] [channels] [rates_hz]
+                                      [duration_s] [videos] [video_mb]
+
+rates_hz is a comma separated list of sample rates, given to the data files
+in turn (e.g. 1000,100 alternates between 1 kHz and 100 Hz files).
+"""
+
+import os
+import sys
+import numpy as np
+
+# Rows written per np.savetxt call, which bounds memory use on long channels
+BLOCK_ROWS = 200000
+# Seconds the burn lasts after T0
+BURN_SECONDS = 5.0
+# Bytes of random data repeated through each video file
+VIDEO_BLOCK_BYTES = 1024 * 1024
+
+
+def channel_values(times, t0_time, index, rng):
+    """
+    :param times: the sample times
+    :param t0_time: the time the burn starts
+    :param index: the number of the channel, which sets its scale
+    :param rng: a numpy.random.RandomState for the noise
+    :returns: the channel's values at the given times
+    """
+    scale = 100.0 * (index + 1)
+    since_t0 = times - t0_time
+    ramp = np.clip(since_t0 / 0.2, 0.0, 1.0) * np.clip((BURN_SECONDS - since_t0) / 0.5, 0.0, 1.0)
+    roughness = 0.03 * np.sin(2 * np.pi * (40.0 + index) * times)
+    return scale * ramp * (1.0 + roughness) + rng.normal(0.0, scale * 0.01, len(times))
+
+
+def write_data_file(path, channels, rate, duration, t0_time, seed=0):
+    """
+    Write a data file of synthetic telemetry
+
+    :param path: the path of the CSV file to create
+    :param channels: the number of value columns
+    :param rate: the sample rate, in Hz
+    :param duration: the number of seconds of data
+    :param t0_time: the time the burn starts
+    :param seed: the seed for the noise, so the same arguments give the same file
+    :returns: the number of rows written
+    """
+    rows = int(rate * duration)
+    rng = np.random.RandomState(seed)
+    with open(path, "w") as csv_file:
+        for start in range(0, rows, BLOCK_ROWS):
+            times = np.arange(start, min(start + BLOCK_ROWS, rows)) / float(rate)
+            block = np.empty((len(times), channels + 1))
+            block[:, 0] = times
+            for index in range(channels):
+                block[:, index + 1] = channel_values(times, t0_time, index, rng)
+            np.savetxt(csv_file, block, delimiter=",", fmt="%.6f")
+    return rows
+
+
+def write_t0_file(path, t0_time):
+    """
+    Write a t0_time.csv marking t0_time as T0 (echo.load_t0 takes the time of
+    the last row with a non-zero flag)
+    """
+    with open(path, "w") as t0_file:
+        t0_file.write("0.000000,0\n{:.6f},1\n".format(t0_time))
+
+
+def write_video(path, size, seed=0):
+    """
+    Write a dummy video file of random bytes
+
+    :param path: the path of the file to create
+    :param size: its size, in bytes
+    :param seed: the seed for the bytes
+    """
+    block = np.random.RandomState(seed).bytes(VIDEO_BLOCK_BYTES)
+    with open(path, "wb") as video_file:
+        for start in range(0, size, len(block)):
+            video_file.write(block[:size - start])
+
+
+def make_test_directory(root, data_files=4, channels=8, rates=(1000.0,), duration=20.0,
+                        videos=1, video_bytes=100 * 1000 * 1000, t0_time=None):
+    """
+    Fill a directory with a synthetic test: data files in root/data, a
+    t0_time.csv in root and videos in root/video
+
+    :param root: the directory to fill (created if need be)
+    :param data_files: the number of data files
+    :param channels: the number of channels in each data file
+    :param rates: the sample rates in Hz, given to the data files in turn
+    :param duration: the number of seconds each data file covers
+    :param videos: the number of video files
+    :param video_bytes: the size of each video file
+    :param t0_time: the time of T0, or None for a quarter of the way through
+    :returns: a dict with "data", "t0" and "video" keys listing the paths
+    created, and "rows", the total number of data rows
+    """
+    if t0_time is None:
+        t0_time = duration / 4
+    data_dir = os.path.join(root, "data")
+    video_dir = os.path.join(root, "video")
+    for folder in (data_dir, video_dir):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    created = {"data": [], "t0": [os.path.join(root, "t0_time.csv")], "video": [], "rows": 0}
+    write_t0_file(created["t0"][0], t0_time)
+    for index in range(data_files):
+        rate = rates[index % len(rates)]
+        path = os.path.join(data_dir, "STAND{:02d}_{:g}hz.csv".format(index, rate))
+        created["rows"] += write_data_file(path, channels, rate, duration, t0_time, index)
+        created["data"].append(path)
+    for index in range(videos):
+        path = os.path.join(video_dir, "camera{:02d}.mp4".format(index))
+        write_video(path, video_bytes, index)
+        created["video"].append(path)
+    return created
+
+
+def main():
+    """
+    Generate a test directory from the command line arguments
+    """
+    if len(sys.argv) < 2:
+        print("Usage: python benchmarks/synthetic.py path [data_files] [channels] [rates_hz]\n"
+              "                                      [duration_s] [videos] [video_mb]")
+        sys.exit(2)
+    args = sys.argv[2:]
+    created = make_test_directory(
+        sys.argv[1],
+        data_files=int(args[0]) if len(args) > 0 else 4,
+        channels=int(args[1]) if len(args) > 1 else 8,
+        rates=[float(rate) for rate in args[2].split(",")] if len(args) > 2 else (1000.0,),
+        duration=float(args[3]) if len(args) > 3 else 20.0,
+        videos=int(args[4]) if len(args) > 4 else 1,
+        video_bytes=int(float(args[5]) * 1e6) if len(args) > 5 else 100 * 1000 * 1000)
+    size = sum(os.path.getsize(path) for kind in ("data", "t0", "video")
+               for path in created[kind])
+    print("Wrote {} data file(s) ({:,} rows), a T0 file and {} video(s) to {} ({:.1f} MB)".format(
+        len(created["data"]), created["rows"], len(created["video"]), sys.argv[1], size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Parallel compression of files on their way to Drive. A file is cut into
+fixed-size blocks and each block is compressed on its own, on a pool of
+threads (zlib and zstd release the GIL while they work), into a gzip member
+or zstd frame. Concatenated members and frames are themselves a valid .gz or
+.zst file, which gunzip, zstd, Python's gzip module and so on read as one.
+
+The output only depends on the file and the settings, so an interrupted
+upload can be resumed by compressing the file again and skipping what the
+server already has. zstd needs the optional zstandard package.
+"""
+
+import gzip
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import scanner
+
+GZIP = "gzip"
+ZSTD = "zstd"
+METHODS = (GZIP, ZSTD)
+EXTENSIONS = {GZIP: ".gz", ZSTD: ".zst"}
+MIME_TYPES = {GZIP: "application/gzip", ZSTD: "application/zstd"}
+# Fast levels: on a single core, gzip -6 compresses telemetry slower than a
+# typical uplink sends it, while gzip -1 is several times faster and only a
+# few percent bigger
+DEFAULT_LEVELS = {GZIP: 1, ZSTD: 3}
+# Size of each independently compressed block. Larger blocks compress a little
+# better, smaller ones spread over more threads on small files
+DEFAULT_BLOCK_BYTES = 1024 * 1024
+# Blocks compressed ahead of what has been read, at least, so compression
+# carries on while a chunk is being sent
+MIN_BLOCKS_AHEAD = 8
+# Files compressed by default: text telemetry, which shrinks several times over
+DEFAULT_EXTENSIONS = (".csv",)
+
+
+def zstd_available():
+    """
+    :returns: True if the zstandard package can be imported
+    """
+    try:
+        import zstandard  # pylint: disable=W0611
+    except ImportError:
+        return False
+    return True
+
+
+def parse_method(text):
+    """
+    Parse a compression setting given on the command line
+
+    :param text: "METHOD" or "METHOD:LEVEL", e.g. "gzip" or "zstd:10"
+    :returns: a tuple of (method, level)
+    :raises ValueError: if the method is unknown or unavailable, or the level
+    isn't a number
+    """
+    method, _, level_text = text.lower().partition(":")
+    if method not in METHODS:
+        raise ValueError("unknown compression method " + repr(method) + " (use " +
+                         " or ".join(METHODS) + ")")
+    if method == ZSTD and not zstd_available():
+        raise ValueError("zstd compression needs the zstandard package")
+    try:
+        level = int(level_text) if level_text else DEFAULT_LEVELS[method]
+    except ValueError:
+        raise ValueError("compression level must be a whole number, not " + repr(level_text))
+    return method, level
+
+
+class Compressor:
+    """
+    Compressor holds the compression settings and decides which files they
+    apply to. Its stream() method yields a file's compressed bytes block by
+    block, compressing a bounded number of blocks ahead (MIN_BLOCKS_AHEAD, or
+    twice the number of threads if that's more), so memory use stays bounded
+    however large the file is.
+    """
+
+    method = GZIP
+    level = DEFAULT_LEVELS[GZIP]
+    threads = 1
+    block_bytes = DEFAULT_BLOCK_BYTES
+    extensions = DEFAULT_EXTENSIONS
+
+    def __init__(self, method=GZIP, level=None, threads=None, block_bytes=DEFAULT_BLOCK_BYTES,
+                 extensions=DEFAULT_EXTENSIONS):
+        """
+        Constructor
+
+        :param method: one of METHODS
+        :param level: the compression level, or None for the method's default
+        :param threads: the number of blocks compressed at once (default: one
+        per CPU)
+        :param block_bytes: the size of each independently compressed block
+        :param extensions: the file extensions (lower case) to compress
+        """
+        self.method = method
+        self.level = DEFAULT_LEVELS[method] if level is None else level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_bytes = block_bytes
+        self.extensions = tuple(extensions)
+        self.local = threading.local()
+
+    @property
+    def extension(self):
+        """
+        The extension added to the name of a compressed file, e.g. ".gz"
+        """
+        return EXTENSIONS[self.method]
+
+    @property
+    def mime_type(self):
+        """
+        The MIME type of a compressed file
+        """
+        return MIME_TYPES[self.method]
+
+    @property
+    def label(self):
+        """
+        A description of every setting that changes the compressed bytes
+        """
+        return self.method + ":" + str(self.level) + ":" + str(self.block_bytes)
+
+    def applies_to(self, file_path):
+        """
+        Echo's own outputs (e.g. summary.csv) are never compressed: they are
+        small, and are meant to be opened straight from Drive
+
+        :param file_path: the path of a file about to be uploaded
+        :returns: True if the file should be compressed on the way
+        """
+        folder = os.path.basename(os.path.dirname(os.path.realpath(file_path)))
+        return file_path.lower().endswith(self.extensions) and \
+            not scanner.is_output_folder(folder)
+
+    def compress_block(self, data):
+        """
+        Compress one block into a complete gzip member or zstd frame
+
+        :param data: the bytes of the block
+        :returns: the compressed bytes
+        """
+        if self.method == GZIP:
+            # A fixed timestamp keeps the output the same from run to run
+            return gzip.compress(data, self.level, mtime=0)
+        # ZstdCompressor objects can't be shared between threads
+        compressor = getattr(self.local, "zstd", None)
+        if compressor is None:
+            import zstandard
+            compressor = self.local.zstd = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(data)
+
+    def stream(self, file_path, digest=None):
+        """
+        Compress a file
+
+        :param file_path: the path of the file
+        :param digest: an optional hashlib object to update with the file's
+        (uncompressed) bytes as they are read
+        :returns: a generator of compressed blocks, in order. Closing it early
+        stops the compression
+        """
+        with open(file_path, "rb") as source, \
+                ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pending = []
+            first = True
+            ahead = max(2 * self.threads, MIN_BLOCKS_AHEAD)
+            while True:
+                while len(pending) < ahead:
+                    data = source.read(self.block_bytes)
+                    if digest is not None:
+                        digest.update(data)
+                    # An empty file still compresses to a valid (empty) archive
+                    if not data and not first:
+                        break
+                    first = False
+                    pending.append(executor.submit(self.compress_block, data))
+                    if not data:
+                        break
+                if not pending:
+                    return
+                try:
+                    yield pending.pop(0).result()
+                except GeneratorExit:
+                    for future in pending:
+                        future.cancel()
+                    raise
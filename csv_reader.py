@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Streaming CSV ingestion for telemetry files. Files are split into byte blocks
+that always start on a line boundary, and each block is parsed straight into a
+NumPy array of the requested dtype. Blocks can be parsed on several threads.
+
+Files too big to parse in memory can be read into memory-mapped files instead
+(see read_csv's allocate argument and memmap_allocator), a block at a time.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Size of each block handed to the parser. Large enough to amortize the per
+# block overhead, small enough that the temporary line list stays modest.
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DELIMITER = ","
+COMMENT = "#"
+# Below this many lines, a block that numpy rejects is parsed line by line
+BISECT_MIN_LINES = 64
+# Bytes read from the start of a file to estimate its line length
+ESTIMATE_SAMPLE_BYTES = 64 * 1024
+
+
+def read_csv(path, columns=None, dtype=float, threads=1,
+             chunk_bytes=DEFAULT_CHUNK_BYTES, logger=None, order="C", window=None,
+             time_dtype=None, allocate=None, scratch_dir=None):
+    """
+    Read a numeric CSV file into a 2D NumPy array
+
+    Rows with the wrong number of fields are skipped. Fields that are not
+    numbers (e.g. a header line) become NaN, like numpy.genfromtxt.
+
+    If a window is given and the first column of the file is in increasing
+    order, blocks that lie wholly outside the window aren't parsed at all. One
+    block either side of the window is kept, which leaves filters a margin of
+    real samples to settle in; the caller trims the rest.
+
+    If an allocate function is given, the result is built out-of-core: blocks
+    are parsed in order, a few ahead, and appended to a scratch file, then
+    copied into arrays from allocate (e.g. memory-mapped files, see
+    memmap_allocator) once the number of rows is known. Only a few blocks are
+    ever in memory, however big the file.
+
+    :param path: path to CSV file
+    :param columns: a sequence of column indices to keep, or None for all
+    :param dtype: the dtype of the returned array (e.g. numpy.float32)
+    :param threads: number of threads used to parse blocks of the file
+    :param chunk_bytes: approximate size of each block in bytes
+    :param logger: an optional Logger used to report skipped rows
+    :param order: the memory layout of the returned array, "C" (row-major) or
+    "F" (column-major, so each column is contiguous)
+    :param window: a tuple of (lowest, highest) values of the first column to
+    read, or None to read the whole file
+    :param time_dtype: if given, the first returned column is also returned on
+    its own as a 1D array of this dtype. Blocks are parsed at the wider of the
+    two dtypes, so e.g. float64 times beside a float32 array keep every digit
+    :param allocate: a function called as allocate(shape, dtype, order) to
+    create each returned array (the time column first, if time_dtype is
+    given), which is then filled in and flushed if it has a flush() method;
+    or None to build the arrays in memory
+    :param scratch_dir: where to put the out-of-core scratch file, or None for
+    the system temporary directory
+    :returns: a 2D NumPy array with one row per parsed CSV line, or a tuple of
+    (time column, 2D array) if time_dtype is given
+    """
+    size = os.path.getsize(path)
+    field_count = _count_fields(path)
+    if columns is not None:
+        columns = list(columns)
+    width = field_count if columns is None else len(columns)
+    if size == 0 or field_count == 0:
+        if allocate is None:
+            allocate = _allocate_memory
+        times = None if time_dtype is None else allocate((0,), time_dtype, "C")
+        empty = allocate((0, width), dtype, order)
+        return empty if time_dtype is None else (times, empty)
+
+    offsets = _block_offsets(path, size, chunk_bytes)
+    spans = list(zip(offsets[:-1], offsets[1:]))
+    if window is not None and len(spans) > 1:
+        kept = _window_spans(path, spans, window)
+        if len(kept) < len(spans) and logger is not None:
+            logger.log_verbose("Skipped " + str(len(spans) - len(kept)) + " of " +
+                               str(len(spans)) + " block(s) outside the trim window in " + path)
+        spans = kept
+
+    parse_dtype = dtype if time_dtype is None else np.result_type(dtype, time_dtype)
+    if allocate is not None:
+        def parse_wide(span):
+            return _parse_block(path, span[0], span[1], field_count, columns, parse_dtype)
+        return _read_out_of_core(path, spans, parse_wide, threads, width, dtype, order,
+                                 time_dtype, allocate, chunk_bytes, logger, scratch_dir)
+
+    def parse(span):
+        block, skipped = _parse_block(path, span[0], span[1], field_count, columns, parse_dtype)
+        if time_dtype is None:
+            return block, skipped
+        # Split off the times before the wide block is narrowed, one block at
+        # a time, so the whole file is never held at the wider dtype
+        return (block[:, 0].astype(time_dtype), block.astype(dtype, copy=False)), skipped
+
+    if threads > 1 and len(spans) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(parse, spans))
+    else:
+        results = [parse(span) for span in spans]
+
+    _log_skipped(path, sum(result[1] for result in results), logger)
+
+    blocks = [result[0] for result in results]
+    if time_dtype is not None:
+        times = np.concatenate([block[0] for block in blocks]) if blocks else \
+            np.empty(0, dtype=time_dtype)
+        return times, _assemble([block[1] for block in blocks], width, dtype, order)
+    return _assemble(blocks, width, dtype, order)
+
+
+def estimate_bytes(path, columns=None, dtype=float):
+    """
+    Estimate the size of the array read_csv() would return, from the length of
+    the lines at the start of the file
+
+    :param path: path to CSV file
+    :param columns: a sequence of column indices to keep, or None for all
+    :param dtype: the dtype of the array
+    :returns: the estimated size in bytes
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as csv_file:
+        sample = csv_file.read(ESTIMATE_SAMPLE_BYTES)
+    if not sample:
+        return 0
+    width = _count_fields(path) if columns is None else len(list(columns))
+    rows = size * max(sample.count(b"\n"), 1) / len(sample)
+    return int(rows * width * np.dtype(dtype).itemsize)
+
+
+def memmap_allocator(paths, scratch_dir=None):
+    """
+    Make an allocate function for read_csv() that creates each array as a
+    memory-mapped file
+
+    :param paths: one path per array, in the order read_csv() creates them:
+    each either a .npy file to write, or None for a scratch file in
+    scratch_dir that is deleted as soon as the array is garbage collected
+    :param scratch_dir: where to put scratch files, or None for the system
+    temporary directory
+    :returns: the allocate function
+    """
+    paths = list(paths)
+
+    def allocate(shape, dtype, order):
+        path = paths.pop(0)
+        if not all(shape):
+            # An empty file can't be mapped
+            empty = np.empty(shape, dtype=dtype, order=order)
+            if path is not None:
+                np.save(path, empty)
+            return empty
+        if path is not None:
+            return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape,
+                                             fortran_order=order == "F")
+        # The mapping (and so the array) outlives the deleted file
+        with tempfile.TemporaryFile(dir=scratch_dir) as scratch:
+            return np.memmap(scratch, dtype=dtype, mode="w+", shape=shape, order=order)
+    return allocate
+
+
+def _read_out_of_core(path, spans, parse, threads, width, dtype, order, time_dtype,
+                      allocate, chunk_bytes, logger, scratch_dir):
+    """
+    The out-of-core half of read_csv(): parse the blocks into a row-major
+    scratch file, then copy it into the allocated arrays a chunk of rows at a
+    time
+
+    :param parse: a function that parses one span into a tuple of (2D array,
+    number of skipped rows)
+    :returns: what read_csv() returns
+    """
+    parse_dtype = np.dtype(dtype if time_dtype is None else np.result_type(dtype, time_dtype))
+    rows = 0
+    skipped = 0
+    with tempfile.TemporaryFile(dir=scratch_dir) as scratch, \
+            ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        pending = []
+        for span in spans + [None]:
+            if span is not None:
+                pending.append(executor.submit(parse, span))
+            # Parse at most two blocks per thread ahead of the one being written
+            while pending and (span is None or len(pending) > 2 * threads):
+                block, block_skipped = pending.pop(0).result()
+                scratch.write(np.ascontiguousarray(block, dtype=parse_dtype).data)
+                rows += len(block)
+                skipped += block_skipped
+        scratch.flush()
+        _log_skipped(path, skipped, logger)
+
+        times = None if time_dtype is None else allocate((rows,), time_dtype, "C")
+        out = allocate((rows, width), dtype, order)
+        if rows:
+            parsed = np.memmap(scratch, dtype=parse_dtype, mode="r", shape=(rows, width))
+            step = max(1, chunk_bytes // (width * parse_dtype.itemsize))
+            for start in range(0, rows, step):
+                chunk = parsed[start:start + step]
+                out[start:start + step] = chunk
+                if times is not None:
+                    times[start:start + step] = chunk[:, 0]
+            del parsed
+    for array in (times, out):
+        if hasattr(array, "flush"):
+            array.flush()
+    return out if time_dtype is None else (times, out)
+
+
+def _log_skipped(path, skipped, logger):
+    """
+    Report the number of malformed rows skipped in a file, if there were any
+    """
+    if skipped and logger is not None:
+        logger.log_verbose("Skipped " + str(skipped) + " malformed row(s) in " + path)
+
+
+def _allocate_memory(shape, dtype, order):
+    """
+    The default allocate function for read_csv(): an array in memory
+    """
+    return np.empty(shape, dtype=dtype, order=order)
+
+
+def _assemble(blocks, width, dtype, order):
+    """
+    Join parsed blocks into one array, releasing each block as it is copied
+
+    :param blocks: a list of 2D arrays, each set to None once copied
+    :returns: a 2D array of the given dtype and memory order
+    """
+    if len(blocks) == 1:
+        return np.asarray(blocks[0], order=order)
+    # Allocate the output once and release each block as soon as it is copied
+    out = np.empty((sum(len(block) for block in blocks), width), dtype=dtype, order=order)
+    row = 0
+    for index, block in enumerate(blocks):
+        out[row:row + len(block)] = block
+        row += len(block)
+        blocks[index] = None
+    return out
+
+
+def _count_fields(path):
+    """
+    Count the fields in the first non-blank, non-comment line of a CSV file
+
+    :param path: path to CSV file
+    :returns: the number of fields, or 0 if the file has no such line
+    """
+    with open(path, "r", errors="replace") as csv_file:
+        for line in csv_file:
+            line = line.split(COMMENT, 1)[0].strip()
+            if line:
+                return len(line.split(DELIMITER))
+    return 0
+
+
+def _block_offsets(path, size, chunk_bytes):
+    """
+    Split a file into blocks of roughly chunk_bytes that start on line boundaries
+
+    :param path: path to the file
+    :param size: size of the file in bytes
+    :param chunk_bytes: approximate size of each block in bytes
+    :returns: a list of byte offsets, starting with 0 and ending with size
+    """
+    offsets = [0]
+    with open(path, "rb") as csv_file:
+        while offsets[-1] + chunk_bytes < size:
+            csv_file.seek(offsets[-1] + chunk_bytes)
+            csv_file.readline()
+            position = csv_file.tell()
+            if position >= size:
+                break
+            offsets.append(position)
+    offsets.append(size)
+    return offsets
+
+
+def _window_spans(path, spans, window):
+    """
+    Drop the blocks whose first-column values all fall outside a window
+
+    Each block's range is bounded by the first value in it and the first value
+    in the next block, so only one line per block is read. If those values
+    aren't in increasing order, nothing is dropped.
+
+    :param path: path to the file
+    :param spans: a list of (start, end) byte offsets of the blocks
+    :param window: a tuple of (lowest, highest) first-column values to keep
+    :returns: the spans to parse
+    """
+    firsts = [_first_value(path, start, end) for start, end in spans]
+    known = [value for value in firsts if value == value]
+    if any(later < earlier for earlier, later in zip(known, known[1:])):
+        return spans
+    keep = set()
+    for index, lowest in enumerate(firsts):
+        highest = firsts[index + 1] if index + 1 < len(firsts) else float("inf")
+        # NaN bounds (e.g. a header line) mean the range is unknown, so keep
+        # the block
+        if not (highest < window[0] or lowest > window[1]):
+            keep.update((index - 1, index, index + 1))
+    return [span for index, span in enumerate(spans) if index in keep]
+
+
+def _first_value(path, start, end):
+    """
+    Read the first field of the first data line between two byte offsets
+
+    :returns: the value as a float, or NaN if it isn't a number or there is no
+    data line
+    """
+    with open(path, "rb") as csv_file:
+        csv_file.seek(start)
+        while csv_file.tell() < end:
+            line = csv_file.readline().decode("utf-8", errors="replace")
+            line = line.split(COMMENT, 1)[0].strip()
+            if line:
+                return _to_float(line.split(DELIMITER, 1)[0])
+    return float("nan")
+
+
+def _parse_block(path, start, end, field_count, columns, dtype):
+    """
+    Parse the lines between two byte offsets of a CSV file
+
+    :returns: a tuple of (2D array, number of skipped rows)
+    """
+    with open(path, "rb") as csv_file:
+        csv_file.seek(start)
+        lines = csv_file.read(end - start).decode("utf-8", errors="replace").splitlines()
+    return _parse_lines(lines, field_count, columns, dtype)
+
+
+def _parse_lines(lines, field_count, columns, dtype):
+    """
+    Parse a list of CSV lines
+
+    The fast path hands all of the lines to numpy.loadtxt. If that fails, the
+    lines are split in half and each half is retried, so a single bad row only
+    pushes a handful of its neighbours onto the slow line-by-line parser.
+
+    :returns: a tuple of (2D array, number of skipped rows)
+    """
+    width = field_count if columns is None else len(columns)
+    if len(lines) > BISECT_MIN_LINES:
+        # numpy.loadtxt rejects rows with the wrong number of fields by itself,
+        # except those whose extra or missing fields aren't in usecols, so
+        # those are looked for beforehand
+        if columns is None or _fields_match(lines, field_count):
+            try:
+                block = np.loadtxt(lines, delimiter=DELIMITER, comments=COMMENT, dtype=dtype,
+                                   usecols=columns, ndmin=2)
+                if block.shape[1] == width:
+                    return block, 0
+            except ValueError:
+                pass
+        middle = len(lines) // 2
+        first, first_skipped = _parse_lines(lines[:middle], field_count, columns, dtype)
+        second, second_skipped = _parse_lines(lines[middle:], field_count, columns, dtype)
+        return np.concatenate((first, second)), first_skipped + second_skipped
+    return _parse_rows(lines, field_count, columns, dtype)
+
+
+def _fields_match(lines, field_count):
+    """
+    :returns: True if every line of a list of CSV lines is blank, a comment or
+    has exactly field_count fields
+    """
+    delimiters = field_count - 1
+    for line in lines:
+        if COMMENT not in line and line.count(DELIMITER) == delimiters:
+            continue
+        line = line.split(COMMENT, 1)[0].strip()
+        if line and line.count(DELIMITER) != delimiters:
+            return False
+    return True
+
+
+def _parse_rows(lines, field_count, columns, dtype):
+    """
+    Slow but forgiving line-by-line parser used around bad rows
+
+    :returns: a tuple of (2D array, number of skipped rows)
+    """
+    rows = []
+    skipped = 0
+    for line in lines:
+        line = line.split(COMMENT, 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split(DELIMITER)
+        if len(fields) != field_count:
+            skipped += 1
+            continue
+        if columns is not None:
+            fields = [fields[index] for index in columns]
+        rows.append([_to_float(field) for field in fields])
+    width = field_count if columns is None else len(columns)
+    return np.array(rows, dtype=dtype).reshape(-1, width), skipped
+
+
+def _to_float(field):
+    """
+    Convert a CSV field to a float, returning NaN if it isn't a number
+    """
+    try:
+        return float(field)
+    except ValueError:
+        return float("nan")
@@ -8,25 +8,27 @@ Created by Anthony Byrne & Silvia Zhang for ENG EK128 (Spring 2016)
 
 See LICENSE for MIT/X11 license info.
 See README.md for all other help.
+
+Run it with "python echo.py", or import it and call main() with a list of
+command line arguments. Only the standard library is imported up front: NumPy,
+matplotlib, SciPy and the Google Drive client each take a noticeable fraction
+of a second to load, so they're imported by the stage that first needs them.
+That way --help, offline runs and runs with nothing to plot don't pay for them.
 """
 
 ### IMPORTS ###
 import time
 APP_START_TIME = int(round(time.time() * 1000))
 import getopt
+import fnmatch
 import sys
 import os
 from datetime import datetime
-#import numpy as np
-from numpy import genfromtxt, dtype, array
-from remote_storage import GoogleDrive
+import threading
+import scanner
+import instrumentation
 from echo_logger import Logger
 
-### CONSTANTS ###
-VIDEO_FILE_TYPES = (".mp4", ".mov", ".avi")
-DATA_FILE_TYPES = (".csv")
-PLOT_FILE_TYPES = (".pdf")
-
 ### GLOBALS ###
 # Interactive Mode: shows graph in pop-up windows without saving them to file
 interactive_mode = False
@@ -34,6 +36,8 @@ interactive_mode = False
 verbose_mode = False
 # Log Path: log all messages to a file if set
 log_path = None
+# JSON Log: write the log file as JSON lines (with levels and millisecond times)
+json_log = False
 # Search Path: the folder to search for relevant files in (videos, CSV's, etc.)
 search_path = None
 # Client Secret Path: the path to the file that contains our Google Drive API
@@ -55,6 +59,82 @@ t_zero = 0.0
 override_t_zero = False
 # Trim interval. Discard all data this amount of time before and after T0
 trim_interval = None
+# Float32 mode. Store parsed telemetry as 32-bit floats to halve memory use
+float32_mode = False
+# Parse threads. Number of threads used to parse each CSV file
+parse_threads = os.cpu_count() or 1
+# Cache. Keep parsed CSVs as memory-mapped .npy files between runs. The size
+# defaults to TelemetryCache.DEFAULT_MAX_BYTES if not set
+use_cache = True
+cache_path = os.getcwd() + "/.echo_cache"
+cache_size = None
+# Upload workers. Number of files uploaded to Google Drive at once. Defaults to
+# GoogleDrive.DEFAULT_UPLOAD_WORKERS if not set
+upload_workers = None
+# Ledger. Remember uploaded files so later runs only upload new or changed ones
+use_ledger = True
+ledger_path = os.getcwd() + "/echo.ledger"
+# Bandwidth Limit: the most bytes per second all uploads together may use
+bandwidth_limit = None
+# Render Processes: the number of processes drawing plots at once
+render_processes = os.cpu_count() or 1
+# Decimate: thin out long channels before plotting them (peaks are kept)
+decimate_plots = True
+# Sessions Path: where unfinished resumable uploads are remembered between runs
+sessions_path = os.getcwd() + "/echo.sessions"
+# Discovery Path: where the Drive API's discovery document is cached between runs
+discovery_path = os.getcwd() + "/echo.discovery"
+# Compressor: compresses data files on the fly as they are uploaded (a
+# compression.Compressor, or None to upload them as they are)
+compressor = None
+# Export NPZ: also save each data file's parsed channels as a compact .npz in
+# the plots folder, and upload it with the plots
+export_npz = False
+# Summary: write the statistics and event (burn) times of every channel to
+# summary.csv in the plots folder, and upload it with the plots. Event
+# Threshold: the fraction of the way from baseline to peak that starts and ends
+# an event (None for summary.DEFAULT_THRESHOLD)
+use_summary = True
+event_threshold = None
+# Verify. Check the ledger against the checksums Drive has on record
+verify_uploads = False
+# Watch Mode: keep running and process new files as they appear in the search path
+watch_mode = False
+# Settle Time: how long a new file must stay unchanged before it is processed
+settle_seconds = 5.0
+# Filters: which filters to apply to which channels (a filters.FilterBank, or
+# None if no filters were given). Each filtered channel is plotted over its raw
+# data. Filter Memory overrides the bank's stream_bytes if set
+filter_bank = None
+filter_memory = None
+# Overlays: patterns of channels (from any data file) to resample onto a common
+# time grid and plot together, and how to resample them (one of resample.METHODS)
+overlay_patterns = []
+resample_method = "linear"
+resample_rate = None
+# Report: write how long each stage took and how much it processed to a JSON
+# file after every batch. Profile Path: also profile each stage with cProfile
+# and save the profiles in this directory, if set
+use_report = True
+report_path = os.getcwd() + "/echo.report.json"
+profile_path = None
+
+### RUN STATE ###
+# Set up by main(): the Logger, the TelemetryCache (or None), the GoogleDrive
+# connection and its UploadScheduler (None when offline), the PlotRenderer
+# (None when there is nothing to plot), the folder plots are saved to and the
+# instrumentation.RunReport timing each stage (main() starts a new one; the
+# default lets csv_to_array() be used on its own). Summaries holds the summary
+# of each data file processed so far (path -> (name, channel names, summary)),
+# so summary.csv covers every batch in watch mode
+logger = None
+cache = None
+drive = None
+scheduler = None
+renderer = None
+folder_name = None
+report = instrumentation.RunReport()
+summaries = {}
 
 
 def print_help():
@@ -64,245 +144,747 @@ def print_help():
     print("BURPG Echo\n"
           "Usage: " + os.path.basename(__file__) +
           " -p search_path [-ahilnovz] [-s secret_path] [-c credentials_path]\n"
+          "       [--json-log] [--float32] [--threads=N] [--no-cache] [--cache-size=MB]\n"
+          "       [--uploads=N] [--no-ledger] [--verify] [--bandwidth=MBPS]\n"
+          "       [--compress=METHOD[:LEVEL]] [--export-npz] [--no-summary]\n"
+          "       [--event-threshold=FRACTION]\n"
+          "       [--plot-processes=N] [--no-decimate] [--watch] [--settle=SECONDS]\n"
+          "       [--filter=PATTERN=SPEC ...] [--filter-config=PATH] [--filter-memory=MB]\n"
+          "       [--overlay=PATTERN ...] [--resample=METHOD[:HZ]] [--no-report] [--profile]\n"
           "\n"
           "See README.md for command line help")
 
 
-# Handle Command Line Options
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "hlaivp:s:c:noz:t:", [
-        "help", "log", "automatic", "interactive", "verbose", "path=",
-        "secret=", "credentials=", "noauth_local_webserver", "offline", "t_zero=", "trim="])
-except getopt.GetoptError:
-    print("Invalid Argument")
-    print_help()
-    sys.exit(2)
-# Loop through the argument list given to us by Getopt and process appropriately
-# See Globals section above and the README for more information about options
-for opt, arg in opts:
-    if opt in ("-h", "--help"):
-        print_help()
-        sys.exit()
-    elif opt in ("-l", "--log"):
-        log_path = os.getcwd() + "/echo.log"
-    elif opt in ("-v", "--verbose"):
-        verbose_mode = True
-    elif opt in ("-a", "--automatic"):
-        interactive_mode = False
-    elif opt in ("-i", "--interactive"):
-        interactive_mode = True
-    elif opt in ("-p", "--path"):
-        search_path = os.path.realpath(arg)
-    elif opt in ("-s", "--secret"):
-        secret_path = os.path.realpath(arg)
-    elif opt in ("-c", "--credentials"):
-        credentials_path = os.path.realpath(arg)
-    elif opt in ("-n", "--noauth_local_webserver"):
-        noauth_local_webserver = True
-    elif opt in ("-o", "--offline"):
-        offline = True
-    elif opt in ("-z", "--t_zero"):
-        override_t_zero = True
-        t_zero = float(arg)
-    elif opt in ("-t", "--trim"):
-        trim_interval = float(arg)
-
-# Create Logger and Write Initial logs
-if log_path is not None and not os.access(os.path.dirname(log_path), os.W_OK):
-    print("ERROR: Unable to write to log. Check permissions.")
-    sys.exit(2)
-
-# Log some key information for debugging purposes
-logger = Logger(verbose_mode, log_path)
-logger.log_verbose("Echo Session Begin")
-logger.log_verbose("Log File: " + str(log_path))
-logger.log_verbose("Interactive Mode: " + str(interactive_mode))
-logger.log_verbose("Search Directory: " + str(search_path))
-logger.log_verbose("API Client Secret File: " + str(secret_path))
-logger.log_verbose("Credentials File: " + str(credentials_path))
-logger.log_verbose("Offline: " + str(offline))
-logger.log_verbose("T0 Time: " + str(t_zero))
-logger.log_verbose("Trim Interval: " + str(trim_interval))
-
-# Sanity Checks
-# Check if a search path was specified
-if search_path is None:
-    logger.log("ERROR: Must specify search directory path.")
-    print_help()
-    sys.exit(2)
-# Check if we can access the search path with read permissions
-if not os.path.isdir(search_path) or not os.access(search_path, os.R_OK):
-    logger.log("ERROR: " + search_path + " does not exist, is not a directory, or is not readable.")
-    print_help()
-    sys.exit(2)
-# Only perform the following checks if we plan to upload to Google Drive
-if not offline:
-    # Check the "client secret" path
-    if secret_path is None:
-        logger.log_verbose("No API client secret file specified. Using " +
-                           os.getcwd() + "/client_secrets.json.")
-        secret_path = os.getcwd() + "/client_secrets.json"
-    # Check that we can access the client secret
-    if not os.path.isfile(secret_path) or not os.access(secret_path, os.R_OK):
-        logger.log("ERROR: " + secret_path + " does not exist, is not a file, or is not readable.")
+def parse_options(argv):
+    """
+    Handle the command line options, setting the globals above. Prints the
+    help text and exits if asked to, or if an option is invalid
+
+    :param argv: the command line arguments, not including the program name
+    """
+    global interactive_mode, verbose_mode, log_path, json_log, search_path, secret_path
+    global credentials_path, noauth_local_webserver, offline, t_zero, override_t_zero
+    global trim_interval, float32_mode, parse_threads, use_cache, cache_size
+    global upload_workers, use_ledger, verify_uploads, bandwidth_limit, render_processes
+    global decimate_plots, watch_mode, settle_seconds, filter_bank, filter_memory
+    global resample_method, resample_rate, use_report, profile_path, compressor, export_npz
+    global use_summary, event_threshold
+    try:
+        opts, _ = getopt.getopt(argv, "hlaivp:s:c:noz:t:", [
+            "help", "log", "json-log", "automatic", "interactive", "verbose", "path=",
+            "secret=", "credentials=", "noauth_local_webserver", "offline", "t_zero=", "trim=",
+            "float32", "threads=", "no-cache", "cache-size=",
+            "uploads=", "no-ledger", "verify", "bandwidth=", "compress=", "export-npz",
+            "no-summary", "event-threshold=",
+            "plot-processes=", "no-decimate", "watch", "settle=",
+            "filter=", "filter-config=", "filter-memory=", "overlay=", "resample=",
+            "no-report", "profile"])
+    except getopt.GetoptError:
+        print("Invalid Argument")
         print_help()
         sys.exit(2)
-    # Try to load a credentials file (not really required, since the user can
-    # just complete the Google authentication flow to get a new one
-    if credentials_path is None:
-        logger.log_verbose("No credentials file specified. Using " +
-                           os.getcwd() + "/drive.credentials.")
-        credentials_path = os.getcwd() + "/drive.credentials"
+    # Filter rules are kept in order and only parsed once every option has been
+    # read, so that filters (and NumPy) are never loaded unless they're used
+    filter_options = []
+    # Loop through the argument list given to us by Getopt and process appropriately
+    # See Globals section above and the README for more information about options
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print_help()
+            sys.exit()
+        elif opt in ("-l", "--log"):
+            log_path = os.getcwd() + "/echo.log"
+        elif opt == "--json-log":
+            json_log = True
+        elif opt in ("-v", "--verbose"):
+            verbose_mode = True
+        elif opt in ("-a", "--automatic"):
+            interactive_mode = False
+        elif opt in ("-i", "--interactive"):
+            interactive_mode = True
+        elif opt in ("-p", "--path"):
+            search_path = os.path.realpath(arg)
+        elif opt in ("-s", "--secret"):
+            secret_path = os.path.realpath(arg)
+        elif opt in ("-c", "--credentials"):
+            credentials_path = os.path.realpath(arg)
+        elif opt in ("-n", "--noauth_local_webserver"):
+            noauth_local_webserver = True
+        elif opt in ("-o", "--offline"):
+            offline = True
+        elif opt in ("-z", "--t_zero"):
+            override_t_zero = True
+            t_zero = float(arg)
+        elif opt in ("-t", "--trim"):
+            trim_interval = float(arg)
+        elif opt == "--float32":
+            float32_mode = True
+        elif opt == "--threads":
+            parse_threads = max(1, int(arg))
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--cache-size":
+            cache_size = int(float(arg) * 1024 * 1024)
+        elif opt == "--uploads":
+            upload_workers = max(1, int(arg))
+        elif opt == "--no-ledger":
+            use_ledger = False
+        elif opt == "--verify":
+            verify_uploads = True
+        elif opt == "--bandwidth":
+            try:
+                bandwidth_limit = float(arg) * 1e6
+            except ValueError:
+                bandwidth_limit = None
+            if not bandwidth_limit or not 0 < bandwidth_limit < float("inf"):
+                print("Invalid Bandwidth: " + arg + " (use a number of MB/s above 0)")
+                print_help()
+                sys.exit(2)
+        elif opt == "--compress":
+            import compression
+            try:
+                method, level = compression.parse_method(arg)
+            except ValueError as error:
+                print("Invalid Compression: " + str(error))
+                print_help()
+                sys.exit(2)
+            compressor = compression.Compressor(method, level)
+        elif opt == "--export-npz":
+            export_npz = True
+        elif opt == "--no-summary":
+            use_summary = False
+        elif opt == "--event-threshold":
+            event_threshold = float(arg)
+            if not 0 < event_threshold < 1:
+                print("Invalid Event Threshold: " + arg + " (use a fraction between 0 and 1)")
+                print_help()
+                sys.exit(2)
+        elif opt == "--plot-processes":
+            render_processes = max(1, int(arg))
+        elif opt == "--no-decimate":
+            decimate_plots = False
+        elif opt == "--watch":
+            watch_mode = True
+        elif opt == "--settle":
+            settle_seconds = max(0.0, float(arg))
+        elif opt in ("--filter", "--filter-config"):
+            filter_options.append((opt, arg))
+        elif opt == "--filter-memory":
+            filter_memory = int(float(arg) * 1024 * 1024)
+        elif opt == "--overlay":
+            overlay_patterns.append(arg)
+        elif opt == "--resample":
+            import resample
+            resample_method, _, rate_text = arg.lower().partition(":")
+            if resample_method not in resample.METHODS:
+                print("Invalid Resampling Method: " + resample_method)
+                print_help()
+                sys.exit(2)
+            try:
+                resample_rate = float(rate_text) if rate_text else None
+            except ValueError:
+                resample_rate = float("nan")
+            if resample_rate is not None and not 0 < resample_rate < float("inf"):
+                print("Invalid Resampling Rate: " + rate_text + " (use a number of Hz above 0)")
+                print_help()
+                sys.exit(2)
+        elif opt == "--no-report":
+            use_report = False
+        elif opt == "--profile":
+            profile_path = os.getcwd() + "/echo.profile"
+
+    if filter_options:
+        import filters
+        filter_bank = filters.FilterBank()
+        if filter_memory is not None:
+            filter_bank.stream_bytes = filter_memory
+        try:
+            for opt, arg in filter_options:
+                if opt == "--filter":
+                    filter_bank.add(arg)
+                else:
+                    filter_bank.load(arg)
+        except (OSError, ValueError) as error:
+            print("Invalid Filter: " + str(error))
+            print_help()
+            sys.exit(2)
+
+
+def csv_to_array(path, columns=None, window=None, with_times=False):
+    """
+    Read a CSV file into a NumPy array, while ensuring that the resulting array is 2D
+
+    A file whose array would be bigger than --filter-memory is parsed a block at
+    a time straight into a memory-mapped .npy file: a cache entry, or a scratch
+    file with --no-cache. So it never has to fit in memory.
+
+    :param path: path to CSV file
+    :param columns: a sequence of column indices to keep, or None for all
+    :param window: a tuple of (earliest, latest) raw times to read, or None
+    for the whole file. Parts of the file well outside the window are skipped,
+    but some rows outside it are still returned (see csv_reader.read_csv)
+    :param with_times: also return the first column on its own as float64. In
+    float32 mode the array's copy of it is rounded, which would lose a long
+    test's milliseconds, so this one is parsed and cached separately
+    :returns: the resulting NumPy array, in column-major order so that each
+    column is contiguous, or a tuple of (times, array) if with_times is set
+    """
+    import numpy as np
+    import csv_reader
+    import filters
+    data_type = np.float32 if float32_mode else np.float64
+    split_times = with_times and data_type != np.float64
+    out_of_core = csv_reader.estimate_bytes(path, columns, data_type) > \
+        (filter_memory or filters.DEFAULT_STREAM_BYTES)
+    # The float64 times parsed alongside a float32 array, waiting to be cached,
+    # as (times, path of the .npy file they were parsed into or None) tuples
+    parsed_times = []
+
+    def parse(csv_path, npy_path=None):
+        allocate = None
+        # Times parsed into the cache wait beside the array for their own entry
+        times_path = npy_path + ".times" if split_times and npy_path else None
+        if out_of_core:
+            allocate = csv_reader.memmap_allocator(([times_path] if split_times else []) +
+                                                   [npy_path])
+        try:
+            with report.span("parse", csv_path):
+                parsed = csv_reader.read_csv(csv_path, columns=columns, dtype=data_type,
+                                             threads=parse_threads, logger=logger, order="F",
+                                             window=window,
+                                             time_dtype=np.float64 if split_times else None,
+                                             allocate=allocate)
+        except BaseException:
+            if times_path is not None and os.path.exists(times_path):
+                os.remove(times_path)
+            raise
+        if split_times:
+            times, parsed = parsed
+            parsed_times.append((times, times_path))
+        report.count(instrumentation.BYTES_READ, os.path.getsize(csv_path))
+        report.count(instrumentation.SAMPLES_PARSED,
+                     parsed.shape[0] * max(parsed.shape[1] - 1, 0))
+        return parsed
+
+    def parse_times(csv_path, npy_path=None):
+        if parsed_times:
+            times, times_path = parsed_times.pop()
+            if npy_path is not None:
+                os.replace(times_path, npy_path)
+            return times
+        # Only needed if the array was cached but its times have since been evicted
+        allocate = csv_reader.memmap_allocator([npy_path, None]) if out_of_core else None
+        with report.span("parse", csv_path):
+            return csv_reader.read_csv(csv_path, columns=[0 if columns is None else columns[0]],
+                                       threads=parse_threads, logger=logger, window=window,
+                                       time_dtype=np.float64, allocate=allocate)[0]
+
+    options = "columns=" + str(columns) + " dtype=" + np.dtype(data_type).str + " order=F"
+    if window is not None:
+        options += " window=" + repr(window)
+    if cache is None:
+        arr = parse(path)
+    else:
+        arr = cache.load(path, parse, options, stream=out_of_core)
+    # Keep the old genfromtxt() behaviour for a 1 line CSV, which was padded
+    # with a leading row of zeros
+    if arr.shape[0] == 1:
+        arr = np.asfortranarray(np.vstack((np.zeros_like(arr), arr)))
+    if not with_times:
+        return arr
+    if not split_times:
+        return arr[:, 0], arr
+    if cache is None:
+        times = parse_times(path)
+    else:
+        times = cache.load(path, parse_times, options + " times", stream=out_of_core)
+        # Times parsed with an array after they were found in the cache
+        for _, times_path in parsed_times:
+            if times_path is not None:
+                os.remove(times_path)
+    if len(times) == 1:
+        times = np.concatenate((np.zeros(1), times))
+    return times, arr
+
+
+def scan_files(path):
+    """
+    Search the given path recursively for videos, data files, plots and the T0 file
 
-logger.log_verbose("Initialization complete. Welcome to BURPG Echo.")
+    :param path: the path to search
+    :returns: a scanner.Manifest of the files found
+    """
+    with report.span("scan"):
+        manifest = scanner.scan(path)
+    for entry in manifest.entries:
+        if entry.kind == scanner.VIDEO:
+            logger.log_verbose("Found video file: " + entry.path)
+        elif entry.kind == scanner.DATA:
+            logger.log_verbose("Found data file: " + entry.path)
+    return manifest
 
 
-def csv_to_array(path):
+def load_t0(manifest):
     """
-    Read a CSV file into a NumPy array, while ensuring that the resulting array is 2D
+    Look through the manifest for a "t0_time.csv" file and use it to set the t_zero
+    global variable, unless a T0 was given on the command line
 
-    :param path: path to CSV file
-    :returns: the resulting NumPy array
+    :param manifest: the scanner.Manifest to look through
     """
-    arr = genfromtxt(path, delimiter=",", dtype=dtype(float))
-    # Ensure the array is 2D (since genfromtxt() reads a 1 line CSV as a 1D array)
-    if len(arr.shape) is 1:
-        arr = array([array([0, 0]), arr])
-    return arr
+    global t_zero
+    if override_t_zero:
+        return
+    for t0_path in manifest.paths(scanner.T0):
+        t0_times, t0_arr = csv_to_array(t0_path, with_times=True)
+        for raw_time, row in zip(t0_times, t0_arr):
+            if row[1] > 0:
+                t_zero = float(raw_time)
+        logger.log_verbose("Found new T0 time from file: " + str(t_zero))
+
+def report_uploads(responses, kind):
+    """
+    Log how a batch of uploads went
+
+    :param responses: the dict returned by GoogleDrive.upload_files
+    :param kind: the kind of file uploaded, e.g. "data"
+    """
+    failed = [path for path, response in responses.items() if response is None]
+    if failed:
+        logger.log("WARNING: " + str(len(failed)) + " " + kind + " file(s) failed to upload.")
+    else:
+        logger.log("All " + kind + " files uploaded.")
 
 
-def find_videos(path):
+def queue_uploads(scheduler, uploads):
     """
-    Search the given path recursively and return a list of video files
+    Queue the files that aren't already on Drive for upload, each kind into a
+    new timestamped folder. The folders are created together in one batch
 
-    :param path: the path to search
-    :returns: a list of video file path strings
+    :param scheduler: the UploadScheduler to queue the files on
+    :param uploads: a list of (file_list, kind, folder_prefix, priority)
+    tuples, e.g. (paths, "data", "EchoData-", UploadScheduler.DATA)
+    :returns: a dict mapping each kind to the list of paths queued
     """
-    # "Walk" through the files in the search dir and check for video file extensions
-    output_list = list()
-    for subdir, dirs, files in os.walk(path):
-        del dirs
-        for file in files:
-            if file.lower().endswith(VIDEO_FILE_TYPES):
-                output_list.append(os.path.join(subdir, file))
-                logger.log_verbose("Found video file: " + os.path.join(subdir, file))
-    return output_list
-
-
-def find_data(path):
+    queued = {}
+    folders = []
+    for file_list, kind, folder_prefix, priority in uploads:
+        pending = drive.pending_uploads(file_list, verify_uploads, upload_workers)
+        queued[kind] = pending
+        if not pending:
+            logger.log("All " + kind + " files were already uploaded.")
+            continue
+        logger.log("Queueing " + str(len(pending)) + " " + kind + " file(s) for upload...")
+        if len(pending) < len(file_list):
+            logger.log("Skipping " + str(len(file_list) - len(pending)) +
+                       " " + kind + " file(s) uploaded by an earlier run.")
+        folders.append((pending, folder_prefix + datetime.utcnow().strftime("%Y.%m.%d.%H%M"),
+                        priority))
+    folder_ids = drive.create_folders([folder_name for _, folder_name, _ in folders])
+    for (pending, _, priority), folder_id in zip(folders, folder_ids):
+        # Files whose folder couldn't be made aren't uploaded, so they're
+        # reported as failed
+        if folder_id is not None:
+            for file_path in pending:
+                scheduler.submit(file_path, folder_id, priority)
+    return queued
+
+def lazy_folder(drive, folder_name):
     """
-    Search the given path recursively and return a list of telemetry data files.
-    Also looks for a "t0_time.csv" file to set the t_zero gloabl variable.
+    Make a function that creates a Drive folder the first time it is called and
+    returns its ID every time, so no folder is made if nothing goes into it
 
-    :param path: the path to search
-    :returns: a list of data file path strings
+    :param drive: the GoogleDrive connection
+    :param folder_name: the desired name of the folder
+    :returns: a thread-safe function returning the folder's ID
     """
-    # "Walk" through the files in the search dir and check for data file extensions
-    output_list = list()
-    for subdir, dirs, files in os.walk(path):
-        del dirs
-        for file in files:
-            if file.lower().endswith(DATA_FILE_TYPES) and not file.lower().endswith("t0_time.csv"):
-                output_list.append(os.path.join(subdir, file))
-                logger.log_verbose("Found data file: " + os.path.join(subdir, file))
-            # Look for the T0 file
-            if not override_t_zero and file.lower().endswith("t0_time.csv"):
-                t0_arr = csv_to_array(os.path.join(subdir, file))
-                for row in t0_arr:
-                    if row[1] > 0:
-                        global t_zero
-                        t_zero = float(row[0])
-                logger.log_verbose("Found new T0 time from file: " + str(t_zero))
-    return output_list
-
-# Locate Files of Interest
-data_list = find_data(search_path)
-video_list = find_videos(search_path)
-
-# Create Google Drive connection (will prompt for user login if necessary)
-if not offline:
-    drive = GoogleDrive(logger, secret_path=secret_path,
-                        credentials_path=credentials_path,
-                        noauth_local_webserver=noauth_local_webserver)
-
-# Upload Data Files (if applicable)
-if not offline and len(data_list) is not 0:
-    logger.log("Beginning Data File Upload...")
-    folder_id = drive.create_folder("EchoData-" + datetime.utcnow().strftime("%Y.%m.%d.%H%M"))
-    for data_file in data_list:
-        drive.upload_file(data_file, folder_id)
-    logger.log("All data files uploaded.")
-else:
-    logger.log("Offline, or no data files found. Skipping upload.")
-
-# Upload Video Files (if applicable)
-if not offline and len(video_list) is not 0:
-    logger.log("Beginning Video File Upload...")
-    folder_id = drive.create_folder("EchoVideo-" + datetime.utcnow().strftime("%Y.%m.%d.%H%M"))
-    for video_file in video_list:
-        drive.upload_file(video_file, folder_id)
-    logger.log("All video files uploaded.")
-else:
-    logger.log("Offline, or no video files found. Skipping upload.")
-
-# Generate Data Plots
-folder_name = "EchoPlots-" + datetime.utcnow().strftime("%Y.%m.%d.%H%M")
-plot_list = []
-if len(data_list) is not 0:
-    logger.log("Beginning Plot Generation...")
-    import plotting
-    # Ensure our plots folder exists
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
-    # Create a DataAnalysis object
-    analysis = plotting.DataAnalysis(logger, interactive_mode, folder_name)
-    # Loop through the data files and plot them, recording plot paths as we go
-    for data_file in data_list:
-        raw_data_array = csv_to_array(data_file)
-        dataset = plotting.DataSet(os.path.basename(
-            data_file)[:-4], raw_data_array[:, 0], raw_data_array[:, 1])
-        dataset.set_t0(t_zero)
-        if trim_interval is None:
-            plot_list.append(analysis.plot_dataset(dataset, xlabel="Time (s)",
-                                                   ylabel="Units"))
-        else:
-            plot_list.append(analysis.plot_dataset(dataset, xlabel="Time (s)",
-                                                   ylabel="Units",
-                                                   xlimits=(-trim_interval, trim_interval)))
-
-    ## Filtered multiplot test code ##
-    multilist = []
-
-    # Run the first dataset through a 5th order Butterworth filter
-    filtered_data = analysis.butter_filter_data(raw_data_array[:, 1], 5, 2/150/2)
-    raw_data_array = csv_to_array(data_list[0])
-
-    # Create a new DataSet object based on the filtered data
-    multilist.append(plotting.DataSet(os.path.basename(
-        data_list[0])[:-4], raw_data_array[:, 0], filtered_data))
-    multilist[0].set_t0(t_zero)
-
-    # Run the second dataset through a 5th order Butterworth filter
-    raw_data_array = csv_to_array(data_list[1])
-    filtered_data = analysis.butter_filter_data(raw_data_array[:, 1], 5, 2/150/2)
-
-    # Create a new DataSet object based on the filtered data
-    multilist.append(plotting.DataSet(os.path.basename(
-        data_list[1])[:-4], raw_data_array[:, 0], filtered_data))
-    multilist[1].set_t0(t_zero)
-    plot_list.append(analysis.plot_dataset(multilist, xlabel="Time (s)", ylabel="Units"))
-
-
-# Upload Plots (if applicable)
-if not offline and len(plot_list) is not 0:
-    logger.log("Beginning Plot File Upload...")
-    folder_id = drive.create_folder("EchoPlots-" + datetime.utcnow().strftime("%Y.%m.%d.%H%M"))
-    for plot_file in plot_list:
-        drive.upload_file(plot_file, folder_id)
-    logger.log("All plot files uploaded.")
-else:
-    logger.log("Offline, or no plot files found. Skipping upload.")
-
-# All Done!
-logger.log("All operations completed after " +
-           str(int(round(time.time() * 1000)) - APP_START_TIME) + "ms. Goodbye.")
+    lock = threading.Lock()
+    folder_ids = []
+
+    def folder_id():
+        with lock:
+            if not folder_ids:
+                folder_ids.append(drive.create_folder(folder_name))
+            return folder_ids[0]
+    return folder_id
+
+
+def process_files(data_list, video_list):
+    """
+    Upload a batch of data and video files, plot every channel of the data
+    files and upload the plots, then wait for all of it to finish. The plot
+    renderer and upload scheduler are left running for the next batch
+
+    :param data_list: paths to the data files in the batch
+    :param video_list: paths to the video files in the batch
+    """
+    uploads = []
+    if not offline:
+        from remote_storage import UploadScheduler
+
+    # Queue Data Files for Upload (if applicable)
+    if not offline and data_list:
+        uploads.append((data_list, "data", "EchoData-", UploadScheduler.DATA))
+    else:
+        logger.log("Offline, or no data files found. Skipping upload.")
+
+    # Queue Video Files for Upload (if applicable)
+    if not offline and video_list:
+        uploads.append((video_list, "video", "EchoVideo-", UploadScheduler.VIDEO))
+    else:
+        logger.log("Offline, or no video files found. Skipping upload.")
+    queued = {}
+    if uploads:
+        with report.span("queue"):
+            queued = queue_uploads(scheduler, uploads)
+
+    # Upload each Plot as soon as it is Drawn (if applicable)
+    if not offline and data_list:
+        queued["plot"] = []
+        plot_folder = lazy_folder(drive, "EchoPlots-" +
+                                  datetime.utcnow().strftime("%Y.%m.%d.%H%M"))
+
+        def queue_plot(plot_path):
+            """
+            Queue a freshly drawn plot for upload, unless an identical copy is on Drive
+            """
+            queued["plot"].append(plot_path)
+            scheduler.submit(plot_path, plot_folder, UploadScheduler.PLOT, skip_uploaded=True)
+        renderer.on_plotted = queue_plot
+    else:
+        logger.log("Offline, or no data files found. Skipping plot upload.")
+
+    # Generate Data Plots
+    if data_list:
+        import pipeline
+        import plotting
+        logger.log("Beginning Plot Generation...")
+        # Ensure our plots folder exists
+        if not os.path.exists(folder_name):
+            os.makedirs(folder_name)
+        # Loop through the data files and queue a plot for every channel in them.
+        # The next file is parsed in the background while this one is plotted
+        # With --trim, only the window around T0 is parsed, filtered and plotted
+        window = None if trim_interval is None else (-trim_interval, trim_interval)
+
+        def read_data(data_file):
+            if window is None:
+                return csv_to_array(data_file, with_times=True)
+            return csv_to_array(data_file, window=(window[0] + t_zero, window[1] + t_zero),
+                                with_times=True)
+
+        # pattern -> list of (names, times, values) for each file with matching channels
+        overlays = {pattern: [] for pattern in overlay_patterns}
+        for data_file, parsed, error in pipeline.prefetch(read_data, data_list):
+            if error is not None:
+                logger.log("ERROR: Unable to read " + data_file + ": " + str(error))
+                continue
+            channels = plotting.ChannelSet(os.path.basename(data_file)[:-4], parsed[1],
+                                           times=parsed[0])
+            channels.set_t0(t_zero)
+            trimmed = channels
+            if window is not None:
+                if not channels.is_sorted():
+                    logger.log("WARNING: The times in " + data_file + " aren't in order, " +
+                               "so it is trimmed by checking every sample.")
+                trimmed = channels.trim(window[0], window[1])
+            # With --trim, only the window is exported and summarised: the rest
+            # of what was parsed is whole blocks of the file either side of it,
+            # which depend on where the block boundaries fall
+            if export_npz:
+                export_path = os.path.join(folder_name, channels.dataname + ".npz")
+                with report.span("export", data_file):
+                    trimmed.save_npz(export_path)
+                logger.log_verbose("Exported " + export_path)
+                if not offline:
+                    queue_plot(export_path)
+            if use_summary:
+                import summary
+                with report.span("summary", data_file):
+                    summaries[data_file] = (trimmed.dataname, trimmed.names, summary.summarize(
+                        trimmed, event_threshold or summary.DEFAULT_THRESHOLD))
+            plots = list(trimmed)
+            for pattern in overlay_patterns:
+                indices = [index for index, name in enumerate(trimmed.names)
+                           if fnmatch.fnmatchcase(name, pattern)]
+                if indices and len(trimmed.data) > 1:
+                    overlays[pattern].append((
+                        [trimmed.names[index] for index in indices], trimmed.times,
+                        trimmed.data[:, [index + 1 for index in indices]]))
+            # Filter each group of matching channels in one pass, and plot
+            # every filtered channel over its raw data. A trimmed filter still
+            # sees a margin of samples either side of the window
+            if filter_bank is not None:
+                import filters
+                with report.span("filter", data_file):
+                    for index, spec, xlist, ylist in filter_bank.filter_channels(channels, logger,
+                                                                                 window):
+                        dataset = plots[index]
+                        plots.append([dataset, plotting.DataSet(
+                            dataset.dataname + "_" + filters.spec_label(spec), xlist, ylist,
+                            t_zero)])
+            # With a pool of plot processes this mostly times handing the plots
+            # over (and waiting for room in the queue); otherwise it includes
+            # drawing them
+            with report.span("plot", data_file):
+                for plot in plots:
+                    report.count(instrumentation.POINTS_PLOTTED,
+                                 sum(len(dataset) for dataset in plot)
+                                 if isinstance(plot, list) else len(plot))
+                    if trim_interval is None:
+                        renderer.submit(plot, xlabel="Time (s)", ylabel="Units")
+                    else:
+                        renderer.submit(plot, xlabel="Time (s)", ylabel="Units",
+                                        xlimits=(-trim_interval, trim_interval))
+
+        if use_summary and summaries:
+            import summary
+            summary_path = os.path.join(folder_name, "summary.csv")
+            with report.span("summary"):
+                summary.write_csv(summary_path, [summaries[path] for path in sorted(summaries)])
+            logger.log("Summarised " + str(sum(len(names) for _, names, _ in summaries.values())) +
+                       " channel(s) in " + summary_path + ".")
+            if not offline:
+                queue_plot(summary_path)
+
+        # Put the channels of each overlay onto a common time grid, so channels
+        # logged at different rates line up sample for sample
+        for pattern, groups in overlays.items():
+            import resample
+            names = [name for group in groups for name in group[0]]
+            if len(names) < 2:
+                logger.log("WARNING: Fewer than two channels match overlay " + pattern + ".")
+                continue
+            try:
+                with report.span("overlay"):
+                    grid, aligned = resample.align([group[1:] for group in groups],
+                                                   resample_rate, resample_method)
+            except ValueError as error:
+                logger.log("WARNING: Unable to overlay " + pattern + ": " + str(error))
+                continue
+            overlay = [plotting.DataSet(name, grid, aligned[:, index], t_zero)
+                       for index, name in enumerate(names)]
+            if trim_interval is None:
+                renderer.submit(overlay, xlabel="Time (s)", ylabel="Units")
+            else:
+                renderer.submit(overlay, xlabel="Time (s)", ylabel="Units",
+                                xlimits=(-trim_interval, trim_interval))
+
+        # Wait for the last plots to be drawn
+        with report.span("render"):
+            plot_list = renderer.drain()
+        report.count(instrumentation.PLOTS_DRAWN, len(plot_list))
+        logger.log("Generated " + str(len(plot_list)) + " plot(s).")
+
+    # Wait for the Uploads to Finish
+    if not offline:
+        with report.span("upload_wait"):
+            responses = scheduler.drain()
+        for kind, file_list in queued.items():
+            if file_list:
+                report_uploads({path: responses.get(path) for path in file_list}, kind)
+
+
+def write_report(final=True):
+    """
+    Save the run report (and any profiles) unless --no-report was given
+
+    :param final: also log how long each stage took. Only done once, at the
+    end of the run; in watch mode the report is saved after every batch too
+    """
+    if final:
+        logger.log_verbose("Stage Times: " + (report.summary() or "None"))
+    if not use_report:
+        return
+    try:
+        report.write(report_path)
+    except OSError as error:
+        logger.log("WARNING: Unable to write run report to " + report_path + ": " + str(error))
+
+
+def main(argv=None):
+    """
+    Run Echo: scan the search path, upload and plot what it finds, then
+    (with --watch) keep processing new files until interrupted
+
+    :param argv: the command line arguments, not including the program name,
+    or None to use sys.argv
+    """
+    global logger, cache, drive, scheduler, renderer, folder_name, report
+    global secret_path, credentials_path, cache_size, upload_workers
+    parse_options(sys.argv[1:] if argv is None else argv)
+
+    # Create Logger and Write Initial logs
+    if log_path is not None and not os.access(os.path.dirname(log_path), os.W_OK):
+        print("ERROR: Unable to write to log. Check permissions.")
+        sys.exit(2)
+
+    # Log some key information for debugging purposes
+    logger = Logger(verbose_mode, log_path, json_log)
+    logger.log_verbose("Echo Session Begin")
+    logger.log_verbose("Log File: " + str(log_path))
+    logger.log_verbose("Log Format: " + ("JSON lines" if json_log else "Text"))
+    logger.log_verbose("Interactive Mode: " + str(interactive_mode))
+    logger.log_verbose("Search Directory: " + str(search_path))
+    logger.log_verbose("API Client Secret File: " + str(secret_path))
+    logger.log_verbose("Credentials File: " + str(credentials_path))
+    logger.log_verbose("Offline: " + str(offline))
+    logger.log_verbose("T0 Time: " + str(t_zero))
+    logger.log_verbose("Trim Interval: " + str(trim_interval))
+    logger.log_verbose("Float32 Mode: " + str(float32_mode))
+    logger.log_verbose("Parse Threads: " + str(parse_threads))
+    logger.log_verbose("Cache: " + (cache_path if use_cache else "Disabled"))
+    logger.log_verbose("Upload Workers: " + ("Default" if upload_workers is None else
+                                            str(upload_workers)))
+    logger.log_verbose("Bandwidth Limit: " + ("None" if bandwidth_limit is None else
+                                             str(bandwidth_limit / 1e6) + " MB/s"))
+    logger.log_verbose("Plot Processes: " + str(render_processes))
+    logger.log_verbose("Decimate Plots: " + str(decimate_plots))
+    logger.log_verbose("Upload Ledger: " + (ledger_path if use_ledger else "Disabled"))
+    logger.log_verbose("Compression: " + ("Disabled" if compressor is None else
+                                         compressor.method + " level " + str(compressor.level)))
+    logger.log_verbose("Export NPZ: " + str(export_npz))
+    logger.log_verbose("Summary: " + (("Threshold " + ("Default" if event_threshold is None else
+                                                       str(event_threshold)))
+                                      if use_summary else "Disabled"))
+    logger.log_verbose("Watch Mode: " + str(watch_mode))
+    logger.log_verbose("Settle Time: " + str(settle_seconds) + "s")
+    if filter_bank is None:
+        logger.log_verbose("Filters: None")
+    else:
+        import filters
+        logger.log_verbose("Filters: " + ", ".join(pattern + "=" + filters.spec_label(spec)
+                                                   for pattern, spec in filter_bank.rules))
+        logger.log_verbose("Filter Memory: " +
+                           str(filter_bank.stream_bytes / (1024 * 1024)) + " MB")
+    logger.log_verbose("Overlays: " + (", ".join(overlay_patterns) or "None"))
+    logger.log_verbose("Resampling: " + resample_method + " at " +
+                       ("the slowest channel's rate" if resample_rate is None else
+                        str(resample_rate) + " Hz"))
+    logger.log_verbose("Run Report: " + (report_path if use_report else "Disabled"))
+    logger.log_verbose("Profiles: " + str(profile_path))
+
+    # Sanity Checks
+    # Check if a search path was specified
+    if search_path is None:
+        logger.log("ERROR: Must specify search directory path.")
+        logger.flush()
+        print_help()
+        sys.exit(2)
+    # Check if we can access the search path with read permissions
+    if not os.path.isdir(search_path) or not os.access(search_path, os.R_OK):
+        logger.log("ERROR: " + search_path +
+                   " does not exist, is not a directory, or is not readable.")
+        logger.flush()
+        print_help()
+        sys.exit(2)
+    # Only perform the following checks if we plan to upload to Google Drive
+    if not offline:
+        # Check the "client secret" path
+        if secret_path is None:
+            logger.log_verbose("No API client secret file specified. Using " +
+                               os.getcwd() + "/client_secrets.json.")
+            secret_path = os.getcwd() + "/client_secrets.json"
+        # Check that we can access the client secret
+        if not os.path.isfile(secret_path) or not os.access(secret_path, os.R_OK):
+            logger.log("ERROR: " + secret_path +
+                       " does not exist, is not a file, or is not readable.")
+            logger.flush()
+            print_help()
+            sys.exit(2)
+        # Try to load a credentials file (not really required, since the user can
+        # just complete the Google authentication flow to get a new one
+        if credentials_path is None:
+            logger.log_verbose("No credentials file specified. Using " +
+                               os.getcwd() + "/drive.credentials.")
+            credentials_path = os.getcwd() + "/drive.credentials"
+
+    logger.log_verbose("Initialization complete. Welcome to BURPG Echo.")
+    report = instrumentation.RunReport(profile_path)
+
+    # Locate Files of Interest
+    manifest = scan_files(search_path)
+    data_list = manifest.paths(scanner.DATA)
+    video_list = manifest.paths(scanner.VIDEO)
+
+    # Open the parsed telemetry cache, unless there's nothing to parse
+    if use_cache and (data_list or manifest.paths(scanner.T0) or watch_mode):
+        from telemetry_cache import TelemetryCache
+        if cache_size is None:
+            cache_size = TelemetryCache.DEFAULT_MAX_BYTES
+        try:
+            cache = TelemetryCache(logger, cache_path, cache_size)
+        except OSError:
+            logger.log("WARNING: Unable to open cache at " + cache_path +
+                       ". Continuing without it.")
+    load_t0(manifest)
+
+    # Start the Plot Rendering Processes. This has to happen before any threads are
+    # started (see plotting.PlotRenderer)
+    folder_name = scanner.OUTPUT_FOLDER_PREFIX + datetime.utcnow().strftime("%Y.%m.%d.%H%M")
+    if data_list or watch_mode:
+        import plotting
+        # Create a DataAnalysis object
+        analysis = plotting.DataAnalysis(logger, interactive_mode, folder_name, decimate_plots)
+        renderer = plotting.PlotRenderer(analysis, render_processes)
+
+    # Create Google Drive connection (will prompt for user login if necessary)
+    if not offline:
+        from upload_ledger import UploadLedger, UploadSessions, DiscoveryCache
+        from remote_storage import GoogleDrive, UploadScheduler
+        if upload_workers is None:
+            upload_workers = GoogleDrive.DEFAULT_UPLOAD_WORKERS
+        with report.span("connect"):
+            drive = GoogleDrive(logger, secret_path=secret_path,
+                                credentials_path=credentials_path,
+                                noauth_local_webserver=noauth_local_webserver,
+                                ledger=UploadLedger(ledger_path) if use_ledger else None,
+                                sessions=UploadSessions(sessions_path),
+                                bandwidth_limit=bandwidth_limit,
+                                discovery_cache=DiscoveryCache(discovery_path),
+                                compressor=compressor)
+        # Uploads run in the background while the plots are generated. Data files
+        # go first, then plots, then videos
+        scheduler = UploadScheduler(drive, upload_workers, report)
+
+    process_files(data_list, video_list)
+
+    # Keep Watching for New Files (if applicable). The Drive connection, upload
+    # workers, plot processes and telemetry cache all stay up between batches
+    if watch_mode:
+        import watcher
+        write_report(final=False)
+        logger.log("Watching " + search_path + " for new files. Press Ctrl+C to stop.")
+        directory_watcher = watcher.DirectoryWatcher(logger, search_path, manifest.entries,
+                                                     settle_seconds)
+        try:
+            while True:
+                ready = scanner.Manifest(search_path, directory_watcher.wait_for_changes())
+                new_data_list = ready.paths(scanner.DATA)
+                if ready.paths(scanner.T0) and not override_t_zero:
+                    # A new T0 moves every plot, so redraw them all
+                    manifest = scan_files(search_path)
+                    load_t0(manifest)
+                    new_data_list = manifest.paths(scanner.DATA)
+                logger.log("Found " + str(len(ready)) + " new or changed file(s).")
+                process_files(new_data_list, ready.paths(scanner.VIDEO))
+                write_report(final=False)
+                logger.log("Watching " + search_path + " for new files. Press Ctrl+C to stop.")
+        except KeyboardInterrupt:
+            logger.log("Stopped watching " + search_path + ".")
+        directory_watcher.close()
+
+    # Shut Down the Plot Processes and Upload Workers
+    if renderer is not None:
+        renderer.wait()
+    if scheduler is not None:
+        scheduler.wait()
+    write_report()
+
+    # All Done!
+    logger.log("All operations completed after " +
+               str(int(round(time.time() * 1000)) - APP_START_TIME) + "ms. Goodbye.")
+    logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,20 +5,94 @@ BURPG Echo
 See LICENSE for MIT/X11 license info.
 See README.md for all other help.
 """
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
 import time
+import weakref
+
+# Levels, as written to a JSON lines log. Messages logged with log() that start
+# with "ERROR:" or "WARNING:" get that level, the rest get INFO
+DEBUG = "DEBUG"
+INFO = "INFO"
+WARNING = "WARNING"
+ERROR = "ERROR"
+
+# Every Logger that hasn't been closed. The exit and fork hooks below are
+# registered once for all of them, so a Logger that is dropped can be freed
+_live_loggers = weakref.WeakSet()
+
+
+def _close_all():
+    """
+    Close every open Logger, writing out what they have queued (run at exit)
+    """
+    for logger in list(_live_loggers):
+        logger.close()
+
+
+def _flush_all():
+    """
+    Flush every open Logger (run before forking)
+    """
+    for logger in list(_live_loggers):
+        logger.flush()
+
+
+def _after_fork_all():
+    """
+    Reset every open Logger's writer state in a freshly forked child
+    """
+    for logger in list(_live_loggers):
+        logger._after_fork()  # pylint: disable=W0212
+
+
+atexit.register(_close_all)
+if hasattr(os, "register_at_fork"):
+    # A forked child (e.g. a plot process) only gets the thread that forked
+    # it, so quiet the writers first and start afresh in the child
+    os.register_at_fork(before=_flush_all, after_in_child=_after_fork_all)
 
 
 class Logger:
     """
     Provides a logging "singleton" instance that can be passed around as needed
+
+    Logging never waits for the console or the disk: messages are stamped with
+    the time they were logged and handed through a queue to a background
+    writer thread, which writes whatever has queued up in one go. The log file
+    is opened once and kept open. flush() waits for everything logged so far
+    to be written, and close() (which runs automatically at exit) also stops
+    the writer and closes the file.
     """
 
     LOG_PATH = None
     VERBOSE_MODE = False
+    JSON_MODE = False
+
+    def __init__(self, verbose=False, path=None, json_lines=False):
+        """
+        Constructor
 
-    def __init__(self, verbose=False, path=None):
+        :param verbose: also log the messages passed to log_verbose
+        :param path: the path of a file to append every message to, or None
+        :param json_lines: write the file as JSON lines, one object per message
+        with "time" (UTC, to the millisecond), "level" and "message" keys,
+        instead of "[unix time] message" lines
+        """
         self.VERBOSE_MODE = verbose
         self.LOG_PATH = path
+        self.JSON_MODE = json_lines
+        self.json_second = (None, None)
+        self.logfile = None
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.writer = None
+        self.closed = False
+        _live_loggers.add(self)
 
     def log(self, message):
         """
@@ -26,10 +100,13 @@ class Logger:
 
         :param message: the message to be logged
         """
-        print(message)
-        if self.LOG_PATH != None:
-            with open(self.LOG_PATH, "a") as logfile:
-                logfile.write("[" + str(int(time.time())) + "] " + message + "\n")
+        if message.startswith(ERROR + ":"):
+            level = ERROR
+        elif message.startswith(WARNING + ":"):
+            level = WARNING
+        else:
+            level = INFO
+        self._put(level, message)
 
     def log_verbose(self, message):
         """
@@ -39,4 +116,111 @@ class Logger:
         :param message: the verbose message to be logged
         """
         if self.VERBOSE_MODE:
-            self.log(message)
+            self._put(DEBUG, message)
+
+    def flush(self):
+        """
+        Wait until every message logged so far has been written
+        """
+        with self.lock:
+            running = self.writer is not None
+        if running:
+            self.queue.join()
+
+    def close(self):
+        """
+        Write every message logged so far, stop the writer thread and close the
+        log file. Anything logged afterwards is written straight away
+        """
+        with self.lock:
+            writer, self.writer = self.writer, None
+            self.closed = True
+        _live_loggers.discard(self)
+        if writer is not None:
+            self.queue.put(None)
+            writer.join()
+        if self.logfile is not None:
+            self.logfile.close()
+            self.logfile = None
+
+    def _put(self, level, message):
+        """
+        Queue a message for the writer thread, starting it if need be
+        """
+        record = (time.time(), level, message)
+        with self.lock:
+            if self.closed:
+                self._write([record])
+                return
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._work, daemon=True)
+                self.writer.start()
+            self.queue.put(record)
+
+    def _work(self):
+        """
+        Writer thread body: write queued messages in batches until told to stop
+        """
+        while True:
+            records = [self.queue.get()]
+            try:
+                while True:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = records[-1] is None
+            try:
+                self._write([record for record in records if record is not None])
+            except (OSError, ValueError) as error:
+                # Keep going, so flush() and close() don't wait forever
+                sys.stderr.write("Unable to write to log: " + str(error) + "\n")
+            finally:
+                for _ in records:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, records):
+        """
+        Write records to the console and the log file, then flush both
+
+        :param records: a list of (unix time, level, message) tuples
+        """
+        try:
+            sys.stdout.write("".join(message + "\n" for _, _, message in records))
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            # The console has gone (e.g. a closed pipe); keep logging to the file
+            pass
+        if self.LOG_PATH is None:
+            return
+        if self.logfile is None:
+            self.logfile = open(self.LOG_PATH, "a")
+        self.logfile.write("".join(self._format(*record) for record in records))
+        self.logfile.flush()
+
+    def _format(self, timestamp, level, message):
+        """
+        :returns: one line of the log file
+        """
+        if not self.JSON_MODE:
+            return "[" + str(int(timestamp)) + "] " + message + "\n"
+        if level in (ERROR, WARNING) and message.startswith(level + ":"):
+            message = message[len(level) + 1:].lstrip()
+        # Formatting the date is the slow part, so it's done once per second
+        second = int(timestamp)
+        if second != self.json_second[0]:
+            self.json_second = (second, time.strftime("%Y-%m-%dT%H:%M:%S",
+                                                      time.gmtime(second)))
+        return ('{"time": "' + self.json_second[1] +
+                ".{:03d}Z".format(int((timestamp - second) * 1000)) + '", "level": "' +
+                level + '", "message": ' + json.dumps(message) + "}\n")
+
+    def _after_fork(self):
+        """
+        Reset the writer state in a freshly forked child
+        """
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.writer = None
+        self.logfile = None
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Filtering for telemetry channels. Filters are described by short specs:
+
+    butter:ORDER:CUTOFF[:low|high]  zero-phase Butterworth filter. CUTOFF is a
+                                    fraction of the Nyquist rate (e.g. 0.0067),
+                                    or a frequency with an "hz" suffix (e.g.
+                                    10hz), in which case the sample rate is
+                                    worked out from the time column
+    mavg:SAMPLES                    moving average over SAMPLES samples
+
+and are matched to channels by name with rules of the form PATTERN=SPEC, where
+PATTERN is a shell-style wildcard (e.g. "PT*=butter:5:10hz").
+"""
+
+import fnmatch
+import tempfile
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+BUTTER = "butter"
+MOVING_AVERAGE = "mavg"
+BAND_TYPES = ("low", "high")
+# Blocks of channels bigger than this are filtered a piece at a time into a
+# memory-mapped scratch file, rather than in memory
+DEFAULT_STREAM_BYTES = 256 * 1024 * 1024
+# Each piece is this fraction of the stream limit, which leaves room for the
+# filter's temporary copies of it
+STREAM_BLOCK_FRACTION = 8
+# When a Butterworth filter only sees a window of a channel, it is given this
+# many cycles of the cutoff frequency per filter order on either side, which
+# lets the edge transients die away (to ~1e-5 of the signal) before the window
+MARGIN_CYCLES_PER_ORDER = 2
+# Time columns are checked for order this many samples at a time
+SORT_CHECK_SAMPLES = 1024 * 1024
+
+FilterSpec = namedtuple("FilterSpec", ["kind", "order", "cutoff", "hertz", "btype"])
+
+
+class FilterBank:
+    """
+    FilterBank holds a list of (pattern, FilterSpec) rules and applies them to
+    the channels of a plotting.ChannelSet.
+
+    Channels of one file that match the same spec are filtered together, in a
+    single call over a 2D block of the file's array, rather than one at a time.
+    Butterworth designs are cached as second-order sections, which stay
+    accurate at high orders and low cutoffs where the transfer function (ba)
+    form breaks down.
+    """
+
+    rules = None
+    stream_bytes = DEFAULT_STREAM_BYTES
+    scratch_dir = None
+
+    def __init__(self, rules=(), stream_bytes=DEFAULT_STREAM_BYTES, scratch_dir=None):
+        """
+        Constructor
+
+        :param rules: a sequence of (pattern, FilterSpec) tuples
+        :param stream_bytes: blocks of channels larger than this (as float64)
+        are filtered out-of-core, in pieces, with bounded memory use
+        :param scratch_dir: where to put the memory-mapped output of
+        out-of-core filtering, or None for the system temporary directory
+        """
+        self.rules = list(rules)
+        self.stream_bytes = stream_bytes
+        self.scratch_dir = scratch_dir
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, rule):
+        """
+        Add a rule given as text
+
+        :param rule: a "PATTERN=SPEC" string
+        """
+        self.rules.append(parse_rule(rule))
+
+    def load(self, path):
+        """
+        Add the rules from a config file, one "PATTERN=SPEC" per line. Blank
+        lines and anything after a "#" are ignored
+
+        :param path: path to the config file
+        """
+        with open(path, "r") as config_file:
+            for number, line in enumerate(config_file, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    self.add(line)
+                except ValueError as error:
+                    raise ValueError(path + " line " + str(number) + ": " + str(error))
+
+    def match(self, name):
+        """
+        :param name: a channel name
+        :returns: the list of FilterSpecs whose patterns match the name
+        """
+        return [spec for pattern, spec in self.rules if fnmatch.fnmatchcase(name, pattern)]
+
+    def filter_channels(self, channels, logger=None, window=None):
+        """
+        Filter every matching channel of a ChannelSet
+
+        :param channels: a plotting.ChannelSet
+        :param logger: an optional Logger used to report filters that couldn't
+        be applied (e.g. because a channel is too short)
+        :param window: a tuple of (xmin, xmax) to only filter the samples with
+        xmin <= x <= xmax (after the T0 shift), plus a margin of samples either
+        side (see margin_samples), or None to filter everything
+        :returns: a list of (channel index, FilterSpec, x array, filtered y array)
+        tuples, in channel order
+        """
+        groups = {}
+        for index, name in enumerate(channels.names):
+            for spec in self.match(name):
+                groups.setdefault(spec, []).append(index)
+
+        results = []
+        if not groups:
+            return results
+        for spec, indices in groups.items():
+            columns = [index + 1 for index in indices]
+            try:
+                data, times = channels.data, channels.times
+                if window is not None:
+                    trimmed = channels.trim(window[0], window[1], margin_samples(spec, times))
+                    data, times = trimmed.data, trimmed.times
+                if len(times) * len(columns) * 8 > self.stream_bytes:
+                    xlist, filtered = self._stream(data, columns, spec, times)
+                else:
+                    # Value columns are contiguous in the column-major array, so
+                    # a block of them can be filtered down axis 0 without a transpose
+                    xlist, filtered = apply_filter(np.asfortranarray(data[:, columns]),
+                                                   spec, times)
+                if window is not None:
+                    rows = window_index(xlist, window[0] + channels.t0_time,
+                                        window[1] + channels.t0_time)
+                    xlist, filtered = xlist[rows], filtered[rows]
+            except ValueError as error:
+                if logger is not None:
+                    logger.log("WARNING: Unable to apply " + spec_label(spec) + " to " +
+                               ", ".join(channels.names[index] for index in indices) +
+                               ": " + str(error))
+                continue
+            for column, index in enumerate(indices):
+                results.append((index, spec, xlist, filtered[:, column]))
+        return sorted(results, key=lambda result: result[0])
+
+    def _stream(self, data, columns, spec, times):
+        """
+        Filter some columns of a (typically memory-mapped) array a piece at a
+        time, into a memory-mapped scratch file
+
+        :returns: a tuple of (times for the filtered samples, filtered array)
+        """
+        samples = len(times) - (spec.order - 1 if spec.kind == MOVING_AVERAGE else 0)
+        dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+        # The scratch file is deleted as soon as it is closed, but the mapping
+        # (and so the filtered data) lives on until the array is garbage collected
+        with tempfile.TemporaryFile(dir=self.scratch_dir) as scratch:
+            out = np.memmap(scratch, dtype=dtype, mode="w+",
+                            shape=(max(samples, 0), len(columns)), order="F")
+        block_samples = max(1024, self.stream_bytes // STREAM_BLOCK_FRACTION //
+                            (8 * len(columns)))
+        return stream_filter(data, columns, spec, out, block_samples, times)
+
+
+def parse_spec(text):
+    """
+    Parse a filter spec such as "butter:5:0.0067" or "mavg:50"
+
+    :param text: the spec
+    :returns: a FilterSpec
+    :raises ValueError: if the spec is malformed
+    """
+    fields = text.strip().lower().split(":")
+    try:
+        if fields[0] == BUTTER and len(fields) in (3, 4):
+            order = int(fields[1])
+            hertz = fields[2].endswith("hz")
+            cutoff = float(fields[2][:-2] if hertz else fields[2])
+            btype = fields[3] if len(fields) == 4 else "low"
+            if order < 1 or cutoff <= 0 or (not hertz and cutoff >= 1) or \
+                    btype not in BAND_TYPES:
+                raise ValueError()
+            return FilterSpec(BUTTER, order, cutoff, hertz, btype)
+        if fields[0] == MOVING_AVERAGE and len(fields) == 2:
+            order = int(fields[1])
+            if order < 1:
+                raise ValueError()
+            return FilterSpec(MOVING_AVERAGE, order, None, False, None)
+    except ValueError:
+        pass
+    raise ValueError("invalid filter spec '" + text + "'")
+
+
+def parse_rule(text):
+    """
+    Parse a filter rule such as "PT*=butter:5:10hz"
+
+    :param text: the rule
+    :returns: a (pattern, FilterSpec) tuple
+    :raises ValueError: if the rule is malformed
+    """
+    pattern, separator, spec = text.partition("=")
+    if not separator or not pattern.strip():
+        raise ValueError("invalid filter rule '" + text + "', expected PATTERN=SPEC")
+    return pattern.strip(), parse_spec(spec)
+
+
+def spec_label(spec):
+    """
+    :param spec: a FilterSpec
+    :returns: a short name for the filter that is safe to use in a file name,
+    e.g. "butter5-0.0067" or "mavg50"
+    """
+    if spec.kind == MOVING_AVERAGE:
+        return MOVING_AVERAGE + str(spec.order)
+    label = BUTTER + str(spec.order) + "-" + "{:g}".format(spec.cutoff)
+    if spec.hertz:
+        label += "hz"
+    if spec.btype != "low":
+        label += "-" + spec.btype
+    return label
+
+
+@lru_cache(maxsize=64)
+def design_butter(order, cutoff, btype="low"):
+    """
+    Design a Butterworth filter as second-order sections. Designs are cached,
+    so applying the same filter to many channels designs it once
+
+    :param order: the filter order
+    :param cutoff: the cutoff as a fraction of the Nyquist rate
+    :param btype: "low" or "high"
+    :returns: the array of second-order sections, which is shared between
+    callers and must not be modified
+    """
+    # scipy.signal takes most of a second to import, so it is only loaded
+    # once something is actually filtered
+    from scipy import signal
+    return signal.butter(order, cutoff, btype=btype, output='sos')
+
+
+def butter_filter(data, order, cutoff, btype="low", axis=0):
+    """
+    Apply a zero-phase Butterworth filter along one axis of an array
+
+    :param data: a 1D array, or a 2D array with one channel per column
+    :param order: the filter order
+    :param cutoff: the cutoff as a fraction of the Nyquist rate
+    :param btype: "low" or "high"
+    :param axis: the axis to filter along
+    :returns: the filtered array
+    """
+    from scipy import signal
+    return signal.sosfiltfilt(design_butter(order, float(cutoff), btype), data, axis=axis)
+
+
+def moving_average(data, interval, axis=0):
+    """
+    Apply a trailing moving average along one axis of an array. The result is
+    interval - 1 samples shorter than the input
+    Citation: Based on this StackOverflow answer: http://stackoverflow.com/a/14314054
+
+    :param data: a 1D array, or a 2D array with one channel per column
+    :param interval: the number of samples averaged
+    :param axis: the axis to filter along
+    :returns: the averaged array
+    """
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    ret = np.cumsum(data, axis=0, dtype=float)
+    ret[interval:] = ret[interval:] - ret[:-interval]
+    return np.moveaxis(ret[interval - 1:] / interval, 0, axis)
+
+
+def sample_rate(times):
+    """
+    Work out the average sample rate of a time column
+
+    :param times: an array of times in seconds, in increasing order
+    :returns: the sample rate in Hz
+    :raises ValueError: if there are too few distinct times
+    """
+    span = float(times[-1] - times[0]) if len(times) > 1 else 0.0
+    if not span > 0:
+        raise ValueError("can't work out the sample rate of the time column")
+    return (len(times) - 1) / span
+
+
+def apply_filter(data, spec, times):
+    """
+    Filter a block of channels that share a time column
+
+    :param data: a 2D array with one channel per column (or a 1D array)
+    :param spec: a FilterSpec
+    :param times: the shared time column
+    :returns: a tuple of (times for the filtered samples, filtered array)
+    :raises ValueError: if the channels are too short for the filter
+    """
+    if spec.kind == MOVING_AVERAGE:
+        return times[spec.order - 1:], moving_average(data, spec.order)
+    return times, butter_filter(data, spec.order, normalized_cutoff(spec, times), spec.btype)
+
+
+def normalized_cutoff(spec, times):
+    """
+    :param spec: a Butterworth FilterSpec
+    :param times: the time column of the channels being filtered
+    :returns: the spec's cutoff as a fraction of the Nyquist rate
+    :raises ValueError: if a cutoff in Hz is at or above the Nyquist rate
+    """
+    if not spec.hertz:
+        return spec.cutoff
+    cutoff = spec.cutoff / (sample_rate(times) / 2)
+    if not 0 < cutoff < 1:
+        raise ValueError("cutoff " + spec_label(spec) + " is above the Nyquist rate")
+    return cutoff
+
+
+def margin_samples(spec, times):
+    """
+    Work out how many samples either side of a window a filter needs to see so
+    that its output inside the window matches filtering the whole channel
+
+    :param spec: a FilterSpec
+    :param times: the time column of the channels being filtered
+    :returns: the number of samples
+    """
+    if spec.kind == MOVING_AVERAGE:
+        return spec.order - 1
+    # 2 / cutoff is the number of samples in one cycle of the cutoff frequency
+    cycles = MARGIN_CYCLES_PER_ORDER * spec.order
+    return int(np.ceil(cycles * 2 / normalized_cutoff(spec, times)))
+
+
+def is_sorted(times):
+    """
+    Check that a time column never goes backwards. NaNs (e.g. from a header
+    row) are ignored. The column is compared a block at a time, so a long
+    (e.g. memory-mapped) one never needs a full-length temporary array
+
+    :param times: an array of times
+    :returns: True if the times are in non-decreasing order
+    """
+    for start in range(0, max(len(times) - 1, 0), SORT_CHECK_SAMPLES):
+        block = times[start:start + SORT_CHECK_SAMPLES + 1]
+        if np.any(block[1:] < block[:-1]):
+            return False
+    return True
+
+
+def window_index(times, lower, upper, margin=0):
+    """
+    Find the samples with lower <= time <= upper. Sorted times are searched with
+    a binary search, and the result is a slice, so indexing with it gives views;
+    unsorted times fall back to a boolean mask
+
+    :param times: an array of times
+    :param lower: the smallest time to keep
+    :param upper: the largest time to keep
+    :param margin: extra samples to keep either side (sorted times only)
+    :returns: a slice or a boolean array to index the samples with
+    """
+    if not is_sorted(times):
+        return (times >= lower) & (times <= upper)
+    start = np.searchsorted(times, lower, side="left")
+    stop = np.searchsorted(times, upper, side="right")
+    return slice(max(start - margin, 0), stop + margin)
+
+
+def stream_filter(data, columns, spec, out, block_samples, times=None):
+    """
+    Filter some columns of an array a block of samples at a time, so only a
+    few blocks are ever in memory. The result matches apply_filter() to within
+    rounding
+
+    :param data: a 2D array (e.g. a numpy.memmap) whose first column holds the
+    times
+    :param columns: the indices of the columns to filter
+    :param spec: a FilterSpec
+    :param out: a 2D array (e.g. a numpy.memmap) to write the filtered columns
+    to, with one row per output sample
+    :param block_samples: the number of samples filtered at a time
+    :param times: the time column, or None to use data's first column
+    :returns: a tuple of (times for the filtered samples, out)
+    :raises ValueError: if the channels are too short for the filter
+    """
+    if times is None:
+        times = data[:, 0]
+    if spec.kind == MOVING_AVERAGE:
+        return times[spec.order - 1:], stream_moving_average(data, columns, spec.order, out,
+                                                            block_samples)
+    sos = design_butter(spec.order, float(normalized_cutoff(spec, times)), spec.btype)
+    return times, stream_sosfiltfilt(sos, data, columns, out, block_samples)
+
+
+def stream_sosfiltfilt(sos, data, columns, out, block_samples):
+    """
+    Out-of-core equivalent of scipy.signal.sosfiltfilt along axis 0
+
+    sosfiltfilt pads each end of the signal with an odd reflection, filters
+    forwards, then filters the result backwards. Here the forward pass runs
+    block by block from the start, carrying the filter state across block
+    edges and writing into out; the backward pass then runs block by block
+    from the end, reading and overwriting out. Only the reflected padding,
+    which is a few dozen samples, is built in memory.
+
+    :param sos: the second-order sections of the filter
+    :param data: a 2D array holding the signal in some of its columns
+    :param columns: the indices of the columns to filter
+    :param out: a 2D array of the same length as data to write the result to
+    :param block_samples: the number of samples filtered at a time
+    :returns: out
+    :raises ValueError: if the signal is no longer than the padding
+    """
+    from scipy import signal
+    samples = data.shape[0]
+    # The same padding length sosfiltfilt uses by default
+    taps = 2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    padlen = 3 * taps
+    if samples <= padlen:
+        raise ValueError("The length of the input vector x must be greater than padlen, "
+                         "which is " + str(padlen) + ".")
+    zi = signal.sosfilt_zi(sos)[:, :, np.newaxis]
+
+    # Forward pass: the leading reflection only sets up the filter state
+    head = np.asarray(data[:padlen + 1, columns], dtype=np.float64)
+    left = 2 * head[0] - head[padlen:0:-1]
+    _, state = signal.sosfilt(sos, left, axis=0, zi=zi * left[0])
+    for start in range(0, samples, block_samples):
+        stop = min(start + block_samples, samples)
+        block = np.asarray(data[start:stop, columns], dtype=np.float64)
+        out[start:stop], state = signal.sosfilt(sos, block, axis=0, zi=state)
+    tail = np.asarray(data[samples - padlen - 1:, columns], dtype=np.float64)
+    right, state = signal.sosfilt(sos, 2 * tail[-1] - tail[-2::-1], axis=0, zi=state)
+
+    # Backward pass, starting from the end of the trailing reflection
+    _, state = signal.sosfilt(sos, right[::-1], axis=0, zi=zi * right[-1])
+    for stop in range(samples, 0, -block_samples):
+        start = max(stop - block_samples, 0)
+        block = np.asarray(out[start:stop], dtype=np.float64)[::-1]
+        filtered, state = signal.sosfilt(sos, block, axis=0, zi=state)
+        out[start:stop] = filtered[::-1]
+    return out
+
+
+def stream_moving_average(data, columns, interval, out, block_samples):
+    """
+    Out-of-core equivalent of moving_average() along axis 0. Each block reads
+    interval - 1 samples of overlap with the block before it
+
+    :param data: a 2D array holding the signal in some of its columns
+    :param columns: the indices of the columns to filter
+    :param interval: the number of samples averaged
+    :param out: a 2D array, interval - 1 samples shorter than data, to write
+    the result to
+    :param block_samples: the number of output samples computed at a time
+    :returns: out
+    """
+    for start in range(0, len(out), block_samples):
+        stop = min(start + block_samples, len(out))
+        block = np.asarray(data[start:stop + interval - 1, columns], dtype=np.float64)
+        sums = np.zeros((len(block) + 1, len(columns)))
+        np.cumsum(block, axis=0, out=sums[1:])
+        out[start:stop] = (sums[interval:] - sums[:-interval]) / interval
+    return out
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Lightweight timing and counting for a run, so a slow run can be pinned on
+scanning, parsing, filtering, plotting or uploading. Code wraps each stage
+(optionally for one file) in a span and counts what it processed; the totals
+are written out as a JSON run report. With profiling on, the spans also run
+under cProfile and each stage's profile is saved for pstats or snakeviz.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+# Counter names used across Echo
+BYTES_READ = "bytes_read"
+SAMPLES_PARSED = "samples_parsed"
+POINTS_PLOTTED = "points_plotted"
+PLOTS_DRAWN = "plots_drawn"
+BYTES_UPLOADED = "bytes_uploaded"
+FILES_UPLOADED = "files_uploaded"
+# How many functions of each stage's profile are listed in the report
+PROFILE_TOP_FUNCTIONS = 15
+
+
+class RunReport:
+    """
+    RunReport collects timing spans and counters from any thread
+
+    For each stage it records the number of spans, their total duration (which
+    can exceed the run's length when spans run on several threads at once) and
+    the wall time from the start of its first span to the end of its last.
+    Spans given a file path are also totalled per file.
+    """
+
+    profile_path = None
+
+    def __init__(self, profile_path=None):
+        """
+        Constructor
+
+        :param profile_path: a directory to save a cProfile profile of each
+        stage in (as STAGE.prof), or None not to profile
+        """
+        self.profile_path = profile_path
+        self.lock = threading.Lock()
+        self.thread_state = threading.local()
+        self.start_time = time.time()
+        self.stages = {}
+        self.files = {}
+        self.counters = {}
+        self.profiles = {}
+
+    @contextlib.contextmanager
+    def span(self, stage, file_path=None):
+        """
+        Time the body of a with block as part of a stage
+
+        :param stage: the name of the stage, e.g. "parse"
+        :param file_path: the file being worked on, if any
+        """
+        profile = None
+        if self.profile_path is not None and not getattr(self.thread_state, "profiling", False):
+            # Only the outermost span on each thread is profiled, since a
+            # thread can only run one profiler at a time
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.thread_state.profiling = True
+            except ValueError:
+                # Newer Pythons allow one profiler at a time across all threads
+                profile = None
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            if profile is not None:
+                profile.disable()
+                self.thread_state.profiling = False
+            self._record(stage, file_path, start, end, profile)
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter
+
+        :param name: the counter, e.g. BYTES_READ
+        :param amount: the amount to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """
+        :returns: a one-line description of where the time went, for the log
+        """
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1]["seconds"])
+        return ", ".join(name + " {:.2f}s".format(stage["seconds"]) for name, stage in stages)
+
+    def to_dict(self):
+        """
+        :returns: the report as a dict of plain values, ready for JSON
+        """
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = {"calls": stage["calls"], "seconds": round(stage["seconds"], 6),
+                                "wall_seconds": round(stage["last"] - stage["first"], 6)}
+            report = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.start_time)),
+                "seconds": round(time.time() - self.start_time, 6),
+                "stages": stages,
+                "counters": dict(self.counters),
+                "files": {path: {name: round(seconds, 6) for name, seconds in file_stages.items()}
+                          for path, file_stages in self.files.items()}}
+            upload = self.stages.get("upload")
+            if upload is not None and upload["last"] > upload["first"]:
+                report["upload_mb_per_second"] = round(
+                    self.counters.get(BYTES_UPLOADED, 0) / 1e6 /
+                    (upload["last"] - upload["first"]), 6)
+            if self.profiles:
+                report["profiles"] = {name: self._profile_summary(name, stats)
+                                      for name, stats in self.profiles.items()}
+        return report
+
+    def write(self, report_path):
+        """
+        Atomically write the report to a JSON file, and each stage's profile
+        (if profiling) to the profile directory
+
+        :param report_path: the path of the JSON file
+        """
+        report = self.to_dict()
+        with open(report_path + ".tmp", "w") as report_file:
+            json.dump(report, report_file, indent=1, sort_keys=True)
+        os.replace(report_path + ".tmp", report_path)
+        if self.profiles:
+            os.makedirs(self.profile_path, exist_ok=True)
+            with self.lock:
+                for name, stats in self.profiles.items():
+                    stats.dump_stats(os.path.join(self.profile_path, name + ".prof"))
+
+    def _record(self, stage, file_path, start, end, profile):
+        """
+        Add a finished span to the totals
+        """
+        stats = None
+        if profile is not None:
+            profile.create_stats()
+            stats = pstats.Stats(profile)
+        with self.lock:
+            totals = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0,
+                                                    "first": start, "last": end})
+            totals["calls"] += 1
+            totals["seconds"] += end - start
+            totals["first"] = min(totals["first"], start)
+            totals["last"] = max(totals["last"], end)
+            if file_path is not None:
+                file_stages = self.files.setdefault(file_path, {})
+                file_stages[stage] = file_stages.get(stage, 0.0) + end - start
+            if stats is not None:
+                if stage in self.profiles:
+                    self.profiles[stage].add(stats)
+                else:
+                    self.profiles[stage] = stats
+
+    def _profile_summary(self, stage, stats):
+        """
+        :returns: the functions a stage spent the most cumulative time in, as
+        a list of "seconds file:line(function)" strings. Must be called with
+        the lock held
+        """
+        top = []
+        for (path, line, function), (_, _, _, cumulative, _) in sorted(
+                stats.stats.items(), key=lambda item: -item[1][3])[:PROFILE_TOP_FUNCTIONS]:
+            top.append("{:.3f}s {}:{}({})".format(cumulative, os.path.basename(path), line,
+                                                 function))
+        return {"path": os.path.join(self.profile_path, stage + ".prof"), "top": top}
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(function, items, depth=1):
+    """
+    Apply a function to a sequence of items on a background thread, staying up
+    to depth items ahead of the consumer
+
+    This lets the next item be prepared (e.g. a CSV file parsed) while the
+    caller is still busy with the current one, while holding at most depth + 1
+    results in memory. An exception raised for one item is handed back for that
+    item instead of stopping the rest.
+
+    :param function: a function taking one item
+    :param items: the items to process, in order
+    :param depth: the number of items to work on ahead of the consumer
+    :returns: a generator of (item, result, error) tuples in the order of
+    items, where error is None on success and result is None on failure
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        window = deque()
+        for item in items:
+            window.append((item, executor.submit(function, item)))
+            if len(window) > depth:
+                yield _result(*window.popleft())
+        while window:
+            yield _result(*window.popleft())
+
+
+def _result(item, future):
+    """
+    Wait for a prefetched item and unpack it into an (item, result, error) tuple
+    """
+    try:
+        return item, future.result(), None
+    except Exception as error:  # pylint: disable=W0703
+        return item, None, error
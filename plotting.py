@@ -6,9 +6,15 @@ See LICENSE for MIT/X11 license info.
 See README.md for all other help.
 """
 
+import os
+import shutil
+import tempfile
+import multiprocessing
 import matplotlib.pyplot as plt
-from scipy import signal
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
+import filters
 
 
 class DataAnalysis:
@@ -17,14 +23,16 @@ class DataAnalysis:
     data.
     """
     interactive = False
+    decimate = True
     save_folder = "."
     logger = None
     LINE_COLORS = ["#de3c80", "#196512", "#d47e20", "#17c009", "#d9013a", "#2a9e60", "#116186"]
 
-    def __init__(self, logger, interactive, save_folder="."):
+    def __init__(self, logger, interactive, save_folder=".", decimate=True):
         self.interactive = interactive
         self.save_folder = save_folder
         self.logger = logger
+        self.decimate = decimate
 
     def plot_dataset(self, data, xlabel, ylabel, title=None, xlimits=None):
         """
@@ -42,57 +50,25 @@ class DataAnalysis:
          :param xlimits: a tuple containing the x limits ie. (-10, 10)
          :returns: path to plot image folder
         """
-        legendnames = []
-        dslist = []
-        dsnamelist = []
-
-        # Check if input data is a list of DataSets or just one DataSet
-        if isinstance(data, list):
-            dslist = data
-        else:
-            dslist = [data]
-
-        # Loop through each DataSet and plot it on a graph
-        for dataset in dslist:
-            plt.plot(dataset.xlist, dataset.ylist,
-                     color=DataAnalysis.LINE_COLORS[dslist.index(dataset)])
-            legendnames.append(dataset.dataname)
-            dsnamelist.append(dataset.dataname)
-
-        save_path = ""
-        # Set the plot title based on the DataSet's dataname
-        if title is None:
-            if len(dslist) > 1:
-                plt.title(" vs. ".join(dsnamelist))
-                save_path = self.save_folder + "/" + "_vs_".join(dsnamelist) + ".pdf"
-            else:
-                plt.title(dslist[0])
-                save_path = self.save_folder + "/" + dslist[0].dataname + ".pdf"
-        else:
-            plt.title(title)
-            save_path = self.save_folder + "/" + title + ".pdf"
-
-        # Plot Formatting
-        if len(dslist) > 1:
-            plt.legend(legendnames, loc="upper right")
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        axis = plt.gca()
-        axis.grid(which='minor', alpha=0.2)
-        axis.grid(which='major', alpha=0.5)
-        if xlimits is not None:
-            axis.set_xlim(xlimits[0], xlimits[1])
-
-        # Check for interactive mode
-        if self.interactive:
-            plt.show()
-
-        # Save plot
-        plt.savefig(save_path, bbox_inches='tight')
+        dslist = data if isinstance(data, list) else [data]
+        save_path = self.plot_path(dslist, title)
+        render_plot(dslist, save_path, xlabel, ylabel, title, xlimits, self.interactive,
+                    self.decimate)
         self.logger.log_verbose("Generated Graph " + save_path)
-        plt.close()
         return save_path
 
+    def plot_path(self, dslist, title=None):
+        """
+        Work out where the plot of a list of DataSets will be saved
+
+        :param dslist: a list of DataSet objects
+        :param title: Title of the plot
+        :returns: path to the plot's PDF file
+        """
+        if title is not None:
+            return self.save_folder + "/" + title + ".pdf"
+        return self.save_folder + "/" + "_vs_".join(ds.dataname for ds in dslist) + ".pdf"
+
     def butter_filter_data(self, raw, order, cutoff):
         """
         Takes raw telemetry data and applies a Butterworth filter
@@ -102,50 +78,488 @@ class DataAnalysis:
         :param cutoff: cutoff frequency
         :returns: filtered data
         """
-        numerator, denominator = signal.butter(order, cutoff, output='ba')
-        return signal.filtfilt(numerator, denominator, raw)
+        return filters.butter_filter(raw, order, cutoff)
 
     def moving_average_filter_data(self, raw, interval):
         """
         Takes raw telemetry data and applies a moving average filter
-        Citation: Based on this StackOverflow answer: http://stackoverflow.com/a/14314054
 
         :param raw: an array of raw telemetry data
         :param period: the smoothing interval
         """
-        ret = np.cumsum(raw, dtype=float)
-        ret[interval:] = ret[interval:] - ret[:-interval]
-        return ret[interval - 1:] / interval
+        return filters.moving_average(raw, interval)
+
+
+# Resolution the decimated plots are sized for. Each DataSet is cut down to a
+# min/max pair per dot across the width of the figure
+DECIMATE_DPI = 300
+# DataSets with fewer points than this are always drawn in full
+DECIMATE_THRESHOLD = 20000
+
+
+def minmax_decimate(xlist, ylist, buckets):
+    """
+    Shrink a time series to the smallest and largest value in each of a number
+    of equal-sized buckets, in their original order
+
+    Drawn one bucket per pixel, the result looks the same as the full series:
+    every peak and dropout survives, where plain striding would miss them.
+
+    :param xlist: an array of independent values
+    :param ylist: an array of telemetry values, the same length as xlist
+    :param buckets: the number of buckets (e.g. the plot width in pixels)
+    :returns: a tuple of (x array, y array) with at most 2 * buckets points
+    """
+    xlist = np.asarray(xlist)
+    ylist = np.asarray(ylist)
+    size = len(ylist)
+    if size <= 2 * buckets:
+        return xlist, ylist
+    width = size // buckets
+    # Whole buckets are reshaped into rows; the leftover tail forms one more
+    tail = size - width * buckets
+    rows = ylist[:width * buckets].reshape(buckets, width)
+    starts = np.arange(buckets) * width
+    indices = [starts + np.argmin(rows, axis=1), starts + np.argmax(rows, axis=1)]
+    if tail:
+        indices.append(np.array([width * buckets + np.argmin(ylist[width * buckets:])]))
+        indices.append(np.array([width * buckets + np.argmax(ylist[width * buckets:])]))
+    keep = np.unique(np.concatenate(indices))
+    return xlist[keep], ylist[keep]
+
+
+def plot_buckets():
+    """
+    :returns: the number of minmax_decimate() buckets across a default-sized
+    figure at DECIMATE_DPI
+    """
+    return int(plt.rcParams["figure.figsize"][0] * DECIMATE_DPI)
+
+
+def render_plot(dslist, save_path, xlabel, ylabel, title=None, xlimits=None, interactive=False,
+                decimate=True):
+    """
+    Draw a list of DataSets on one set of axes and save it as a PDF
+
+    Uses its own Figure and Axes rather than pyplot's global state, so plots
+    can be drawn in several processes at once. The PDF's creation date is left
+    out, so the same data always produces the same file.
+
+    DataSets longer than DECIMATE_THRESHOLD are cut down with minmax_decimate()
+    to the figure's width at DECIMATE_DPI, unless decimate is False.
+
+    :param dslist: a list of DataSet objects
+    :param save_path: where to save the PDF
+    :param xlabel: label on x axis
+    :param ylabel: label on y axis
+    :param title: Title of the plot, or None to use the DataSets' names
+    :param xlimits: a tuple containing the x limits ie. (-10, 10)
+    :param interactive: also show the plot in a pop-up window
+    :param decimate: thin out long DataSets before drawing them
+    """
+    if interactive:
+        figure = plt.figure()
+    else:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+    axis = figure.add_subplot(1, 1, 1)
+
+    # Loop through each DataSet and plot it on a graph
+    buckets = int(figure.get_figwidth() * DECIMATE_DPI)
+    for index, dataset in enumerate(dslist):
+        if decimate:
+            dataset = dataset.decimate(buckets)
+        axis.plot(dataset.xlist, dataset.ylist,
+                  color=DataAnalysis.LINE_COLORS[index % len(DataAnalysis.LINE_COLORS)])
+
+    # Set the plot title based on the DataSet's dataname
+    if title is None:
+        if len(dslist) > 1:
+            axis.set_title(" vs. ".join(ds.dataname for ds in dslist))
+        else:
+            axis.set_title(str(dslist[0]))
+    else:
+        axis.set_title(title)
+
+    # Plot Formatting
+    if len(dslist) > 1:
+        axis.legend([ds.dataname for ds in dslist], loc="upper right")
+    axis.set_xlabel(xlabel)
+    axis.set_ylabel(ylabel)
+    axis.grid(which='minor', alpha=0.2)
+    axis.grid(which='major', alpha=0.5)
+    if xlimits is not None:
+        axis.set_xlim(xlimits[0], xlimits[1])
+
+    # Check for interactive mode
+    if interactive:
+        plt.show()
+
+    # Save plot
+    figure.savefig(save_path, bbox_inches='tight', metadata={'CreationDate': None})
+    if interactive:
+        plt.close(figure)
+
+
+class PlotRenderer:
+    """
+    PlotRenderer draws plots on a pool of worker processes, so a run with
+    dozens of channels uses every core.
+
+    The arrays are handed to the workers as memory-mapped .npy files (in
+    /dev/shm where it exists) rather than pickled, so each sample is copied
+    once no matter how many processes there are. Long DataSets are decimated
+    first (see render_plot), so only the points that will be drawn are
+    copied. At most two plots per worker are in flight at once, which keeps
+    memory use flat.
+
+    A plot that can't be drawn is logged and left out of the finished list,
+    whether it failed in a worker or in this process.
+    """
+
+    def __init__(self, analysis, processes=None, on_plotted=None):
+        """
+        Constructor. With one process, or in interactive mode, plots are drawn
+        in this process instead.
+
+        Create the renderer before starting any threads: the pool is forked
+        where the platform allows it, and a forked child only gets the thread
+        that forked it.
+
+        :param analysis: the DataAnalysis whose settings the plots use
+        :param processes: the number of worker processes (default: one per CPU)
+        :param on_plotted: a function called with the path of each plot as soon
+        as it is saved (from a background thread when there is a pool). May also
+        be set later through the on_plotted attribute
+        """
+        self.on_plotted = on_plotted
+        self.analysis = analysis
+        self.logger = analysis.logger
+        self.processes = processes or os.cpu_count() or 1
+        self.pending = []
+        self.finished = []
+        self.pool = None
+        self.tmpdir = None
+        if self.processes > 1 and not analysis.interactive:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            self.pool = context.Pool(self.processes)
+            shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            self.tmpdir = tempfile.mkdtemp(prefix="echo-plots-", dir=shm)
+
+    def submit(self, data, xlabel, ylabel, title=None, xlimits=None):
+        """
+        Queue a plot. Takes the same arguments as DataAnalysis.plot_dataset
+
+        :returns: the path the plot will be saved to
+        """
+        dslist = data if isinstance(data, list) else [data]
+        save_path = self.analysis.plot_path(dslist, title)
+        if self.pool is None:
+            try:
+                self.analysis.plot_dataset(dslist, xlabel, ylabel, title, xlimits)
+            except Exception as error:  # pylint: disable=W0703
+                self._failed(save_path, error)
+                return save_path
+            self.finished.append(save_path)
+            self._notify(save_path)
+            return save_path
+
+        # Keep at most two plots per worker in flight
+        while len(self.pending) >= 2 * self.processes:
+            self._collect(self.pending.pop(0))
+        job_dir = tempfile.mkdtemp(dir=self.tmpdir)
+        try:
+            specs = []
+            for index, dataset in enumerate(dslist):
+                if self.analysis.decimate:
+                    dataset = dataset.decimate(plot_buckets())
+                x_path = os.path.join(job_dir, str(index) + "x.npy")
+                y_path = os.path.join(job_dir, str(index) + "y.npy")
+                np.save(x_path, np.asarray(dataset.xlist))
+                np.save(y_path, np.asarray(dataset.ylist))
+                specs.append((dataset.dataname, x_path, y_path))
+        except Exception as error:  # pylint: disable=W0703
+            # e.g. /dev/shm is full
+            self._failed(save_path, error)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return save_path
+        result = self.pool.apply_async(_render_job, (specs, save_path, xlabel, ylabel,
+                                                     title, xlimits, self.analysis.decimate),
+                                       callback=lambda _: self._notify(save_path))
+        self.pending.append((result, save_path, job_dir))
+        return save_path
+
+    def drain(self):
+        """
+        Wait for every queued plot to be drawn, keeping the pool running
+
+        :returns: the paths of the plots drawn since the last drain(), in the
+        order queued
+        """
+        while self.pending:
+            self._collect(self.pending.pop(0))
+        finished, self.finished = self.finished, []
+        return finished
+
+    def wait(self):
+        """
+        Wait for every queued plot to be drawn and shut the pool down
+
+        :returns: the paths of the plots drawn since the last drain(), in the
+        order queued
+        """
+        finished = self.drain()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.pool = None
+        return finished
+
+    def _notify(self, save_path):
+        """
+        Pass a finished plot to on_plotted, logging (not raising) any error
+        """
+        if self.on_plotted is None:
+            return
+        try:
+            self.on_plotted(save_path)
+        except Exception as error:  # pylint: disable=W0703
+            self.logger.log("ERROR: Unable to hand off " + save_path + ": " + str(error))
+
+    def _failed(self, save_path, error):
+        """
+        Log a plot that couldn't be drawn
+        """
+        self.logger.log("ERROR: Unable to generate " + save_path + ": " + str(error))
+
+    def _collect(self, job):
+        """
+        Wait for one plot job, log the outcome and remove its temporary arrays
+        """
+        result, save_path, job_dir = job
+        try:
+            result.get()
+            self.logger.log_verbose("Generated Graph " + save_path)
+            self.finished.append(save_path)
+        except Exception as error:  # pylint: disable=W0703
+            self._failed(save_path, error)
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _render_job(specs, save_path, xlabel, ylabel, title, xlimits, decimate):
+    """
+    Worker process body: map a plot's arrays and draw it
+
+    :param specs: a list of (dataname, x .npy path, y .npy path) tuples
+    """
+    dslist = [DataSet(name, np.load(x_path, mmap_mode="r"), np.load(y_path, mmap_mode="r"))
+              for name, x_path, y_path in specs]
+    render_plot(dslist, save_path, xlabel, ylabel, title, xlimits, decimate=decimate)
 
 
 class DataSet:
     """
-    Datasets store lists of data points and a title, to make plotting easier
+    Datasets store arrays of data points and a title, to make plotting easier
+
+    A DataSet never copies or modifies the arrays it is given: the T0 shift is
+    applied lazily, the first time xlist is read, into a new array. slice() and
+    trim() return DataSets that are views of the same memory, and copy() is the
+    only way to get independent arrays.
     """
-    t0_time = 0
+    __slots__ = ("dataname", "raw_xlist", "ylist", "t0_time", "_shifted_xlist")
 
-    def __init__(self, dataname, xlist, ylist):
+    def __init__(self, dataname, xlist, ylist, t0_time=0.0):
         """
         Constructor
 
         :param dataname: telemetry value being plotted ie VOXB
-        :param xlist: list of independent values to be plotted over
-        :param ylist: list of telemetry values to plot over xlist
+        :param xlist: array of independent values to be plotted over
+        :param ylist: array of telemetry values to plot over xlist
+        :param t0_time: the T0 time to subtract from xlist
         """
         self.dataname = dataname
-        self.xlist = xlist
-        self.ylist = ylist
+        self.raw_xlist = np.asarray(xlist)
+        self.ylist = np.asarray(ylist)
+        self.t0_time = t0_time
+        self._shifted_xlist = None
 
     def __str__(self):
         return self.dataname
 
+    def __len__(self):
+        return len(self.ylist)
+
+    @property
+    def xlist(self):
+        """
+        The x-values, shifted so that T0 is at zero
+        """
+        if not self.t0_time:
+            return self.raw_xlist
+        if self._shifted_xlist is None:
+            self._shifted_xlist = self.raw_xlist - self.raw_xlist.dtype.type(self.t0_time)
+        return self._shifted_xlist
+
     def set_t0(self, t0_time):
         """
         Adjust the x-values for a given t0 time
 
+        The shift is always relative to the original x-values, so calling this
+        twice doesn't shift twice.
+
+        :param t0_time: the desired t0 time
+        """
+        self.t0_time = t0_time
+        self._shifted_xlist = None
+
+    def slice(self, start=None, stop=None):
+        """
+        :param start: index of the first sample to keep
+        :param stop: index one past the last sample to keep
+        :returns: a DataSet viewing part of this one's arrays
+        """
+        return DataSet(self.dataname, self.raw_xlist[start:stop], self.ylist[start:stop],
+                       self.t0_time)
+
+    def trim(self, xmin, xmax):
+        """
+        Keep only the samples with xmin <= x <= xmax (after the T0 shift)
+
+        The x-values must be in increasing order, as they are in a time column.
+
+        :param xmin: the smallest x-value to keep
+        :param xmax: the largest x-value to keep
+        :returns: a DataSet viewing part of this one's arrays
+        """
+        start = np.searchsorted(self.raw_xlist, xmin + self.t0_time, side="left")
+        stop = np.searchsorted(self.raw_xlist, xmax + self.t0_time, side="right")
+        return self.slice(start, stop)
+
+    def decimate(self, buckets):
+        """
+        Cut a long DataSet down with minmax_decimate(). DataSets no longer than
+        DECIMATE_THRESHOLD are returned as they are
+
+        The raw x-values are decimated and the T0 shift applied afterwards, so
+        a shifted copy of a long (e.g. memory-mapped) x array is never made.
+
+        :param buckets: the number of buckets (e.g. the plot width in pixels)
+        :returns: a DataSet of at most 2 * buckets + 2 points
+        """
+        if len(self) <= DECIMATE_THRESHOLD:
+            return self
+        xlist, ylist = minmax_decimate(self.raw_xlist, self.ylist, buckets)
+        return DataSet(self.dataname, xlist, ylist, self.t0_time)
+
+    def copy(self):
+        """
+        :returns: a DataSet with its own contiguous copies of the arrays
+        """
+        return DataSet(self.dataname, np.array(self.raw_xlist), np.array(self.ylist),
+                       self.t0_time)
+
+
+class ChannelSet:
+    """
+    ChannelSets hold every channel of one CSV file, so a file with many value
+    columns is read once. Column 0 is the shared time column, and each other
+    column becomes a DataSet viewing the same array.
+
+    The array is kept in column-major (Fortran) order, so each channel's values
+    are contiguous in memory. The times can be given as a separate array, e.g.
+    float64 times for a float32 array, in which case they are used instead of
+    the array's first column.
+    """
+    __slots__ = ("dataname", "data", "names", "t0_time", "times")
+
+    def __init__(self, dataname, data, names=None, t0_time=0.0, times=None):
+        """
+        Constructor
+
+        :param dataname: the name of the file's telemetry ie VOXB
+        :param data: a 2D array whose first column holds the times
+        :param names: one name per value column, or None to use dataname (for a
+        single value column) or dataname_1, dataname_2, ... (for several)
+        :param t0_time: the T0 time to subtract from the time column
+        :param times: a 1D array of the times, one per row of data, or None to
+        use data's first column
+        """
+        self.dataname = dataname
+        data = np.asarray(data)
+        # A slice of rows of a column-major array still has contiguous columns,
+        # so only copy arrays whose columns are strided
+        self.data = data if data.strides[0] == data.itemsize else np.asfortranarray(data)
+        if names is None:
+            if self.data.shape[1] == 2:
+                names = [dataname]
+            else:
+                names = [dataname + "_" + str(index) for index in range(1, self.data.shape[1])]
+        self.names = list(names)
+        self.t0_time = t0_time
+        self.times = self.data[:, 0] if times is None else np.asarray(times)
+
+    def __str__(self):
+        return self.dataname
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield self.channel(index)
+
+    def channel(self, index):
+        """
+        :param index: the index of a value channel (0 is the first value column)
+        :returns: a DataSet viewing the time column and the channel's values
+        """
+        return DataSet(self.names[index], self.times, self.data[:, index + 1], self.t0_time)
+
+    def set_t0(self, t0_time):
+        """
+        Set the T0 time used by every channel returned from now on
+
         :param t0_time: the desired t0 time
         """
         self.t0_time = t0_time
 
-        for x_index, x_value in enumerate(self.xlist):
-            self.xlist[x_index] = float(x_value) - float(t0_time)
+    def save_npz(self, path):
+        """
+        Save the channels as a compressed NumPy .npz archive, with the values
+        stored as 32-bit floats to roughly halve the size again. The times
+        stay 64-bit, since long tests need every digit. The archive holds
+        "time" (the raw times), "values" (one column per channel), "names"
+        and "t0"
+
+        :param path: the path of the .npz file to write
+        """
+        np.savez_compressed(path, time=self.times,
+                            values=self.data[:, 1:].astype(np.float32),
+                            names=np.array(self.names), t0=np.float64(self.t0_time))
+
+    def is_sorted(self):
+        """
+        :returns: True if the time column never goes backwards
+        """
+        return self.data.shape[1] == 0 or filters.is_sorted(self.times)
+
+    def trim(self, xmin, xmax, margin=0):
+        """
+        Keep only the rows with xmin <= time <= xmax (after the T0 shift)
+
+        A sorted time column is binary searched and the result views this
+        ChannelSet's array; an unsorted one is masked, which copies the rows.
+
+        :param xmin: the smallest time to keep
+        :param xmax: the largest time to keep
+        :param margin: extra rows to keep either side of the window, e.g. for a
+        filter to settle in (sorted time columns only)
+        :returns: a ChannelSet of the rows in the window
+        """
+        if self.data.shape[1] == 0:
+            return self
+        rows = filters.window_index(self.times, xmin + self.t0_time, xmax + self.t0_time, margin)
+        return ChannelSet(self.dataname, self.data[rows], self.names, self.t0_time,
+                          self.times[rows])
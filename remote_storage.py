@@ -10,14 +10,29 @@ https://developers.google.com/drive/v3/web/quickstart/python
 """
 
 #from __future__ import print_function
+import contextlib
+import hashlib
+import itertools
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import httplib2
 
 from apiclient import discovery
+from apiclient import errors
 from apiclient import http
 import oauth2client
 from oauth2client import client
 from oauth2client import tools
+import instrumentation
+from upload_ledger import file_md5
+try:
+    from googleapiclient.version import __version__ as CLIENT_VERSION
+except ImportError:
+    from googleapiclient import __version__ as CLIENT_VERSION
 
 
 class GoogleDrive:
@@ -30,21 +45,64 @@ class GoogleDrive:
     CLIENT_SECRET_FILE = 'client_secrets.json'
     CLIENT_CREDENTIAL_FILE = 'drive.credentials'
     APPLICATION_NAME = 'BURPG Echo'
+    # HTTP statuses worth retrying: rate limiting and transient server errors
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    MAX_RETRIES = 5
+    RETRY_BASE_DELAY = 1.0
+    DEFAULT_UPLOAD_WORKERS = 4
+    # Drive accepts at most 100 requests in one batch
+    MAX_BATCH_REQUESTS = 100
+    FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+    # Where the Drive API's discovery document is fetched from
+    DISCOVERY_URI = 'https://www.googleapis.com/discovery/v1/apis/drive/v3/rest'
     CREDENTIALS = None
     DRIVE_SERVICE = None
     logger = None
+    ledger = None
+    sessions = None
+    bandwidth_limiter = None
+    discovery_cache = None
+    http_pool = None
+    compressor = None
 
     def __init__(self, logger, secret_path='client_secrets.json',
-                 credentials_path='drive.credentials', noauth_local_webserver=False):
+                 credentials_path='drive.credentials', noauth_local_webserver=False,
+                 ledger=None, sessions=None, bandwidth_limit=None, discovery_cache=None,
+                 discovery_uri=DISCOVERY_URI, compressor=None):
         """
         Gets valid GDrive user credentials from storage.
 
         If nothing has been stored, or if the stored credentials are invalid,
         the OAuth2 flow is completed to obtain the new credentials.
+
+        If an UploadLedger is given, upload_files records every upload in it and
+        pending_uploads uses it to skip files that were uploaded by earlier runs.
+        If an UploadSessions store is given, upload_file saves its progress there
+        and resumes uploads that an earlier run didn't finish.
+
+        If bandwidth_limit (in bytes per second) is given, all uploads share
+        that much of the link between them.
+
+        If a DiscoveryCache is given, the Drive API's discovery document is
+        read from it rather than fetched from discovery_uri, unless the cached
+        copy is stale. Every request goes over a connection from http_pool (see
+        HttpPool), so the connection used to fetch the document is then reused
+        by the first upload.
+
+        If a compression.Compressor is given, the files it applies to are
+        compressed on the fly as they are uploaded (see CompressedMediaUpload),
+        and stored on Drive with its extension added to their names.
         """
         self.CLIENT_SECRET_FILE = secret_path
         self.CLIENT_CREDENTIAL_FILE = credentials_path
         self.logger = logger
+        self.ledger = ledger
+        self.sessions = sessions
+        self.discovery_cache = discovery_cache
+        self.compressor = compressor
+        if bandwidth_limit is not None:
+            self.bandwidth_limiter = BandwidthLimiter(bandwidth_limit)
+        self.thread_state = threading.local()
 
         credstore = oauth2client.file.Storage(self.CLIENT_CREDENTIAL_FILE)
         credentials = credstore.get()
@@ -65,34 +123,384 @@ class GoogleDrive:
             credentials = tools.run_flow(flow, credstore, flags=parser.parse_args(dummy_args))
             self.logger.log_verbose('Storing credentials to ' + self.CLIENT_CREDENTIAL_FILE)
         self.CREDENTIALS = credentials
-        self.DRIVE_SERVICE = discovery.build(
-            'drive', 'v3', http=credentials.authorize(httplib2.Http()))
+        self.http_pool = HttpPool(credentials)
+        self.DRIVE_SERVICE = self._build_service(discovery_uri)
         self.logger.log_verbose("Google Drive authentication complete")
 
-    def upload_file(self, file_path, parent_folder_id=None):
+    def _build_service(self, discovery_uri):
+        """
+        Build the Drive service from the cached discovery document if there is
+        a usable one, otherwise from a freshly fetched one (which is cached for
+        next time). If the document can't be fetched, the client library is
+        left to find one itself
+
+        :param discovery_uri: where to fetch the discovery document from
+        :returns: the Drive service
+        """
+        service_http = self.CREDENTIALS.authorize(http.build_http())
+        if self.discovery_cache is not None:
+            document = self.discovery_cache.lookup(discovery_uri, CLIENT_VERSION)
+            if document is not None:
+                try:
+                    return discovery.build_from_document(document, http=service_http)
+                except (ValueError, KeyError, errors.Error) as error:
+                    self.logger.log_verbose("Discarding cached discovery document: " +
+                                            str(error))
+                    self.discovery_cache.forget(discovery_uri)
+        try:
+            with self.http_pool.connection() as connection:
+                response, content = connection.request(discovery_uri)
+            if response.status != 200:
+                raise errors.HttpError(response, content, uri=discovery_uri)
+            document = content.decode('utf-8')
+            service = discovery.build_from_document(document, http=service_http)
+        except (errors.Error, httplib2.HttpLib2Error, OSError, ValueError) as error:
+            self.logger.log_verbose("Unable to fetch the discovery document from " +
+                                    discovery_uri + " (" + str(error) + ")")
+            return discovery.build('drive', 'v3', http=service_http)
+        if self.discovery_cache is not None:
+            self.discovery_cache.save(discovery_uri, CLIENT_VERSION, document)
+        self.logger.log_verbose("Fetched the discovery document from " + discovery_uri)
+        return service
+
+    def upload_file(self, file_path, parent_folder_id=None, http_client=None):
         """
         Upload a file to Google Drive in a "chunked" manner
 
+        Chunks that fail with a rate limiting or server error, or a dropped
+        connection, are retried with exponential backoff, resuming from the
+        last byte the server confirmed. If an UploadSessions store is set, the
+        session URI and confirmed offset are saved after every chunk, and an
+        upload left unfinished by an earlier run is resumed rather than
+        restarted. (It lands in the folder that run chose.)
+
+        The chunk size adapts to the measured throughput (see ChunkSizer), and
+        each thread carries its converged chunk size over to its next file.
+
+        Files the compressor applies to are compressed as they are sent. The
+        ledger still records the checksum of the file itself (worked out as it
+        is compressed), along with the compression settings and the checksum of
+        the compressed copy that Drive reports.
+
         :param file_path: the local path to the file being uploaded
         :param parent_folder_id: the id of the folder where this file should be
         placed
+        :param http_client: an authorized httplib2.Http to send the upload over,
+        or None to borrow one from http_pool
         :returns: the API's response object
         """
+        if http_client is None:
+            with self.http_pool.connection() as connection:
+                return self.upload_file(file_path, parent_folder_id, connection)
         self.logger.log_verbose("Attempting upload:" + file_path +" to " + str(parent_folder_id))
-        media = http.MediaFileUpload(file_path, resumable=True)
-        file_metadata = {'name': os.path.basename(file_path)}
-        if parent_folder_id is not None:
-            file_metadata['parents'] = [parent_folder_id]
+        if not hasattr(self.thread_state, 'chunk_sizer'):
+            self.thread_state.chunk_sizer = ChunkSizer(
+                max_bytes=ChunkSizer.MAX_BYTES if self.bandwidth_limiter is None
+                else self.bandwidth_limiter.max_chunk_bytes())
+        sizer = self.thread_state.chunk_sizer
+        compressor = self._compressor_for(file_path)
+        # A session is only resumed with the same compression settings
+        encoding = compressor.label if compressor is not None else None
+        request = self._create_upload(file_path, parent_folder_id, sizer, compressor)
+        session = (self.sessions.lookup(file_path, encoding) if self.sessions is not None
+                   else None)
+        if session is not None:
+            self.logger.log_verbose("Resuming upload of " + file_path + " from byte " +
+                                    str(session['offset']))
+            request.resumable_uri = session['uri']
+            request.resumable_progress = session['offset']
+            # Makes the next next_chunk() ask the server how much it really has
+            request._in_error_state = True  # pylint: disable=W0212
 
-        request = self.DRIVE_SERVICE.files().create(body=file_metadata, media_body=media)
         response = None
+        retries = 0
+        start_time = time.time()
+        start_offset = request.resumable_progress
         while response is None:
-            status, response = request.next_chunk()
-            if status:
+            # Wait for room under the bandwidth cap before sending, not after
+            reserved = 0
+            if self.bandwidth_limiter is not None:
+                reserved = sizer.chunk_bytes
+                self.bandwidth_limiter.reserve(reserved)
+            chunk_start = time.time()
+            offset = request.resumable_progress
+            try:
+                status, response = request.next_chunk(http=http_client)
+            except errors.HttpError as error:
+                if (request.resumable_uri is not None and error.resp.status in (404, 410)
+                        and retries < self.MAX_RETRIES):
+                    # The upload session has expired, so start again from scratch
+                    self.logger.log_verbose("Upload session expired, restarting: " + file_path)
+                    if self.sessions is not None:
+                        self.sessions.forget(file_path)
+                    request = self._create_upload(file_path, parent_folder_id, sizer,
+                                                  compressor)
+                    start_offset = 0
+                    retries += 1
+                    continue
+                if error.resp.status not in self.RETRY_STATUSES or retries >= self.MAX_RETRIES:
+                    raise
+                retries = self._backoff(file_path, "HTTP " + str(error.resp.status), retries)
+                continue
+            except (httplib2.HttpLib2Error, OSError) as error:
+                if retries >= self.MAX_RETRIES:
+                    raise
+                request._in_error_state = True  # pylint: disable=W0212
+                retries = self._backoff(file_path, str(error), retries)
+                continue
+            retries = 0
+            sent = (request.resumable.size() if response is not None
+                    else request.resumable_progress) - offset
+            if reserved > sent:
+                # The last chunk (or a query for a resumed upload's offset) is short
+                self.bandwidth_limiter.refund(reserved - sent)
+            sizer.update(sent, time.time() - chunk_start)
+            if response is None and self.sessions is not None:
+                self.sessions.save(file_path, request.resumable_uri, request.resumable_progress,
+                                   encoding)
+            if status and status.total_size:
                 self.logger.log_verbose("Uploaded {:d}%.".format(int(status.progress() * 100)))
-        self.logger.log_verbose("Upload complete: " + file_path)
+        if self.sessions is not None:
+            self.sessions.forget(file_path)
+        if self.ledger is not None:
+            if compressor is None:
+                self.ledger.record(file_path, response.get('md5Checksum'), response.get('id'))
+            else:
+                self.ledger.record(file_path, request.resumable.source_md5(), response.get('id'),
+                                   encoding, response.get('md5Checksum'))
+        sent = request.resumable.size() - start_offset
+        elapsed = max(time.time() - start_time, 1e-6)
+        message = "Upload complete: " + file_path + " ({:.1f} MB in {:.1f}s, {:.2f} MB/s".format(
+            sent / 1e6, elapsed, sent / 1e6 / elapsed)
+        if compressor is not None:
+            message += ", compressed to {:.0%}".format(
+                request.resumable.size() / max(os.path.getsize(file_path), 1))
+        self.logger.log_verbose(message + ")")
         return response
 
+    def _compressor_for(self, file_path):
+        """
+        :param file_path: the local path of a file about to be uploaded
+        :returns: the compression.Compressor to compress the file with on the
+        way, or None to send it as it is
+        """
+        if self.compressor is not None and self.compressor.applies_to(file_path):
+            return self.compressor
+        return None
+
+    def _create_upload(self, file_path, parent_folder_id, sizer, compressor=None):
+        """
+        Build the resumable files().create request for uploading a file
+
+        :param file_path: the local path to the file being uploaded
+        :param parent_folder_id: the id of the folder where this file should be
+        placed
+        :param sizer: the ChunkSizer that picks the size of each chunk
+        :param compressor: the compression.Compressor to compress the file
+        with on the way, or None to upload it as it is
+        :returns: the googleapiclient HttpRequest
+        """
+        file_metadata = {'name': os.path.basename(file_path)}
+        if compressor is None:
+            media = AdaptiveMediaFileUpload(file_path, sizer)
+        else:
+            media = CompressedMediaUpload(file_path, sizer, compressor)
+            file_metadata['name'] += compressor.extension
+        if parent_folder_id is not None:
+            file_metadata['parents'] = [parent_folder_id]
+        return self.DRIVE_SERVICE.files().create(
+            body=file_metadata, media_body=media,
+            fields='id,name,mimeType,md5Checksum,parents,size')
+
+    def _backoff(self, file_path, reason, retries):
+        """
+        Sleep before retrying a failed chunk, doubling the delay every attempt
+
+        :param file_path: the local path to the file being uploaded
+        :param reason: why the chunk failed, for the log
+        :param retries: the number of retries already made
+        :returns: the new number of retries
+        """
+        delay = self.RETRY_BASE_DELAY * 2 ** retries * (1 + random.random())
+        self.logger.log_verbose("Upload of " + file_path + " failed (" + reason +
+                                "), retrying in {:.1f}s".format(delay))
+        time.sleep(delay)
+        return retries + 1
+
+    def upload_files(self, file_paths, parent_folder_id=None, workers=DEFAULT_UPLOAD_WORKERS):
+        """
+        Upload several files to Google Drive at once
+
+        :param file_paths: a list of local paths to upload
+        :param parent_folder_id: the id of the folder where the files should be
+        placed
+        :param workers: the maximum number of uploads in flight at once
+        :returns: a dict mapping each path to its API response, or to None if
+        the upload failed
+        """
+        scheduler = UploadScheduler(self, workers)
+        for file_path in file_paths:
+            scheduler.submit(file_path, parent_folder_id)
+        responses = scheduler.wait()
+        return {file_path: responses[file_path] for file_path in file_paths}
+
+    def pending_uploads(self, file_paths, verify=False, workers=DEFAULT_UPLOAD_WORKERS):
+        """
+        Filter out the files that the upload ledger says are already on Drive
+
+        A file whose size and modification time match its ledger entry is
+        skipped without being read. If only its modification time changed, it
+        is hashed and skipped if its checksum still matches. Hashing runs on
+        several threads, and a file that has never been uploaded is not hashed
+        at all (Drive reports its checksum after the upload instead).
+
+        :param file_paths: a list of local paths
+        :param verify: also ask Drive whether each skipped file still exists
+        with the same checksum (with batched requests, see execute_batch)
+        :param workers: the number of files to check at once
+        :returns: the paths that still need uploading, in their original order
+        """
+        if self.ledger is None:
+            return list(file_paths)
+
+        def check(file_path):
+            try:
+                return self._is_uploaded(file_path)
+            except OSError as error:
+                self.logger.log_verbose("Couldn't check " + file_path + ": " + str(error))
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            uploaded = list(executor.map(check, file_paths))
+        if verify:
+            # Ask Drive about every file the ledger would skip, in batches
+            candidates = [path for path, is_uploaded in zip(file_paths, uploaded) if is_uploaded]
+            confirmed = dict(zip(candidates, self._verify_uploaded(candidates)))
+            uploaded = [is_uploaded and confirmed[path]
+                        for path, is_uploaded in zip(file_paths, uploaded)]
+        for file_path, is_uploaded in zip(file_paths, uploaded):
+            if is_uploaded:
+                self.logger.log_verbose("Already uploaded, skipping: " + file_path)
+        return [path for path, is_uploaded in zip(file_paths, uploaded) if not is_uploaded]
+
+    def _is_uploaded(self, file_path):
+        """
+        Check a single file against the upload ledger
+
+        :param file_path: the local path to check
+        :returns: True if the ledger says an identical copy of the file is
+        already on Drive
+        """
+        entry = self.ledger.lookup(file_path)
+        if entry is None:
+            return False
+        stat = os.stat(file_path)
+        if entry['size'] != stat.st_size:
+            return False
+        # A copy sent with other compression settings (or none) is a different
+        # file on Drive, so it is sent again
+        compressor = self._compressor_for(file_path)
+        encoding = compressor.label if compressor is not None else None
+        if entry.get('encoding') != encoding:
+            return False
+        md5 = entry['md5']
+        if entry['mtime'] != stat.st_mtime_ns:
+            if md5 is None or file_md5(file_path) != md5:
+                return False
+            # Touched but not changed: remember the new mtime to skip the hash next time
+            self.ledger.record(file_path, md5, entry['id'], encoding, entry.get('remote_md5'))
+        return True
+
+    def _verify_uploaded(self, file_paths):
+        """
+        Check files the ledger says are on Drive against the checksums Drive
+        has on record, looking them all up in batches. A file that Drive no
+        longer has is removed from the ledger
+
+        :param file_paths: the local paths to check, each with a ledger entry
+        :returns: a list with True for each file whose Drive copy still exists
+        with the same checksum, and False otherwise
+        """
+        entries = [self.ledger.lookup(file_path) for file_path in file_paths]
+        requests = [self.DRIVE_SERVICE.files().get(fileId=entry['id'], fields='md5Checksum,trashed')
+                    for entry in entries]
+        confirmed = []
+        for file_path, entry, (remote, error) in zip(file_paths, entries,
+                                                     self.execute_batch(requests)):
+            if error is not None:
+                if isinstance(error, errors.HttpError) and error.resp.status == 404:
+                    self.ledger.forget(file_path)
+                else:
+                    self.logger.log_verbose("Couldn't check " + file_path + ": " + str(error))
+                confirmed.append(False)
+                continue
+            # Drive has the checksum of what was sent, which for a compressed
+            # file is the compressed copy's
+            md5 = entry.get('remote_md5') if entry.get('encoding') else entry['md5']
+            try:
+                if md5 is None and not entry.get('encoding'):
+                    md5 = file_md5(file_path)
+            except OSError as error:
+                self.logger.log_verbose("Couldn't check " + file_path + ": " + str(error))
+                confirmed.append(False)
+                continue
+            confirmed.append(not remote.get('trashed') and remote.get('md5Checksum') == md5)
+        return confirmed
+
+    def execute_batch(self, requests):
+        """
+        Send several metadata requests using Drive's batch endpoint, so up to
+        MAX_BATCH_REQUESTS of them share one HTTP round trip
+
+        Each request succeeds or fails on its own. Requests that fail with a
+        rate limiting or server error (or whose whole batch was lost to a
+        dropped connection) are sent again in a later batch, with exponential
+        backoff; any other error is returned for that request alone.
+
+        :param requests: a list of googleapiclient HttpRequests, not yet
+        executed and not media uploads
+        :returns: a list with a (response, error) tuple for each request, in
+        order, where error is None if the request succeeded
+        """
+        results = [(None, None)] * len(requests)
+
+        def store(request_id, response, exception):
+            results[int(request_id)] = (response, exception)
+
+        pending = list(range(len(requests)))
+        retries = 0
+        while pending:
+            for start in range(0, len(pending), self.MAX_BATCH_REQUESTS):
+                chunk = pending[start:start + self.MAX_BATCH_REQUESTS]
+                batch = self.DRIVE_SERVICE.new_batch_http_request(callback=store)
+                for index in chunk:
+                    batch.add(requests[index], request_id=str(index))
+                try:
+                    with self.http_pool.connection() as connection:
+                        batch.execute(http=connection)
+                except (errors.HttpError, httplib2.HttpLib2Error, OSError) as error:
+                    for index in chunk:
+                        results[index] = (None, error)
+            pending = [index for index in pending if self._is_transient(results[index][1])]
+            if not pending or retries >= self.MAX_RETRIES:
+                break
+            delay = self.RETRY_BASE_DELAY * 2 ** retries * (1 + random.random())
+            self.logger.log_verbose(str(len(pending)) + " batched request(s) failed (" +
+                                    str(results[pending[0]][1]) +
+                                    "), retrying in {:.1f}s".format(delay))
+            time.sleep(delay)
+            retries += 1
+        return results
+
+    def _is_transient(self, error):
+        """
+        :param error: the exception a request failed with, or None
+        :returns: True if the request is worth retrying
+        """
+        if isinstance(error, errors.HttpError):
+            return error.resp.status in self.RETRY_STATUSES
+        return isinstance(error, (httplib2.HttpLib2Error, OSError))
+
     def create_folder(self, folder_name):
         """
         Creates a folder in Google Drive and returns the ID
@@ -108,9 +516,476 @@ class GoogleDrive:
         """
         folder_metadata = {
             'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder'
+            'mimeType': self.FOLDER_MIME_TYPE
         }
 
-        folder = self.DRIVE_SERVICE.files().create(body=folder_metadata, fields='id').execute()
+        with self.http_pool.connection() as connection:
+            folder = self.DRIVE_SERVICE.files().create(
+                body=folder_metadata, fields='id').execute(http=connection)
         self.logger.log_verbose("Created folder '" + folder_name + "' with ID " + folder.get('id'))
         return folder.get('id')
+
+    def create_folders(self, folder_names):
+        """
+        Creates several folders in Google Drive with one batched request (see
+        create_folder and execute_batch)
+
+        :param folder_names: the desired names of the folders
+        :returns: a list of the new folders' IDs, in order, with None for any
+        folder that couldn't be created
+        """
+        requests = [self.DRIVE_SERVICE.files().create(
+            body={'name': folder_name, 'mimeType': self.FOLDER_MIME_TYPE}, fields='id')
+                    for folder_name in folder_names]
+        folder_ids = []
+        for folder_name, (folder, error) in zip(folder_names, self.execute_batch(requests)):
+            if error is not None:
+                self.logger.log("ERROR: Unable to create folder '" + folder_name + "': " +
+                                str(error))
+                folder_ids.append(None)
+                continue
+            self.logger.log_verbose("Created folder '" + folder_name + "' with ID " +
+                                    folder.get('id'))
+            folder_ids.append(folder.get('id'))
+        return folder_ids
+
+    def move_files(self, moves):
+        """
+        Move several files into other folders with one batched request (see
+        execute_batch)
+
+        :param moves: a list of (file_id, folder_id, old_parent_ids) tuples
+        :returns: a list with True for each file moved, and False for each
+        file that couldn't be
+        """
+        requests = [self.DRIVE_SERVICE.files().update(
+            fileId=file_id, addParents=folder_id, removeParents=','.join(old_parent_ids),
+            fields='id,parents') for file_id, folder_id, old_parent_ids in moves]
+        moved = []
+        for (file_id, folder_id, _), (_, error) in zip(moves, self.execute_batch(requests)):
+            if error is not None:
+                self.logger.log("WARNING: Unable to move file " + file_id + " into folder " +
+                                folder_id + ": " + str(error))
+            moved.append(error is None)
+        return moved
+
+
+class UploadScheduler:
+    """
+    UploadScheduler uploads queued files on a pool of worker threads, always
+    starting the highest priority file next: data files first, then plots,
+    then videos, so the files engineers look at first aren't stuck behind a
+    multi-gigabyte video. Files of equal priority go in the order queued.
+
+    Each upload borrows an authorized connection from the drive's HttpPool,
+    since httplib2 connections can't be used by two threads at once. A failed
+    upload is logged and doesn't stop the others.
+
+    An upload resumed from an earlier run's session lands in the folder that
+    run chose. Such files are moved into the folder they were queued for, all
+    in one batched request, once the queue has drained.
+    """
+
+    DATA = 0
+    PLOT = 1
+    VIDEO = 2
+    _STOP = 3
+
+    def __init__(self, drive, workers=GoogleDrive.DEFAULT_UPLOAD_WORKERS, report=None):
+        """
+        Constructor. The workers start right away and wait for files
+
+        :param drive: the GoogleDrive to upload with
+        :param workers: the maximum number of uploads in flight at once
+        :param report: an instrumentation.RunReport to time each upload in
+        (as the "upload" stage) and count the bytes uploaded in, or None
+        """
+        self.drive = drive
+        self.logger = drive.logger
+        self.report = report
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.responses = {}
+        # (file ID, wanted folder ID, current parent IDs) of files to move
+        self.misplaced = []
+        self.queued = {'files': 0, 'bytes': 0}
+        self.uploaded = {'files': 0, 'bytes': 0}
+        self.start_time = time.time()
+        self.threads = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, file_path, parent_folder_id=None, priority=VIDEO, skip_uploaded=False):
+        """
+        Queue a file for upload. Safe to call from any thread
+
+        :param file_path: the local path to the file
+        :param parent_folder_id: the id of the folder where the file should be
+        placed, or a function returning it (called by the worker, so a folder
+        can be created only once something is going into it)
+        :param priority: DATA, PLOT or VIDEO
+        :param skip_uploaded: check the upload ledger first and skip the file
+        if an earlier run already uploaded it
+        """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            # The worker will fail to upload it and say why
+            size = 0
+        with self.lock:
+            self.queued['files'] += 1
+            self.queued['bytes'] += size
+        self.queue.put((priority, next(self.sequence), file_path,
+                        (parent_folder_id, skip_uploaded)))
+
+    def drain(self):
+        """
+        Wait for every queued file to finish uploading, keeping the workers
+
+        :returns: a dict mapping each path to its API response, or to None if
+        the upload failed
+        """
+        self.queue.join()
+        self._move_misplaced()
+        with self.lock:
+            return dict(self.responses)
+
+    def wait(self):
+        """
+        Wait for every queued file to finish uploading, then stop the workers
+
+        :returns: a dict mapping each path to its API response, or to None if
+        the upload failed
+        """
+        for _ in self.threads:
+            self.queue.put((self._STOP, next(self.sequence), None, (None, False)))
+        for thread in self.threads:
+            thread.join()
+        self._move_misplaced()
+        return dict(self.responses)
+
+    def _move_misplaced(self):
+        """
+        Move every uploaded file that landed in the wrong folder into the
+        folder it was queued for
+        """
+        with self.lock:
+            misplaced, self.misplaced = self.misplaced, []
+        if misplaced:
+            self.logger.log_verbose("Moving " + str(len(misplaced)) +
+                                    " resumed upload(s) into this run's folders")
+            self.drive.move_files(misplaced)
+
+    def _work(self):
+        """
+        Worker thread body: upload queued files until told to stop
+        """
+        while True:
+            _, _, file_path, options = self.queue.get()
+            try:
+                if file_path is None:
+                    return
+                self._upload(file_path, *options)
+            finally:
+                self.queue.task_done()
+
+    def _upload(self, file_path, parent_folder_id, skip_uploaded):
+        """
+        Upload one queued file and record the outcome. Any error is logged and
+        recorded as a failed upload, so the worker carries on with the next file
+        (and drain() and wait() can't be left waiting on a dead worker)
+        """
+        try:
+            if skip_uploaded and not self.drive.pending_uploads([file_path], workers=1):
+                with self.lock:
+                    self.responses[file_path] = self.drive.ledger.lookup(file_path)
+                return
+            if callable(parent_folder_id):
+                parent_folder_id = parent_folder_id()
+            size = os.path.getsize(file_path)
+            if self.report is None:
+                response = self.drive.upload_file(file_path, parent_folder_id)
+            else:
+                with self.report.span("upload", file_path):
+                    response = self.drive.upload_file(file_path, parent_folder_id)
+        except (errors.HttpError, httplib2.HttpLib2Error, OSError) as error:
+            self.logger.log("ERROR: Upload failed for " + file_path + ": " + str(error))
+            response = None
+        except Exception as error:  # pylint: disable=W0703
+            # e.g. a revoked token (HttpAccessTokenRefreshError) or a BatchError
+            self.logger.log("ERROR: Upload failed for " + file_path + ": " +
+                            type(error).__name__ + ": " + str(error))
+            response = None
+        with self.lock:
+            self.responses[file_path] = response
+            if response is None:
+                return
+            parents = response.get('parents')
+            if parent_folder_id is not None and parents and parent_folder_id not in parents:
+                self.misplaced.append((response['id'], parent_folder_id, parents))
+            self.uploaded['files'] += 1
+            self.uploaded['bytes'] += size
+            if self.report is not None:
+                # Drive reports the size it stored, which is smaller than the
+                # file's if it was compressed on the way
+                self.report.count(instrumentation.FILES_UPLOADED)
+                self.report.count(instrumentation.BYTES_UPLOADED,
+                                  int(response.get('size') or size))
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            self.logger.log("Uploaded {:d}/{:d} files ({:.1f}/{:.1f} MB, {:.2f} MB/s)".format(
+                self.uploaded['files'], self.queued['files'], self.uploaded['bytes'] / 1e6,
+                self.queued['bytes'] / 1e6, self.uploaded['bytes'] / 1e6 / elapsed))
+
+
+class ChunkSizer:
+    """
+    ChunkSizer picks the size of each chunk of a resumable upload so that a
+    chunk takes about TARGET_SECONDS to send. On a fast link that means large
+    chunks, so the round trip between chunks is a small share of the time; on
+    a slow or lossy link it means small chunks, so a failed chunk costs little
+    to resend. Sizes stay multiples of 256 KiB, as Drive requires.
+    """
+
+    GRANULARITY = 256 * 1024
+    MIN_BYTES = GRANULARITY
+    MAX_BYTES = 128 * 1024 * 1024
+    START_BYTES = 4 * GRANULARITY
+    TARGET_SECONDS = 4.0
+
+    def __init__(self, chunk_bytes=START_BYTES, max_bytes=MAX_BYTES):
+        """
+        Constructor
+
+        :param chunk_bytes: the size of the first chunk
+        :param max_bytes: the largest chunk to send, e.g. to keep each burst
+        short under a bandwidth cap
+        """
+        self.max_bytes = max(max_bytes, self.MIN_BYTES)
+        self.chunk_bytes = min(chunk_bytes, self.max_bytes)
+
+    def update(self, sent_bytes, seconds):
+        """
+        Adjust the chunk size after a chunk has been sent
+
+        :param sent_bytes: the size of the chunk that was sent
+        :param seconds: how long it took to send
+        """
+        if sent_bytes <= 0 or seconds <= 0:
+            return
+        ideal = sent_bytes / seconds * self.TARGET_SECONDS
+        # Move at most a factor of two per chunk, so one odd chunk can't swing it
+        ideal = min(max(ideal, self.chunk_bytes / 2), self.chunk_bytes * 2)
+        ideal = int(ideal) // self.GRANULARITY * self.GRANULARITY
+        self.chunk_bytes = min(max(ideal, self.MIN_BYTES), self.max_bytes)
+
+
+class AdaptiveMediaFileUpload(http.MediaFileUpload):
+    """
+    A MediaFileUpload whose chunk size is chosen by a ChunkSizer before every
+    chunk (googleapiclient asks for chunksize() each time it sends one)
+    """
+
+    def __init__(self, file_path, sizer):
+        http.MediaFileUpload.__init__(self, file_path, chunksize=sizer.chunk_bytes,
+                                      resumable=True)
+        self.sizer = sizer
+
+    def chunksize(self):
+        return self.sizer.chunk_bytes
+
+
+class CompressedMediaUpload(http.MediaUpload):
+    """
+    A resumable upload of a file compressed on the fly by a
+    compression.Compressor, with no compressed copy written to disk. Chunk
+    sizes come from a ChunkSizer, as with AdaptiveMediaFileUpload.
+
+    The compressed size isn't known until the whole file has been compressed,
+    so only the unconfirmed part of the compressed stream is kept in memory:
+    compressing runs at most one chunk ahead of what has been sent, and bytes
+    before the offset googleapiclient asks for (which the server has
+    confirmed) are dropped. If an earlier offset is asked for, e.g. when
+    resuming an upload, the file is compressed again from the start, which
+    gives the same bytes.
+    """
+
+    def __init__(self, file_path, sizer, compressor):
+        http.MediaUpload.__init__(self)
+        self.file_path = file_path
+        self.sizer = sizer
+        self.compressor = compressor
+        self.blocks = None
+        # MD5 of the file's bytes read so far, which is the whole file's once
+        # the compressed stream is complete
+        self.digest = None
+        self.buffer = bytearray()
+        # Offset of the first byte of buffer in the compressed stream
+        self.buffer_start = 0
+        # Bytes before this offset are no longer needed
+        self.keep_from = 0
+        # The end of the last chunk handed out
+        self.requested = 0
+        self.total = None
+
+    def chunksize(self):
+        return self.sizer.chunk_bytes
+
+    def mimetype(self):
+        return self.compressor.mime_type
+
+    def resumable(self):
+        return True
+
+    def size(self):
+        """
+        :returns: the compressed size, or None while it isn't known yet.
+        googleapiclient asks for it before sending each chunk, so compressing a
+        chunk ahead here means the last chunk is always sent with the total
+        size, even when it is exactly a chunk long
+        """
+        self._fill(self.requested + self.chunksize() + 1)
+        return self.total
+
+    def getbytes(self, begin, length):
+        if begin < self.buffer_start:
+            self._restart()
+        self.keep_from = begin
+        self._fill(begin + length)
+        data = bytes(self.buffer[begin - self.buffer_start:begin - self.buffer_start + length])
+        self.requested = begin + len(data)
+        return data
+
+    def source_md5(self):
+        """
+        :returns: the MD5 checksum of the uncompressed file as a hex string, or
+        None if it hasn't all been compressed yet
+        """
+        if self.total is None:
+            return None
+        return self.digest.hexdigest()
+
+    def _fill(self, end):
+        """
+        Compress until the stream reaches end or finishes, dropping bytes
+        before keep_from as it goes
+        """
+        if self.blocks is None:
+            self._restart()
+        while self.total is None and self.buffer_start + len(self.buffer) < end:
+            try:
+                self.buffer += next(self.blocks)
+            except StopIteration:
+                self.total = self.buffer_start + len(self.buffer)
+            drop = min(self.keep_from - self.buffer_start, len(self.buffer))
+            if drop > 0:
+                del self.buffer[:drop]
+                self.buffer_start += drop
+
+    def _restart(self):
+        """
+        Start compressing the file again from the beginning
+        """
+        if self.blocks is not None:
+            self.blocks.close()
+        self.digest = hashlib.md5()
+        self.blocks = self.compressor.stream(self.file_path, self.digest)
+        self.buffer = bytearray()
+        self.buffer_start = 0
+        self.total = None
+
+
+class BandwidthLimiter:
+    """
+    BandwidthLimiter caps the combined rate of every upload, leaving the rest
+    of the link free for other traffic. Workers reserve each chunk before
+    sending it and wait until it fits under the cap, so no credit builds up
+    while uploads are idle. A chunk still goes out at the link's full rate, so
+    chunks are kept to BURST_SECONDS' worth of the cap (see max_chunk_bytes),
+    which keeps each burst short.
+    """
+
+    BURST_SECONDS = 0.5
+
+    def __init__(self, bytes_per_second):
+        """
+        Constructor
+
+        :param bytes_per_second: the maximum combined upload rate
+        """
+        self.bytes_per_second = float(bytes_per_second)
+        self.lock = threading.Lock()
+        self.next_time = time.time()
+
+    def max_chunk_bytes(self):
+        """
+        :returns: the largest chunk to send under the cap, BURST_SECONDS of it
+        rounded down to a multiple of ChunkSizer.GRANULARITY (at least one)
+        """
+        granularity = ChunkSizer.GRANULARITY
+        return max(int(self.bytes_per_second * self.BURST_SECONDS) // granularity * granularity,
+                   granularity)
+
+    def reserve(self, chunk_bytes):
+        """
+        Wait until a chunk can be sent without going over the cap
+
+        :param chunk_bytes: the number of bytes about to be sent
+        """
+        with self.lock:
+            now = time.time()
+            start = max(self.next_time, now)
+            self.next_time = start + chunk_bytes / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+    def refund(self, unused_bytes):
+        """
+        Give back part of a reservation that wasn't sent
+
+        :param unused_bytes: the number of reserved bytes that weren't sent
+        """
+        with self.lock:
+            self.next_time -= unused_bytes / self.bytes_per_second
+
+
+class HttpPool:
+    """
+    HttpPool lends out authorized httplib2.Http objects. Each one keeps its
+    connections to Google open between requests, so once a connection has
+    been set up (TCP and TLS handshakes, a few round trips on a high-latency
+    link) every later upload, folder creation and metadata lookup that borrows
+    it skips that cost. An httplib2.Http can't be used by two threads at once,
+    so each is lent to one caller at a time; a new one is made whenever every
+    existing one is busy, and the most recently returned one is lent first.
+
+    The objects come from http.build_http(), which stops httplib2 from
+    treating the 308 "resume incomplete" reply of a chunked upload as a
+    redirect.
+    """
+
+    def __init__(self, credentials):
+        """
+        Constructor
+
+        :param credentials: the oauth2client credentials to authorize requests with
+        """
+        self.credentials = credentials
+        self.lock = threading.Lock()
+        self.idle = []
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow an authorized httplib2.Http for the duration of a with block
+        """
+        with self.lock:
+            http_client = self.idle.pop() if self.idle else None
+        if http_client is None:
+            http_client = self.credentials.authorize(http.build_http())
+        try:
+            yield http_client
+        finally:
+            with self.lock:
+                self.idle.append(http_client)
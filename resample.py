@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Puts channels recorded at different rates (and with jittered timestamps) onto
+one shared time grid, so they can be overlaid, exported side by side or
+combined sample by sample. Every channel that shares a time column (i.e. every
+channel of one CSV file) is resampled together: the grid is located in the
+time column with one vectorized search, and the same indices and weights are
+then applied to each of the channels. Time columns that go backwards are
+sorted first.
+"""
+
+import numpy as np
+import filters
+
+NEAREST = "nearest"
+LINEAR = "linear"
+DECIMATE = "decimate"
+METHODS = (NEAREST, LINEAR, DECIMATE)
+# The anti-aliasing filter used by DECIMATE: an order 8 Butterworth filter
+# with its cutoff just below the Nyquist rate of the grid
+DECIMATE_ORDER = 8
+DECIMATE_CUTOFF = 0.8
+
+
+def common_grid(time_columns, rate=None):
+    """
+    Build an evenly spaced time grid covering the span every time column has
+    data for
+
+    :param time_columns: a list of arrays of times
+    :param rate: the grid's sample rate in Hz, or None to use the rate of the
+    slowest time column (so no channel is made to look more detailed than it is)
+    :returns: an array of times
+    :raises ValueError: if the time columns don't overlap
+    """
+    if any(not np.isfinite(times).any() for times in time_columns):
+        raise ValueError("a channel has no samples")
+    start = max(float(np.nanmin(times)) for times in time_columns)
+    stop = min(float(np.nanmax(times)) for times in time_columns)
+    if not stop > start:
+        raise ValueError("the channels don't overlap in time")
+    if rate is None:
+        # The average rate over each column's span, which doesn't need it sorted
+        rate = min((np.isfinite(times).sum() - 1) / (float(np.nanmax(times)) -
+                                                     float(np.nanmin(times)))
+                   for times in time_columns)
+    if not 0 < rate < np.inf:
+        raise ValueError("the grid's sample rate must be above 0 Hz")
+    return start + np.arange(int(np.floor((stop - start) * rate)) + 1) / rate
+
+
+def resample(times, values, grid, method=LINEAR, out=None):
+    """
+    Resample channels that share a time column onto a time grid
+
+    :param times: the channels' time column (sorted first if it goes backwards)
+    :param values: a 2D array with one channel per column (or a 1D array)
+    :param grid: the times to resample to, in increasing order and within
+    the span of times
+    :param method: NEAREST (take the closest sample), LINEAR (interpolate
+    between the samples either side) or DECIMATE (low-pass filter the
+    channels below the grid's Nyquist rate first, then interpolate, so noise
+    faster than the grid can show isn't aliased into it)
+    :param out: an optional 2D array to write the result to, with one row per
+    grid time (only when values is 2D)
+    :returns: an array with one row per grid time and the same columns as values
+    """
+    if method not in METHODS:
+        raise ValueError("unknown resampling method '" + str(method) + "'")
+    times = np.asarray(times)
+    values = np.asarray(values)
+    finite = np.isfinite(times)
+    if not finite.all():
+        # Drop rows without a time (e.g. a header line)
+        first = int(np.argmax(finite))
+        rows = slice(first, None) if finite[first:].all() else finite
+        times, values = times[rows], values[rows]
+    if not filters.is_sorted(times):
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+    if method == DECIMATE and len(grid) > 1 and len(times) > 1:
+        source_rate = filters.sample_rate(times)
+        cutoff = DECIMATE_CUTOFF * filters.sample_rate(grid) / source_rate
+        if cutoff < 1:
+            # Only the samples under the grid are filtered, plus enough either
+            # side for the filter to settle, as with trimmed filters
+            margin = int(np.ceil(filters.MARGIN_CYCLES_PER_ORDER * DECIMATE_ORDER * 2 / cutoff))
+            rows = filters.window_index(times, grid[0], grid[-1], margin)
+            times, values = times[rows], values[rows]
+            try:
+                values = filters.butter_filter(values, DECIMATE_ORDER, cutoff)
+            except ValueError:
+                # Too few samples to filter, and so too few to alias much
+                pass
+    # Index of the last sample at or before each grid time
+    below = np.clip(np.searchsorted(times, grid, side="right") - 1, 0, len(times) - 2)
+    above = below + 1
+    span = times[above] - times[below]
+    weight = np.divide(grid - times[below], span, out=np.zeros(len(grid)), where=span > 0)
+    weight = np.clip(weight, 0.0, 1.0)
+    if method == NEAREST:
+        nearest = np.where(weight < 0.5, below, above)
+        return _per_column(values, len(grid), values.dtype, lambda column: column[nearest], out)
+    dtype = np.result_type(values.dtype, np.float32)
+    weight = weight.astype(dtype)
+
+    def interpolate(column):
+        lower = column[below]
+        return lower + (column[above] - lower) * weight
+    return _per_column(values, len(grid), dtype, interpolate, out)
+
+
+def _per_column(values, rows, dtype, function, out=None):
+    """
+    Apply a function to each column of a 2D array (or to a 1D array)
+
+    The indices and weights are worked out once for every column; gathering
+    from one contiguous column at a time is then much faster than gathering
+    whole rows of a column-major array.
+
+    :param values: the array
+    :param rows: the length of the function's result
+    :param dtype: the dtype of the function's result
+    :param function: a function taking a column and returning its new values
+    :param out: the array to write the results to, or None for a new one
+    :returns: a column-major array of the results
+    """
+    if values.ndim == 1:
+        return function(values)
+    if out is None:
+        out = np.empty((rows, values.shape[1]), dtype=dtype, order="F")
+    for index in range(values.shape[1]):
+        out[:, index] = function(values[:, index])
+    return out
+
+
+def align(groups, rate=None, method=LINEAR):
+    """
+    Resample groups of channels, each group with its own time column, onto
+    one common grid
+
+    :param groups: a list of (times, values) tuples, where values is a 2D array
+    with one channel per column
+    :param rate: the grid's sample rate in Hz, or None (see common_grid)
+    :param method: NEAREST, LINEAR or DECIMATE (see resample)
+    :returns: a tuple of (grid, 2D array with a column for every channel of
+    every group, in order)
+    """
+    grid = common_grid([times for times, _ in groups], rate)
+    columns = sum(np.shape(values)[1] if np.ndim(values) > 1 else 1 for _, values in groups)
+    dtype = np.result_type(*[np.asarray(values).dtype for _, values in groups], np.float32)
+    out = np.empty((len(grid), columns), dtype=dtype, order="F")
+    column = 0
+    for times, values in groups:
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        width = values.shape[1]
+        resample(times, values, grid, method, out[:, column:column + width])
+        column += width
+    return grid, out
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+VIDEO_FILE_TYPES = (".mp4", ".mov", ".avi")
+DATA_FILE_TYPES = (".csv",)
+PLOT_FILE_TYPES = (".pdf",)
+T0_FILE_NAME = "t0_time.csv"
+# Folders Echo saves its plots, summaries and exports to. They're skipped, so
+# a run from inside the search path doesn't pick up its own output
+OUTPUT_FOLDER_PREFIX = "EchoPlots-"
+
+VIDEO = "video"
+DATA = "data"
+PLOT = "plot"
+T0 = "t0"
+
+# Directory listings are I/O bound (especially on network shares), so it pays
+# to have more of them in flight than there are CPUs
+DEFAULT_THREADS = 8
+
+FileEntry = namedtuple("FileEntry", ["path", "size", "mtime", "kind"])
+
+
+class Manifest:
+    """
+    A Manifest lists every file of interest found under a search path
+    """
+
+    def __init__(self, root, entries):
+        """
+        Constructor
+
+        :param root: the path that was scanned
+        :param entries: a list of FileEntry tuples
+        """
+        self.root = root
+        self.entries = sorted(entries, key=lambda entry: entry.path)
+
+    def files(self, kind):
+        """
+        :param kind: one of VIDEO, DATA, PLOT or T0
+        :returns: a list of the FileEntry tuples of the given kind
+        """
+        return [entry for entry in self.entries if entry.kind == kind]
+
+    def paths(self, kind):
+        """
+        :param kind: one of VIDEO, DATA, PLOT or T0
+        :returns: a list of the paths of the files of the given kind
+        """
+        return [entry.path for entry in self.entries if entry.kind == kind]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def classify(file_name):
+    """
+    Work out what kind of file a file name refers to
+
+    :param file_name: the name of the file
+    :returns: VIDEO, DATA, PLOT or T0, or None if Echo has no use for the file
+    """
+    lower = file_name.lower()
+    if lower.endswith(T0_FILE_NAME):
+        return T0
+    if lower.endswith(DATA_FILE_TYPES):
+        return DATA
+    if lower.endswith(VIDEO_FILE_TYPES):
+        return VIDEO
+    if lower.endswith(PLOT_FILE_TYPES):
+        return PLOT
+    return None
+
+
+def is_output_folder(name):
+    """
+    :param name: the name of a directory
+    :returns: True if it is one of Echo's own output folders
+    """
+    return name.startswith(OUTPUT_FOLDER_PREFIX)
+
+
+def scan(path, threads=DEFAULT_THREADS):
+    """
+    Search the given path recursively in a single pass and classify every file
+
+    Each directory is listed once with os.scandir, and subdirectories are listed
+    in parallel. Unreadable directories and Echo's own output folders are
+    skipped.
+
+    :param path: the path to search
+    :param threads: the number of directories to list at once
+    :returns: a Manifest of the files found
+    """
+    entries = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(_scan_dir, path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_entries, subdirs = future.result()
+                entries.extend(dir_entries)
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_dir, subdir))
+    return Manifest(path, entries)
+
+
+def _scan_dir(path):
+    """
+    List one directory
+
+    Only files that classify() recognises are stat'ed, which keeps the number
+    of round trips down on network shares.
+
+    :param path: the directory to list
+    :returns: a tuple of (list of FileEntry, list of subdirectory paths)
+    """
+    entries = []
+    subdirs = []
+    try:
+        with os.scandir(path) as iterator:
+            for dir_entry in iterator:
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        if not is_output_folder(dir_entry.name):
+                            subdirs.append(dir_entry.path)
+                        continue
+                    kind = classify(dir_entry.name)
+                    if kind is not None and dir_entry.is_file():
+                        stat = dir_entry.stat()
+                        entries.append(FileEntry(dir_entry.path, stat.st_size,
+                                                 stat.st_mtime, kind))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return entries, subdirs
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Summary statistics and event detection for every channel of a data file, so
+peak pressure, burn duration and rise time can be read off one table instead
+of every plot. All the channels of a file are worked on together, as one 2D
+block, a bounded number of rows at a time; there are no Python loops over
+samples or channels, and memory use stays flat however long the file is
+(memory-mapped arrays from the cache are only read).
+
+An event is the run of samples around a channel's peak that stays above a
+threshold, set as a fraction of the way from the channel's baseline (its mean
+before T0) to its peak. Rise time runs from the channel's last time below 10%
+of that height before the peak to its first time at 90% after that, so noise
+on a plateau doesn't stretch it. Crossing times are interpolated between
+samples.
+"""
+
+import csv
+import numpy as np
+
+# Fraction of the way from baseline to peak that starts and ends an event
+DEFAULT_THRESHOLD = 0.1
+# Fractions of the way from baseline to peak that the rise time is measured between
+RISE_LOW = 0.1
+RISE_HIGH = 0.9
+# Values worked on at once (rows times channels), which bounds the temporary arrays
+BLOCK_ELEMENTS = 4 * 1024 * 1024
+# Columns of the summary file, in order, after the file and channel names
+FIELDS = ("samples", "min", "max", "mean", "rms", "baseline", "peak_time", "event_start",
+          "event_end", "event_duration", "rise_time")
+
+
+def summarize(channels, threshold=DEFAULT_THRESHOLD):
+    """
+    Compute the statistics and events of every channel of a ChannelSet. NaN
+    values (e.g. from a header line) are ignored. Times are relative to T0
+
+    :param channels: a plotting.ChannelSet
+    :param threshold: the event threshold, as a fraction of the way from
+    baseline to peak
+    :returns: a dict mapping each name in FIELDS to an array with one value
+    per channel. Anything that couldn't be found (e.g. the event of a channel
+    that never rises above its baseline) is NaN
+    """
+    times = channels.times
+    values = channels.data[:, 1:]
+    rows, count = values.shape
+    t0_time = channels.t0_time
+    block_rows = max(1, BLOCK_ELEMENTS // max(count, 1))
+
+    # First pass: totals, extremes and the baseline
+    samples = np.zeros(count, dtype=np.int64)
+    total = np.zeros(count)
+    squares = np.zeros(count)
+    low = np.full(count, np.inf)
+    high = np.full(count, -np.inf)
+    peak_index = np.zeros(count, dtype=np.int64)
+    before_total = np.zeros(count)
+    before_samples = np.zeros(count, dtype=np.int64)
+    for start in range(0, rows, block_rows):
+        block = np.array(values[start:start + block_rows], dtype=np.float64)
+        valid = ~np.isnan(block)
+        block[~valid] = 0.0
+        samples += valid.sum(axis=0)
+        total += block.sum(axis=0)
+        squares += np.einsum("ij,ij->j", block, block)
+        before = times[start:start + block_rows] < t0_time
+        before_total += block[before].sum(axis=0)
+        before_samples += valid[before].sum(axis=0)
+        low = np.minimum(low, np.where(valid, block, np.inf).min(axis=0))
+        maximums = np.where(valid, block, -np.inf)
+        block_peak = maximums.argmax(axis=0)
+        block_high = maximums[block_peak, np.arange(count)]
+        higher = block_high > high
+        peak_index = np.where(higher, block_peak + start, peak_index)
+        high = np.where(higher, block_high, high)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / samples
+        rms = np.sqrt(squares / samples)
+        baseline = np.where(before_samples > 0, before_total / before_samples, low)
+    found = samples > 0
+    low[~found] = np.nan
+    high[~found] = np.nan
+    height = high - baseline
+    has_event = found & (height > 0)
+
+    # Second pass: the last sample below the threshold and the rise's low
+    # level before the peak, and the first sample below the threshold after it
+    fractions = np.array([threshold, RISE_LOW])
+    levels = baseline + fractions[:, np.newaxis] * height
+    last_below = np.full((len(fractions), count), -1, dtype=np.int64)
+    first_below = np.full(count, -1, dtype=np.int64)
+    for start in range(0, rows, block_rows) if has_event.any() else ():
+        block = values[start:start + block_rows]
+        positions = np.arange(start, start + len(block))[:, np.newaxis]
+        below = ((block[:, np.newaxis, :] < levels) &
+                 (positions[:, :, np.newaxis] < peak_index))
+        any_below = below.any(axis=0)
+        last = start + len(block) - 1 - below[::-1].argmax(axis=0)
+        last_below = np.where(any_below, last, last_below)
+        after = (block < levels[0]) & (positions > peak_index)
+        first = start + after.argmax(axis=0)
+        first_below = np.where((first_below < 0) & after.any(axis=0), first, first_below)
+
+    # Third pass, over the rising edges only: the first sample at the rise's
+    # high level after its low level
+    high_level = baseline + RISE_HIGH * height
+    rise_start = np.where(has_event, last_below[1], rows)
+    first_above = np.full(count, -1, dtype=np.int64)
+    edge_start = max(int(rise_start.min()), 0) if count else 0
+    edge_stop = int(peak_index.max()) + 1 if count else 0
+    for start in range(edge_start, edge_stop, block_rows):
+        block = values[start:min(start + block_rows, edge_stop)]
+        positions = np.arange(start, start + len(block))[:, np.newaxis]
+        above = (block >= high_level) & (positions > rise_start)
+        first = start + above.argmax(axis=0)
+        first_above = np.where((first_above < 0) & above.any(axis=0), first, first_above)
+
+    event_start = _crossing_time(times, values, last_below[0], levels[0], has_event)
+    event_end = _crossing_time(times, values, first_below - 1, levels[0], has_event)
+    rise_low = _crossing_time(times, values, last_below[1], levels[1], has_event)
+    rise_high = _crossing_time(times, values, first_above - 1, high_level, has_event)
+    peak_time = np.where(found, times[peak_index] if rows else np.nan, np.nan)
+    return {
+        "samples": samples, "min": low, "max": high, "mean": mean, "rms": rms,
+        "baseline": np.where(found, baseline, np.nan), "peak_time": peak_time - t0_time,
+        "event_start": event_start - t0_time, "event_end": event_end - t0_time,
+        "event_duration": event_end - event_start, "rise_time": rise_high - rise_low}
+
+
+def _crossing_time(times, values, indices, levels, mask):
+    """
+    Interpolate when each channel crossed its level between two samples
+
+    :param times: the time column
+    :param values: the value columns
+    :param indices: for each channel, the sample just before the crossing
+    (the one after is indices + 1), or a negative number if there wasn't one
+    :param levels: the level of each channel
+    :param mask: False for channels to skip
+    :returns: the time of each crossing, or NaN where there was none
+    """
+    usable = mask & (indices >= 0) & (indices + 1 < len(times))
+    rows = np.where(usable, indices, 0)
+    columns = np.arange(values.shape[1])
+    if len(times) < 2:
+        return np.full(values.shape[1], np.nan)
+    before = values[rows, columns].astype(np.float64)
+    after = values[rows + 1, columns].astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.clip(np.where(after != before, (levels - before) / (after - before), 0.0),
+                           0.0, 1.0)
+    crossing = times[rows] + fraction * (times[rows + 1] - times[rows])
+    return np.where(usable, crossing, np.nan)
+
+
+def write_csv(path, summaries):
+    """
+    Write summaries as a CSV file, one row per channel
+
+    :param path: the path of the CSV file to write
+    :param summaries: a list of (file name, channel names, summary) tuples,
+    where each summary is a dict returned by summarize()
+    """
+    with open(path, "w", newline="") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(("file", "channel") + FIELDS)
+        for file_name, names, summary in summaries:
+            columns = np.column_stack([summary[field] for field in FIELDS])
+            writer.writerows([file_name, name] + ["{:.6g}".format(value) for value in row]
+                             for name, row in zip(names, columns.tolist()))
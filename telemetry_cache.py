@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+"""
+
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+
+class TelemetryCache:
+    """
+    TelemetryCache keeps parsed telemetry arrays as .npy files in a cache
+    directory, so later reads of an unchanged CSV can memory-map the array
+    instead of parsing the text again.
+
+    Entries are keyed by the source file's path, size and modification time (plus
+    the options used to parse it), so editing or replacing a file invalidates its
+    entry. The total size of the cache is capped, and the least recently used
+    entries are evicted first. An array that was parsed straight into the cache
+    (see load's stream argument) is kept even if it is bigger than the cap,
+    since it has nowhere else to live.
+    """
+
+    INDEX_FILE = "index.json"
+    DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+    cache_dir = None
+    max_bytes = DEFAULT_MAX_BYTES
+    logger = None
+
+    def __init__(self, logger, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Constructor
+
+        :param logger: the Logger to report cache activity to
+        :param cache_dir: the directory to store cached arrays in (created if needed)
+        :param max_bytes: the maximum total size of the cached arrays
+        """
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.index = self._load_index()
+
+    def load(self, path, loader, options="", stream=False):
+        """
+        Return the array for a file, from the cache if possible
+
+        Cached arrays are memory-mapped copy-on-write, so callers may modify them
+        without touching the cache.
+
+        :param path: path to the source file
+        :param loader: a function that takes path and parses it into a NumPy array
+        :param options: a string describing any parse options that change the result
+        :param stream: the array is too big to build in memory, so the loader is
+        called as loader(path, npy_path) and writes it to the .npy file at
+        npy_path itself (e.g. through csv_reader.memmap_allocator). The entry
+        is kept however big it is, and older ones are evicted to make room
+        :returns: the NumPy array for path
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = self._key(path, stat, options)
+        entry = self.index.get(key)
+        npy_path = os.path.join(self.cache_dir, key + ".npy")
+        if entry is not None and os.path.isfile(npy_path):
+            entry["last_used"] = time.time()
+            self._save_index()
+            self.logger.log_verbose("Cache hit: " + path)
+            return np.load(npy_path, mmap_mode="c")
+
+        tmp_path = npy_path + ".tmp"
+        if stream:
+            try:
+                loader(path, tmp_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._invalidate(path, stat)
+        else:
+            arr = loader(path)
+            self._invalidate(path, stat)
+            if arr.nbytes > self.max_bytes:
+                return arr
+            with open(tmp_path, "wb") as npy_file:
+                np.save(npy_file, arr)
+        os.replace(tmp_path, npy_path)
+        self.index[key] = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                           "bytes": os.path.getsize(npy_path), "last_used": time.time()}
+        self._evict(key)
+        self._save_index()
+        self.logger.log_verbose("Cached " + path)
+        return np.load(npy_path, mmap_mode="c")
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        """
+        for key in list(self.index):
+            self._remove(key)
+        self._save_index()
+
+    def _key(self, path, stat, options):
+        """
+        Build the cache key for a file from its path, size, mtime and parse options
+        """
+        key = "\0".join((path, str(stat.st_size), str(stat.st_mtime_ns), options))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _invalidate(self, path, stat):
+        """
+        Drop every stale entry that was built from path: those made from an
+        older version of the file. Entries for the current version with other
+        parse options are kept
+
+        :param path: the real path of the source file
+        :param stat: the file's current os.stat result
+        """
+        for key in [key for key, entry in self.index.items() if entry["path"] == path and
+                    (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime_ns)]:
+            self._remove(key)
+
+    def _evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in max_bytes
+
+        :param keep: the key of an entry never to evict (the one just added)
+        """
+        total = sum(entry["bytes"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.index[key]["bytes"]
+            self.logger.log_verbose("Evicting from cache: " + self.index[key]["path"])
+            self._remove(key)
+
+    def _remove(self, key):
+        """
+        Delete an entry's array file and forget it
+        """
+        del self.index[key]
+        try:
+            os.remove(os.path.join(self.cache_dir, key + ".npy"))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """
+        Read the cache index, starting over if it is missing or unreadable
+        """
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), "r") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        """
+        Atomically write the cache index to disk
+        """
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(index_path + ".tmp", index_path)
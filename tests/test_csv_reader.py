@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Tests for csv_reader.read_csv: malformed rows are skipped the same way
+whether or not columns are selected, float32 arrays can keep float64 times,
+and reading out-of-core into memory-mapped files gives the same arrays.
+
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import csv_reader  # pylint: disable=C0413
+
+# Enough rows that blocks take numpy's fast path rather than the row parser
+ROWS = 1000
+
+
+class ReadCsvTest(unittest.TestCase):
+    """
+    read_csv on small files with a few bad rows
+    """
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def write_csv(self, lines):
+        """
+        :returns: the path of a new CSV file holding the lines
+        """
+        path = os.path.join(self.work, "data.csv")
+        with open(path, "w") as csv_file:
+            csv_file.write("\n".join(lines) + "\n")
+        return path
+
+    def test_rows_with_wrong_field_count_skipped_with_columns(self):
+        lines = ["%d,%d,%d" % (row, row * 2, row * 3) for row in range(ROWS)]
+        lines[100] = "100,200,300,400"
+        lines[500] = "500,1000"
+        path = self.write_csv(lines)
+        every = csv_reader.read_csv(path)
+        selected = csv_reader.read_csv(path, columns=[0, 1])
+        self.assertEqual(len(every), ROWS - 2)
+        np.testing.assert_array_equal(selected, every[:, :2])
+        self.assertNotIn(100.0, selected[:, 0])
+        self.assertNotIn(500.0, selected[:, 0])
+
+    def test_comments_and_blank_lines_kept_on_fast_path(self):
+        lines = ["%d,%d,%d # a, b" % (row, row, row) if row % 10 else ""
+                 for row in range(ROWS)]
+        self.assertEqual(len(csv_reader.read_csv(self.write_csv(lines), columns=[2])),
+                         ROWS - ROWS // 10)
+
+    def test_float32_with_float64_times(self):
+        start = 1.7e9
+        lines = ["%.6f,%d" % (start + row * 0.001, row) for row in range(ROWS)]
+        times, data = csv_reader.read_csv(self.write_csv(lines), dtype=np.float32,
+                                          order="F", time_dtype=np.float64)
+        self.assertEqual(data.dtype, np.float32)
+        self.assertEqual(times.dtype, np.float64)
+        np.testing.assert_allclose(np.diff(times), 0.001, rtol=0, atol=1e-6)
+        np.testing.assert_array_equal(data[:, 1], np.arange(ROWS))
+
+    def test_out_of_core_matches_in_memory(self):
+        lines = ["%d,%d,%d" % (row, row * 2, row * 3) for row in range(20 * ROWS)]
+        lines[100] = "100,200,300,400"
+        path = self.write_csv(lines)
+        npy_path = os.path.join(self.work, "data.npy")
+        options = {"dtype": np.float32, "time_dtype": np.float64, "order": "F",
+                   "chunk_bytes": 4096, "threads": 2}
+        times, data = csv_reader.read_csv(path, **options)
+        mapped_times, mapped = csv_reader.read_csv(
+            path, allocate=csv_reader.memmap_allocator([None, npy_path]), **options)
+        self.assertIsInstance(mapped, np.memmap)
+        np.testing.assert_array_equal(mapped_times, times)
+        np.testing.assert_array_equal(mapped, data)
+        saved = np.load(npy_path, mmap_mode="r")
+        self.assertTrue(saved.flags.f_contiguous)
+        np.testing.assert_array_equal(saved, data)
+
+
+if __name__ == "__main__":
+    unittest.main()
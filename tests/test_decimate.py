@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Tests for plotting.minmax_decimate: every bucket's extremes (and so the
+series' global ones) survive, in their original order. DataSet.decimate
+gives the same points, with the T0 shift applied.
+
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from plotting import DataSet, minmax_decimate  # pylint: disable=C0413
+
+
+class MinMaxDecimateTest(unittest.TestCase):
+    """
+    minmax_decimate on noise with a few spikes and dropouts
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.xlist = np.arange(100003) / 1000.0
+        self.ylist = rng.normal(0.0, 1.0, len(self.xlist))
+        # Single-sample spikes and dropouts that striding would step over
+        self.ylist[[12345, 67891]] = [50.0, 40.0]
+        self.ylist[[333, 99999]] = [-60.0, -45.0]
+
+    def test_global_extremes_kept(self):
+        _, ylist = minmax_decimate(self.xlist, self.ylist, 500)
+        self.assertEqual(ylist.max(), self.ylist.max())
+        self.assertEqual(ylist.min(), self.ylist.min())
+        for spike in (50.0, 40.0, -60.0, -45.0):
+            self.assertIn(spike, ylist)
+
+    def test_bucket_extremes_kept(self):
+        buckets = 500
+        xlist, ylist = minmax_decimate(self.xlist, self.ylist, buckets)
+        width = len(self.ylist) // buckets
+        starts = list(range(0, width * buckets, width)) + [width * buckets]
+        stops = starts[1:] + [len(self.ylist)]
+        for start, stop in zip(starts, stops):
+            if start == stop:
+                continue
+            kept = ylist[(xlist >= self.xlist[start]) & (xlist <= self.xlist[stop - 1])]
+            self.assertEqual(kept.max(), self.ylist[start:stop].max())
+            self.assertEqual(kept.min(), self.ylist[start:stop].min())
+
+    def test_order_and_pairs_kept(self):
+        xlist, ylist = minmax_decimate(self.xlist, self.ylist, 500)
+        self.assertLessEqual(len(ylist), 2 * 500 + 2)
+        self.assertTrue(np.all(np.diff(xlist) > 0))
+        # Every point is an original (x, y) pair
+        indices = np.searchsorted(self.xlist, xlist)
+        np.testing.assert_array_equal(self.xlist[indices], xlist)
+        np.testing.assert_array_equal(self.ylist[indices], ylist)
+
+    def test_short_series_unchanged(self):
+        xlist, ylist = minmax_decimate(self.xlist[:1000], self.ylist[:1000], 500)
+        np.testing.assert_array_equal(xlist, self.xlist[:1000])
+        np.testing.assert_array_equal(ylist, self.ylist[:1000])
+
+    def test_dataset_decimated_after_shift(self):
+        dataset = DataSet("VOXB", self.xlist, self.ylist, 12.5).decimate(500)
+        xlist, ylist = minmax_decimate(self.xlist - 12.5, self.ylist, 500)
+        np.testing.assert_array_equal(dataset.xlist, xlist)
+        np.testing.assert_array_equal(dataset.ylist, ylist)
+
+
+if __name__ == "__main__":
+    unittest.main()
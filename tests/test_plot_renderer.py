@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Tests for plotting.PlotRenderer: a plot that can't be drawn is logged and
+left out of the finished list the same way in this process as on the pool,
+and the others are still drawn.
+
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import plotting  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+
+
+class PlotRendererTest(unittest.TestCase):
+    """
+    Render a good plot and one whose folder doesn't exist
+    """
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.work, "echo.log")
+        self.logger = Logger(path=self.log_path)
+        xlist = np.arange(50000) / 1000.0
+        self.dataset = plotting.DataSet("VOXB", xlist, np.sin(xlist))
+
+    def tearDown(self):
+        self.logger.close()
+        shutil.rmtree(self.work)
+
+    def render(self, processes):
+        """
+        :returns: a tuple of (the finished plots, the log's lines)
+        """
+        good = plotting.DataAnalysis(self.logger, False, self.work)
+        bad = plotting.DataAnalysis(self.logger, False, os.path.join(self.work, "missing"))
+        renderer = plotting.PlotRenderer(good, processes)
+        renderer.submit(self.dataset, "Time (s)", "Units")
+        renderer.analysis = bad
+        renderer.submit(self.dataset, "Time (s)", "Units", title="lost")
+        finished = renderer.wait()
+        self.logger.flush()
+        with open(self.log_path) as log_file:
+            return finished, log_file.read().splitlines()
+
+    def assertLoggedFailure(self, finished, lines):  # pylint: disable=C0103
+        """
+        Check that only the good plot was drawn, and the bad one was logged
+        """
+        self.assertEqual(finished, [os.path.join(self.work, "VOXB.pdf")])
+        self.assertTrue(os.path.isfile(finished[0]))
+        self.assertEqual(len([line for line in lines if "ERROR: Unable to generate" in line and
+                              "lost.pdf" in line]), 1)
+
+    def test_failure_logged_in_process(self):
+        self.assertLoggedFailure(*self.render(1))
+
+    def test_failure_logged_on_pool(self):
+        self.assertLoggedFailure(*self.render(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+
+Tests for uploading to Drive, against the local stand-in Drive from
+benchmarks/stand_in_drive.py: retrying chunks that get HTTP 429 or 5xx,
+resuming an interrupted upload from where the server got to, one file's
+failure leaving the others to upload, and the upload ledger recognising a
+file that was compressed on the way.
+
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from oauth2client import client, file as oauth_file
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import compression  # pylint: disable=C0413
+import remote_storage  # pylint: disable=C0413
+import scanner  # pylint: disable=C0413
+from echo_logger import Logger  # pylint: disable=C0413
+from stand_in_drive import DISCOVERY_PATH, StandInDrive, serve  # pylint: disable=C0413
+from upload_ledger import UploadLedger, UploadSessions, file_md5  # pylint: disable=C0413
+
+# Bigger than the first chunk (ChunkSizer.START_BYTES), so uploads take several
+FILE_BYTES = 3 * 1024 * 1024
+
+
+class StandInDriveTest(unittest.TestCase):
+    """
+    Uploads to the stand-in Drive, with no simulated latency
+    """
+
+    base = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base = serve(0.0)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.credentials_path = os.path.join(self.work, "drive.credentials")
+        oauth_file.Storage(self.credentials_path).put(
+            client.AccessTokenCredentials("token", "test"))
+        StandInDrive.upload_failures = []
+        StandInDrive.failing_names = set()
+
+    def tearDown(self):
+        StandInDrive.upload_failures = []
+        StandInDrive.failing_names = set()
+        shutil.rmtree(self.work)
+
+    def make_drive(self, **kwargs):
+        """
+        :returns: a GoogleDrive using the stand-in, which retries without waiting
+        """
+        drive = remote_storage.GoogleDrive(Logger(), credentials_path=self.credentials_path,
+                                           discovery_uri=self.base + DISCOVERY_PATH[1:],
+                                           **kwargs)
+        drive.RETRY_BASE_DELAY = 0.0
+        return drive
+
+    def make_file(self, name, size=FILE_BYTES):
+        """
+        :returns: the path of a new file of random bytes
+        """
+        path = os.path.join(self.work, name)
+        with open(path, "wb") as new_file:
+            new_file.write(os.urandom(size))
+        return path
+
+    def assertUploaded(self, response, path):  # pylint: disable=C0103
+        """
+        Check that Drive ended up with exactly the file's bytes
+        """
+        self.assertIsNotNone(response)
+        with open(path, "rb") as source:
+            self.assertEqual(response["md5Checksum"], hashlib.md5(source.read()).hexdigest())
+        self.assertEqual(int(response["size"]), os.path.getsize(path))
+
+    def test_retries_rate_limits_and_server_errors(self):
+        path = self.make_file("retried.bin")
+        StandInDrive.upload_failures = [429, None, 500, 502, 503, 504]
+        response = self.make_drive().upload_file(path)
+        self.assertUploaded(response, path)
+        self.assertEqual(StandInDrive.upload_failures, [])
+
+    def test_gives_up_after_max_retries(self):
+        path = self.make_file("doomed.bin")
+        drive = self.make_drive()
+        StandInDrive.upload_failures = [503] * (drive.MAX_RETRIES + 1)
+        with self.assertRaises(remote_storage.errors.HttpError):
+            drive.upload_file(path)
+
+    def test_resumes_interrupted_upload(self):
+        path = self.make_file("resumed.bin")
+        sessions = UploadSessions(os.path.join(self.work, "echo.sessions"))
+        drive = self.make_drive(sessions=sessions)
+        # The first chunk arrives, then the upload fails until it gives up
+        StandInDrive.upload_failures = [None] + [503] * (drive.MAX_RETRIES + 1)
+        with self.assertRaises(remote_storage.errors.HttpError):
+            drive.upload_file(path)
+        session = sessions.lookup(path)
+        self.assertIsNotNone(session)
+        self.assertGreater(session["offset"], 0)
+
+        # A new run picks up from the server's offset instead of starting again
+        received = StandInDrive.bytes_received
+        drive = self.make_drive(sessions=UploadSessions(os.path.join(self.work,
+                                                                     "echo.sessions")))
+        response = drive.upload_file(path)
+        self.assertUploaded(response, path)
+        self.assertLessEqual(StandInDrive.bytes_received - received,
+                             FILE_BYTES - session["offset"] + 64 * 1024)
+        self.assertIsNone(drive.sessions.lookup(path))
+
+    def test_failed_file_leaves_others_uploading(self):
+        good = [self.make_file("good" + str(index) + ".bin", 300 * 1024) for index in range(3)]
+        rejected = self.make_file("rejected.bin", 300 * 1024)
+        missing = os.path.join(self.work, "missing.bin")
+        StandInDrive.failing_names = {"rejected.bin"}
+        drive = self.make_drive()
+        drive.MAX_RETRIES = 1
+        responses = drive.upload_files([good[0], rejected, good[1], missing, good[2]],
+                                       workers=2)
+        self.assertIsNone(responses[rejected])
+        self.assertIsNone(responses[missing])
+        for path in good:
+            self.assertUploaded(responses[path], path)
+
+    def test_unexpected_error_leaves_workers_running(self):
+        paths = [self.make_file("file" + str(index) + ".bin", 1024) for index in range(4)]
+        drive = self.make_drive()
+        upload_file = drive.upload_file
+
+        def flaky_upload(file_path, *args):
+            if file_path == paths[1]:
+                raise RuntimeError("token revoked")
+            return upload_file(file_path, *args)
+        drive.upload_file = flaky_upload
+        scheduler = remote_storage.UploadScheduler(drive, 2)
+        for path in paths:
+            scheduler.submit(path, None)
+        responses = scheduler.drain()
+        self.assertIsNone(responses[paths[1]])
+        for path in paths[:1] + paths[2:]:
+            self.assertUploaded(responses[path], path)
+        # Both workers are still there for the next batch
+        scheduler.submit(paths[1], None)
+        drive.upload_file = upload_file
+        self.assertUploaded(scheduler.wait()[paths[1]], paths[1])
+
+    def test_ledger_skips_touched_compressed_file(self):
+        path = os.path.join(self.work, "telemetry.csv")
+        with open(path, "w") as csv_file:
+            csv_file.write("".join("%d,%d\n" % (row, row * row) for row in range(100000)))
+        drive = self.make_drive(ledger=UploadLedger(os.path.join(self.work, "echo.ledger")),
+                                compressor=compression.Compressor())
+        response = drive.upload_file(path)
+        self.assertLess(int(response["size"]), os.path.getsize(path))
+        entry = drive.ledger.lookup(path)
+        self.assertEqual(entry["md5"], file_md5(path))
+        self.assertEqual(entry["remote_md5"], response["md5Checksum"])
+
+        # Touched but unchanged: skipped, and Drive still has what was sent
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(drive.pending_uploads([path]), [])
+        self.assertEqual(drive.pending_uploads([path], verify=True), [])
+        # Sent again once compression is turned off
+        drive.compressor = None
+        self.assertEqual(drive.pending_uploads([path]), [path])
+
+    def test_outputs_not_compressed(self):
+        output = os.path.join(self.work, scanner.OUTPUT_FOLDER_PREFIX + "2024.01.01.0000")
+        os.makedirs(output)
+        compressor = compression.Compressor()
+        self.assertTrue(compressor.applies_to(os.path.join(self.work, "telemetry.csv")))
+        self.assertFalse(compressor.applies_to(os.path.join(output, "summary.csv")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Read files in 1 MiB pieces when hashing, so a large video is never held in memory
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+class UploadLedger:
+    """
+    UploadLedger remembers which local files have already been uploaded to
+    Google Drive, so that later runs only upload new or changed files.
+
+    Each entry records a file's size, modification time, MD5 checksum and Drive
+    file ID. A file compressed on its way to Drive also records the compression
+    settings, and the checksum of the compressed copy Drive holds. The ledger is written to disk after every change, so the record of
+    a partially completed run survives a crash.
+    """
+
+    ledger_path = None
+
+    def __init__(self, ledger_path):
+        """
+        Constructor
+
+        :param ledger_path: path to the JSON file the ledger is kept in
+        """
+        self.ledger_path = ledger_path
+        self.lock = threading.Lock()
+        self.entries = _read_json(ledger_path)
+
+    def lookup(self, file_path):
+        """
+        :param file_path: path to a local file
+        :returns: the ledger entry for the file as a dict, or None
+        """
+        with self.lock:
+            entry = self.entries.get(os.path.realpath(file_path))
+            return dict(entry) if entry is not None else None
+
+    def record(self, file_path, md5, file_id, encoding=None, remote_md5=None):
+        """
+        Record that a file has been uploaded (or confirmed unchanged)
+
+        :param file_path: path to the local file
+        :param md5: the file's MD5 checksum as a hex string, or None if unknown
+        :param file_id: the Drive ID of the uploaded file
+        :param encoding: how the file was encoded for upload (see
+        compression.Compressor.label), or None if it was sent as it is
+        :param remote_md5: the MD5 checksum of the copy on Drive, if it differs
+        from the file's (i.e. it was compressed)
+        """
+        stat = os.stat(file_path)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "md5": md5, "id": file_id}
+        if encoding is not None:
+            entry.update(encoding=encoding, remote_md5=remote_md5)
+        with self.lock:
+            self.entries[os.path.realpath(file_path)] = entry
+            self._save()
+
+    def forget(self, file_path):
+        """
+        Remove a file's entry, e.g. because the Drive copy has gone missing
+        """
+        with self.lock:
+            if self.entries.pop(os.path.realpath(file_path), None) is not None:
+                self._save()
+
+    def _save(self):
+        """
+        Write the ledger to disk. Must be called with the lock held
+        """
+        _write_json(self.ledger_path, self.entries)
+
+
+class UploadSessions:
+    """
+    UploadSessions keeps the resumable upload session of every unfinished
+    upload on disk, so an upload cut off by a crash or a dropped connection
+    can carry on from where it stopped on the next run.
+
+    Each entry records the session URI, the number of bytes the server has
+    confirmed, and the size and modification time the file had when the
+    session started. A session for a file that has since changed is discarded.
+    So is one that was sending the file with a different encoding (e.g.
+    compression settings), whose bytes wouldn't line up.
+    """
+
+    sessions_path = None
+
+    def __init__(self, sessions_path):
+        """
+        Constructor
+
+        :param sessions_path: path to the JSON file the sessions are kept in
+        """
+        self.sessions_path = sessions_path
+        self.lock = threading.Lock()
+        self.entries = _read_json(sessions_path)
+
+    def lookup(self, file_path, encoding=None):
+        """
+        :param file_path: path to a local file
+        :param encoding: how the file is being encoded for upload (see
+        compression.Compressor.label), or None if it is sent as it is
+        :returns: the saved session for the file as a dict with "uri" and
+        "offset" keys, or None if there is no usable session
+        """
+        stat = os.stat(file_path)
+        with self.lock:
+            entry = self.entries.get(os.path.realpath(file_path))
+            if entry is None:
+                return None
+            if (entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns or
+                    entry.get("encoding") != encoding):
+                del self.entries[os.path.realpath(file_path)]
+                self._save()
+                return None
+            return dict(entry)
+
+    def save(self, file_path, uri, offset, encoding=None):
+        """
+        Record the session URI of an upload and how much of it the server has
+
+        :param file_path: path to the local file
+        :param uri: the resumable session URI
+        :param offset: the number of bytes the server has confirmed
+        :param encoding: how the file is being encoded for upload, or None
+        """
+        stat = os.stat(file_path)
+        with self.lock:
+            self.entries[os.path.realpath(file_path)] = {
+                "uri": uri, "offset": offset, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                "encoding": encoding}
+            self._save()
+
+    def forget(self, file_path):
+        """
+        Remove a file's session, e.g. because the upload finished or expired
+        """
+        with self.lock:
+            if self.entries.pop(os.path.realpath(file_path), None) is not None:
+                self._save()
+
+    def _save(self):
+        """
+        Write the sessions to disk. Must be called with the lock held
+        """
+        _write_json(self.sessions_path, self.entries)
+
+
+class DiscoveryCache:
+    """
+    DiscoveryCache keeps API discovery documents on disk, so the Drive service
+    can be built without downloading and parsing a fresh copy every run.
+
+    Each entry records the URI the document came from, when it was fetched,
+    the version of the API client library that fetched it and the cache's own
+    FORMAT_VERSION. An entry is only used if all of those still match and it
+    is younger than max_age; otherwise it is fetched again. A document that
+    the client library then fails to build a service from should be forgotten.
+    """
+
+    FORMAT_VERSION = 1
+    MAX_AGE = 7 * 24 * 60 * 60
+    cache_path = None
+
+    def __init__(self, cache_path, max_age=MAX_AGE):
+        """
+        Constructor
+
+        :param cache_path: path to the JSON file the documents are kept in
+        :param max_age: the number of seconds a document is trusted for
+        """
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = _read_json(cache_path)
+
+    def lookup(self, uri, client_version):
+        """
+        :param uri: the discovery URI the document comes from
+        :param client_version: the version of the API client library in use
+        :returns: the cached document as a string, or None if there is no
+        usable copy
+        """
+        with self.lock:
+            entry = self.entries.get(uri)
+            if (entry is None or entry.get("format") != self.FORMAT_VERSION or
+                    entry.get("client") != client_version or
+                    not 0 <= time.time() - entry.get("fetched", 0) < self.max_age):
+                return None
+            return entry["document"]
+
+    def save(self, uri, client_version, document):
+        """
+        Store a freshly fetched discovery document
+
+        :param uri: the discovery URI the document came from
+        :param client_version: the version of the API client library in use
+        :param document: the document as a string
+        """
+        with self.lock:
+            self.entries[uri] = {"format": self.FORMAT_VERSION, "client": client_version,
+                                 "fetched": time.time(), "document": document}
+            self._save()
+
+    def forget(self, uri):
+        """
+        Remove a document, e.g. because a service couldn't be built from it
+        """
+        with self.lock:
+            if self.entries.pop(uri, None) is not None:
+                self._save()
+
+    def _save(self):
+        """
+        Write the documents to disk. Must be called with the lock held
+        """
+        _write_json(self.cache_path, self.entries)
+
+
+def _read_json(path):
+    """
+    Read a JSON object from a file, returning an empty dict if it is missing or
+    unreadable
+    """
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    """
+    Atomically write an object to a file as JSON
+    """
+    with open(path + ".tmp", "w") as json_file:
+        json.dump(data, json_file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def file_md5(file_path):
+    """
+    Compute the MD5 checksum of a file, reading it a block at a time
+
+    :param file_path: path to the file
+    :returns: the checksum as a hex string
+    """
+    digest = hashlib.md5()
+    with open(file_path, "rb") as hash_file:
+        for block in iter(lambda: hash_file.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
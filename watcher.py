@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# pylint: disable-msg=C0103
+"""
+BURPG Echo
+See LICENSE for MIT/X11 license info.
+See README.md for all other help.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import scanner
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirectoryWatcher:
+    """
+    DirectoryWatcher waits for telemetry and video files under a search path to
+    be created or changed, and hands them over once they have stopped changing.
+
+    On Linux it is woken by inotify, so a new file is noticed at once without
+    rescanning the tree. Elsewhere (or if inotify is unavailable) it rescans
+    the tree every poll_interval seconds. Either way, a file is only reported
+    after its size and modification time have held still for settle_seconds,
+    so a CSV the DAQ is still appending to, or a video that is still recording,
+    isn't processed half-written.
+    """
+
+    DEFAULT_SETTLE_SECONDS = 5.0
+    DEFAULT_POLL_INTERVAL = 2.0
+    KINDS = (scanner.DATA, scanner.VIDEO, scanner.T0)
+
+    def __init__(self, logger, path, known_entries=(), settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        Constructor
+
+        :param logger: the Logger to report activity to
+        :param path: the directory to watch
+        :param known_entries: FileEntry tuples for files that are already
+        processed, which are only reported again if they change
+        :param settle_seconds: how long a file must stay unchanged
+        :param poll_interval: how often to rescan (or re-check settling files)
+        """
+        self.logger = logger
+        self.path = path
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.known = {entry.path: (entry.size, entry.mtime) for entry in known_entries}
+        # path -> (size, mtime, time the file was last seen to change)
+        self.settling = {}
+        self.inotify = _Inotify.create(path)
+        if self.inotify is None:
+            self.logger.log_verbose("inotify unavailable, polling every " +
+                                    str(poll_interval) + "s")
+        self.last_scan = 0.0
+
+    def wait_for_changes(self):
+        """
+        Block until at least one new or changed file has settled
+
+        :returns: a list of FileEntry tuples for the settled files
+        """
+        while True:
+            if self.inotify is None:
+                if time.time() - self.last_scan >= self.poll_interval:
+                    self._poll()
+                time.sleep(min(self.poll_interval, self.settle_seconds / 2))
+            else:
+                timeout = self.poll_interval if not self.settling else \
+                    min(self.poll_interval, self.settle_seconds / 2)
+                changed, overflowed = self.inotify.read(timeout)
+                if overflowed:
+                    self._poll()
+                for file_path in changed:
+                    self._observe(file_path)
+            ready = self._settled()
+            if ready:
+                return ready
+
+    def close(self):
+        """
+        Stop watching and release the inotify descriptor
+        """
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def _poll(self):
+        """
+        Rescan the whole tree and look at every file that differs from what is known
+        """
+        self.last_scan = time.time()
+        for entry in scanner.scan(self.path).entries:
+            if self.known.get(entry.path) != (entry.size, entry.mtime):
+                self._observe(entry.path)
+
+    def _observe(self, file_path):
+        """
+        Note a file that may have changed, restarting its settling timer if it did
+        """
+        if scanner.classify(os.path.basename(file_path)) not in self.KINDS:
+            return
+        folders = os.path.relpath(os.path.dirname(file_path), self.path).split(os.sep)
+        if any(scanner.is_output_folder(folder) for folder in folders):
+            return
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.settling.pop(file_path, None)
+            return
+        state = (stat.st_size, stat.st_mtime)
+        if self.known.get(file_path) == state:
+            self.settling.pop(file_path, None)
+            return
+        previous = self.settling.get(file_path)
+        if previous is None or previous[:2] != state:
+            self.settling[file_path] = state + (time.time(),)
+
+    def _settled(self):
+        """
+        Re-check every settling file and pull out the ones that have held still
+
+        :returns: a list of FileEntry tuples
+        """
+        ready = []
+        now = time.time()
+        for file_path in list(self.settling):
+            self._observe(file_path)
+            state = self.settling.get(file_path)
+            if state is None or now - state[2] < self.settle_seconds:
+                continue
+            del self.settling[file_path]
+            self.known[file_path] = state[:2]
+            kind = scanner.classify(os.path.basename(file_path))
+            ready.append(scanner.FileEntry(file_path, state[0], state[1], kind))
+            self.logger.log_verbose("File settled: " + file_path)
+        return sorted(ready, key=lambda entry: entry.path)
+
+
+class _Inotify:
+    """
+    A minimal recursive inotify watch, driven through ctypes
+    """
+
+    def __init__(self, libc, descriptor):
+        self.libc = libc
+        self.descriptor = descriptor
+        self.directories = {}
+
+    @classmethod
+    def create(cls, path):
+        """
+        Start watching a directory tree
+
+        :returns: an _Inotify, or None if inotify isn't available here
+        """
+        library = ctypes.util.find_library("c")
+        if library is None:
+            return None
+        try:
+            libc = ctypes.CDLL(library, use_errno=True)
+            descriptor = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if descriptor < 0:
+            return None
+        watch = cls(libc, descriptor)
+        watch.add_tree(path)
+        return watch
+
+    def add_tree(self, path):
+        """
+        Watch a directory and every directory under it, except Echo's own
+        output folders
+        """
+        self._add(path)
+        for subdir, dirs, _ in os.walk(path):
+            dirs[:] = [name for name in dirs if not scanner.is_output_folder(name)]
+            for name in dirs:
+                self._add(os.path.join(subdir, name))
+
+    def _add(self, path):
+        watch_id = self.libc.inotify_add_watch(self.descriptor, os.fsencode(path), WATCH_MASK)
+        if watch_id >= 0:
+            self.directories[watch_id] = path
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds for events
+
+        :returns: a tuple of (list of file paths that changed, True if the kernel
+        dropped events and the caller should rescan)
+        """
+        changed = []
+        overflowed = False
+        readable, _, _ = select.select([self.descriptor], [], [], timeout)
+        if not readable:
+            return changed, overflowed
+        try:
+            buffer = os.read(self.descriptor, 64 * 1024)
+        except BlockingIOError:
+            return changed, overflowed
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            watch_id, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            directory = self.directories.get(watch_id)
+            if directory is None or not name:
+                continue
+            event_path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if scanner.is_output_folder(name):
+                    continue
+                # A new directory: watch it, and pick up anything already in it
+                self.add_tree(event_path)
+                for entry in scanner.scan(event_path).entries:
+                    changed.append(entry.path)
+            else:
+                changed.append(event_path)
+        return changed, overflowed
+
+    def close(self):
+        """
+        Close the inotify descriptor
+        """
+        os.close(self.descriptor)